@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+description = '''
+Run the memory-mapped engine of DPGP_seq_to_SNP.py on several chromosome arms
+at once, and/or on several position ranges of each arm, using a pool of processes.
+The output for each arm is identical to that of
+
+    python DPGP_seq_to_SNP.py *.seq > output
+
+For one arm:
+
+    python DPGP_parallel_seq_to_SNP.py -j 32 -o output *.seq
+
+For all arms, with the .seq files for arm X found by substituting X for {arm} in the pattern:
+
+    python DPGP_parallel_seq_to_SNP.py -j 32 -a 2L 2R 3L 3R X \\
+        -p "data/*_Chr{arm}.seq" -o "all_sample_seqs_Chr{arm}_with_SNP_Pos"
+
+Each arm is split into slices of --slice_size positions; each slice is written
+to a temporary file, and these are concatenated in position order at the end.
+With --binary, --outfile is instead the prefix of a binary genotype store
+(see DPGP_seq_to_SNP.py and pylostruct/genobin.py), and with --recode the
+genotypes are recoded as by lostruct::recode_numeric() (see DPGP_seq_to_SNP.py).
+The number of positions and SNPs in each slice, and the rate at which they were
+processed, are reported to stderr.
+'''
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import multiprocessing
+
+from DPGP_seq_to_SNP import SeqMaps, seq_names, mmap_seq_to_snp, binary_seq_to_snp
+from pylostruct.genobin import concatenate_genobin
+
+
+def slice_file(outfile, start):
+    return "{}.part{:012d}".format(outfile, start)
+
+
+def per_sec(n, seconds):
+    return "{:.0f}".format(n / seconds) if seconds > 0 else "NA"
+
+
+def convert_slice(task):
+    arm, fns, outfile, start, end, binary, opts = task
+    t0 = time.perf_counter()
+    if binary:
+        nsnps = binary_seq_to_snp(fns, slice_file(outfile, start),
+                                  start=start, end=end, header=False, **opts)
+    else:
+        with open(slice_file(outfile, start), "wb") as out:
+            nsnps = mmap_seq_to_snp(fns, out=out,
+                                    start=start, end=end, header=False, **opts)
+    return arm, start, end, nsnps, time.perf_counter() - t0
+
+
+def merge_slices(fns, outfile, starts, binary=False, ploidy=1):
+    if binary:
+        concatenate_genobin(outfile, [slice_file(outfile, start) for start in sorted(starts)],
+                            seq_names(fns, ploidy))
+        return
+    with open(outfile, "wb") as out:
+        out.write(("\t".join(seq_names(fns, ploidy)) + "\n").encode())
+        for start in sorted(starts):
+            part = slice_file(outfile, start)
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+            os.remove(part)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("seqfiles", nargs="*", help=".seq files, one per sample (if not using --arms)")
+    parser.add_argument("--arms", "-a", nargs="*", dest="arms",
+            help="names of chromosome arms, substituted for {arm} in --pattern and --outfile")
+    parser.add_argument("--pattern", "-p", type=str, dest="pattern",
+            help="glob matching the .seq files for each arm, containing {arm}")
+    parser.add_argument("--outfile", "-o", type=str, dest="outfile",
+            help="name of output file (containing {arm}, if using --arms)")
+    parser.add_argument("--slice_size", "-s", type=int, dest="slice_size", default=1000000,
+            help="number of positions per parallel task [default: %(default)s]")
+    parser.add_argument("--chunk_size", "-c", type=int, dest="chunk_size", default=1000000,
+            help="number of positions each task processes at once [default: %(default)s]")
+    parser.add_argument("--binary", "-b", action="store_true", dest="binary",
+            help="write binary genotype stores, with --outfile as the prefix")
+    parser.add_argument("--recode", "-r", action="store_true", dest="recode",
+            help="write numeric genotypes, as lostruct::recode_numeric")
+    parser.add_argument("--ploidy", "-P", type=int, dest="ploidy", default=1,
+            help="number of consecutive .seq files per individual, with --recode [default: %(default)s]")
+    parser.add_argument("--no_triallelic", action="store_false", dest="triallelic",
+            help="with --recode, set sites with more than two alleles to NA (as triallelic=FALSE)")
+    parser.add_argument("--njobs", "-j", type=int, dest="njobs", default=1,
+            help="number of parallel jobs [default: %(default)s]")
+    args = parser.parse_args()
+
+    if args.outfile is None:
+        parser.error("Must specify --outfile.")
+    if args.arms:
+        if args.pattern is None or "{arm}" not in args.pattern or "{arm}" not in args.outfile:
+            parser.error("With --arms, --pattern and --outfile must both contain '{arm}'.")
+        arm_files = {arm: sorted(glob.glob(args.pattern.format(arm=arm))) for arm in args.arms}
+        outfiles = {arm: args.outfile.format(arm=arm) for arm in args.arms}
+    else:
+        if len(args.seqfiles) == 0:
+            parser.error("Must specify either .seq files or --arms.")
+        arm_files = {"": args.seqfiles}
+        outfiles = {"": args.outfile}
+
+    opts = {'chunk_size': args.chunk_size, 'recode': args.recode,
+            'ploidy': args.ploidy, 'triallelic': args.triallelic}
+    tasks = []
+    for arm, fns in arm_files.items():
+        if len(fns) == 0:
+            raise ValueError("No .seq files found for arm " + arm + ".")
+        with SeqMaps(fns) as seqs:
+            length = seqs.length
+        for start in range(0, length, args.slice_size):
+            end = min(length, start + args.slice_size)
+            tasks.append((arm, fns, outfiles[arm], start, end, args.binary, opts))
+
+    sys.stderr.write("arm\tstart\tend\tsnps\tseconds\tpositions_per_sec\tsnps_per_sec\n")
+    t0 = time.time()
+    starts = {arm: [] for arm in arm_files}
+    pool = multiprocessing.Pool(args.njobs)
+    for arm, start, end, nsnps, elapsed in pool.imap_unordered(convert_slice, tasks):
+        starts[arm].append(start)
+        sys.stderr.write("{}\t{}\t{}\t{}\t{:.2f}\t{}\t{}\n".format(
+            arm, start + 1, end, nsnps, elapsed, per_sec(end - start, elapsed), per_sec(nsnps, elapsed)))
+        sys.stderr.flush()
+    pool.close()
+    pool.join()
+
+    for arm, fns in arm_files.items():
+        merge_slices(fns, outfiles[arm], starts[arm], binary=args.binary,
+                     ploidy=args.ploidy if args.recode else 1)
+    sys.stderr.write("Done: {} slices in {:.2f} seconds.\n".format(len(tasks), time.time() - t0))
+
+
+if __name__ == '__main__':
+    main()
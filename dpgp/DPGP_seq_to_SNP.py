@@ -1,16 +1,49 @@
 """
 python script.py *.seq > output
+python script.py --mmap [--chunk_size 1000000] *.seq > output
+python script.py --binary PREFIX *.seq
+python script.py --recode [--ploidy 1] [--no_triallelic] [--binary PREFIX] *.seq
+
+Writes one row per polymorphic site (at least two distinct non-N characters),
+giving the 1-based position followed by the character of every sequence,
+with a header line of sequence names.
+
+With --mmap, each .seq file is memory-mapped as raw bytes and the sequences are
+stacked into a (samples x positions) uint8 block, one chunk of positions at a time,
+so memory use is bounded by (number of samples) * (chunk size).
+The output is identical to that of the default mode.
+
+With --binary, the same sites are instead written with the memory-mapped engine
+to the binary store PREFIX.geno, PREFIX.pos, PREFIX.samples
+(see pylostruct/genobin.py for the layout), with alleles coded as
+A=0, C=1, G=2, T=3, and anything else as missing.
+
+With --recode, the alleles are instead recoded as they would be by
+lostruct::recode_numeric(x, ploidy, triallelic) before being written (as text,
+with "NA" for missing, or to the binary store), with one column per individual
+giving the number of minor alleles; each ploidy consecutive .seq files are
+taken to be one individual, named by the first.
 """
 
-from sys import argv, stdout
+import os
+import sys
+import mmap
+import argparse
+from sys import stdout
 
-d = []
-fns = []
-for fn in argv[1:]:
-    with open(fn) as f:
-        line = f.readline().rstrip()
-    fns.append(fn[:-4])
-    d.append(list(line))
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pylostruct.genobin import GenoBinWriter, NA_INT8
+from pylostruct.recode import recode_numeric, numeric_text_rows
+
+N_BYTE = ord("N")
+
+ALLELES = "ACGT"
+# lookup table from characters to allele codes
+ALLELE_CODES = np.full(256, NA_INT8, dtype=np.int8)
+for k, a in enumerate(ALLELES):
+    ALLELE_CODES[ord(a)] = k
 
 
 def util(v, j, out=stdout):
@@ -26,7 +59,198 @@ def util(v, j, out=stdout):
             return
 
 
-stdout.write("\t".join(fns) + "\n")
+def seq_names(fns, ploidy=1):
+    return [fn[:-4] for fn in fns[::ploidy]]
+
+
+def text_seq_to_snp(fns, out=stdout):
+    d = []
+    for fn in fns:
+        with open(fn) as f:
+            line = f.readline().rstrip()
+        d.append(list(line))
+    out.write("\t".join(seq_names(fns)) + "\n")
+    for i in range(len(d[0])):
+        util([j[i] for j in d], i+1, out=out)
+
+
+class SeqMaps(object):
+    '''
+    Memory-mapped view of a collection of .seq files, each of which is a single
+    line of characters; only the first line of each file is used.
+    '''
+
+    def __init__(self, fns):
+        self.fns = list(fns)
+        self._files = []
+        self.maps = []
+        self.lengths = []
+        for fn in self.fns:
+            f = open(fn, "rb")
+            # an empty file cannot be mapped
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b""
+            self._files.append(f)
+            self.maps.append(m)
+            end = m.find(b"\n")
+            if end < 0:
+                end = len(m)
+            # match str.rstrip() on the first line
+            while end > 0 and m[end-1:end].isspace():
+                end -= 1
+            self.lengths.append(end)
+        self.length = self.lengths[0]
+        for fn, n in zip(self.fns, self.lengths):
+            if n < self.length:
+                raise ValueError("Sequence in " + fn + " is shorter than that in " + self.fns[0] + ".")
+
+    def block(self, start, end, out=None):
+        '''
+        Return the (samples x positions) uint8 array of characters at 0-based
+        positions start, ..., end-1.
+        '''
+        if out is None:
+            out = np.empty((len(self.maps), end - start), dtype=np.uint8)
+        for k, m in enumerate(self.maps):
+            out[k] = np.frombuffer(m, dtype=np.uint8, count=end-start, offset=start)
+        return out
+
+    def close(self):
+        for m in self.maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def polymorphic_columns(block):
+    '''
+    Indices of the columns of a uint8 character block that have at least two
+    distinct characters other than "N".
+    '''
+    is_n = (block == N_BYTE)
+    lo = np.where(is_n, 255, block).min(axis=0)
+    hi = np.where(is_n, 0, block).max(axis=0)
+    return np.flatnonzero(lo < hi)
+
+
+def format_rows(block, cols, start):
+    '''
+    Format the rows of output for the given columns of a character block, whose
+    first column is at 0-based position start, as bytes.
+    '''
+    nsamples = block.shape[0]
+    rows = np.empty((len(cols), 2 * nsamples + 1), dtype=np.uint8)
+    rows[:, 0:-1:2] = ord("\t")
+    rows[:, 1:-1:2] = block[:, cols].T
+    rows[:, -1] = ord("\n")
+    return b"".join(str(start + j + 1).encode() + r.tobytes() for j, r in zip(cols, rows))
+
+
+def recode_block(block, cols, ploidy=1, triallelic=True):
+    '''
+    The recoded (sites x individuals) int8 genotypes at the given columns of a
+    character block; see pylostruct.recode.recode_numeric().
+    '''
+    return recode_numeric(ALLELE_CODES[block[:, cols].T], ploidy=ploidy,
+                          triallelic=triallelic, nalleles=len(ALLELES))
+
+
+def snp_blocks(seqs, chunk_size, start, end):
+    '''
+    Iterate over chunks of at most chunk_size positions of the SeqMaps seqs
+    between 0-based positions start and end, yielding for each chunk that has
+    any polymorphic sites the 0-based position of its first column, the
+    character block, and the indices of the polymorphic columns.
+    The block is overwritten by the next iteration.
+    '''
+    buf = np.empty((len(seqs.maps), chunk_size), dtype=np.uint8)
+    for a in range(start, end, chunk_size):
+        b = min(end, a + chunk_size)
+        block = seqs.block(a, b, out=buf[:, :b-a])
+        cols = polymorphic_columns(block)
+        if len(cols) > 0:
+            yield a, block, cols
+
+
+def mmap_seq_to_snp(fns, out=None, chunk_size=1000000, start=0, end=None, header=True,
+                    recode=False, ploidy=1, triallelic=True):
+    '''
+    Write the polymorphic sites found between 0-based positions start and end
+    to the binary stream out, reading chunk_size positions at a time;
+    if recode is True, write numeric genotypes (see recode_block()) instead.
+    Returns the number of sites written.
+    '''
+    if out is None:
+        out = stdout.buffer
+    nsnps = 0
+    with SeqMaps(fns) as seqs:
+        if end is None or end > seqs.length:
+            end = seqs.length
+        if header:
+            out.write(("\t".join(seq_names(fns, ploidy if recode else 1)) + "\n").encode())
+        for a, block, cols in snp_blocks(seqs, chunk_size, start, end):
+            if recode:
+                prefixes = [str(a + j + 1).encode() + b"\t" for j in cols]
+                out.write(numeric_text_rows(prefixes, recode_block(block, cols, ploidy, triallelic)))
+            else:
+                out.write(format_rows(block, cols, a))
+            nsnps += len(cols)
+    return nsnps
+
+
+def binary_seq_to_snp(fns, prefix, chunk_size=1000000, start=0, end=None, header=True,
+                      recode=False, ploidy=1, triallelic=True):
+    '''
+    As mmap_seq_to_snp(), but writes the sites to the binary store with the
+    given prefix, with alleles coded by ALLELE_CODES (or recoded, if recode is True);
+    the .samples file is only written if header is True.
+    Returns the number of sites written.
+    '''
+    with SeqMaps(fns) as seqs:
+        if end is None or end > seqs.length:
+            end = seqs.length
+        samples = seq_names(fns, ploidy if recode else 1) if header else None
+        with GenoBinWriter(prefix, samples=samples) as writer:
+            for a, block, cols in snp_blocks(seqs, chunk_size, start, end):
+                if recode:
+                    geno = recode_block(block, cols, ploidy, triallelic)
+                else:
+                    geno = ALLELE_CODES[block[:, cols].T]
+                writer.write(a + cols + 1, geno)
+            return writer.nsites
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("seqfiles", nargs="+", help=".seq files, one per sample")
+    parser.add_argument("--mmap", action="store_true", dest="mmap",
+            help="use the memory-mapped, vectorized engine")
+    parser.add_argument("--chunk_size", "-c", type=int, dest="chunk_size", default=1000000,
+            help="number of positions to process at once with --mmap [default: %(default)s]")
+    parser.add_argument("--binary", "-b", type=str, dest="binary",
+            help="write a binary genotype store with this prefix instead of text to stdout")
+    parser.add_argument("--recode", "-r", action="store_true", dest="recode",
+            help="write numeric genotypes, as lostruct::recode_numeric (implies --mmap)")
+    parser.add_argument("--ploidy", "-P", type=int, dest="ploidy", default=1,
+            help="number of consecutive .seq files per individual, with --recode [default: %(default)s]")
+    parser.add_argument("--no_triallelic", action="store_false", dest="triallelic",
+            help="with --recode, set sites with more than two alleles to NA (as triallelic=FALSE)")
+    args = parser.parse_args()
+
+    recode_args = {'recode': args.recode, 'ploidy': args.ploidy, 'triallelic': args.triallelic}
+    if args.binary is not None:
+        binary_seq_to_snp(args.seqfiles, args.binary, chunk_size=args.chunk_size, **recode_args)
+    elif args.mmap or args.recode:
+        mmap_seq_to_snp(args.seqfiles, chunk_size=args.chunk_size, **recode_args)
+    else:
+        text_seq_to_snp(args.seqfiles)
+
 
-for i in range(len(d[0])):
-    util([j[i] for j in d], i+1)
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,78 @@
 
 """
 python  VCF.py  VCF_file_name  >  output
+python  VCF.py  --binary PREFIX  VCF_file_name
+python  VCF.py  --recode [--no_triallelic] [--binary PREFIX]  VCF_file_name
+python  VCF.py  --batched [--block_size 64] [--throughput]  VCF_file_name  >  output
+python  VCF.py  [--batched]  VCF_file_name.vcf.gz  [--regions chrom:start-end [...]]  >  output
+python  VCF.py  [--njobs 8]  VCF_file_name  >  output
+python  VCF.py  --checkpoint CHECKPOINT  --outfile output  [--resume]  VCF_file_name
+
+Writes POS, ID, and then the two alleles of the GT field of each sample.
+With --binary, instead writes the alleles (as integers, with "." missing)
+to the binary store PREFIX.geno, PREFIX.pos, PREFIX.samples
+(see pylostruct/genobin.py for the layout), with one column per allele,
+named SAMPLE_1 and SAMPLE_2.
+With --recode, the alleles are instead recoded as they would be by
+lostruct::recode_numeric(x, ploidy=2, triallelic, alleles=as.character(0:3))
+(i.e., as the number of minor alleles carried by each sample, with "NA" for missing)
+before being written, after POS and ID or to the binary store.
+
+With --batched, the file is read in blocks of --block_size megabytes, the GT
+alleles of all lines in a block are extracted at once with NumPy, and the
+output of each block is written at once; the output is identical to the default.
+Lines that the vectorized parser cannot vouch for are handled one at a time
+as in the default mode (so, e.g., a malformed GT field still stops the conversion).
+With --throughput, the number of sites per second is reported to stderr.
+
+With --njobs N, the data lines are split into --nshards pieces at line
+boundaries (at BGZF block boundaries, for bgzipped input), which are converted
+as with --batched by N worker processes and concatenated in their original
+order; the header is read only once, by the main process.  The output is
+identical to the serial output.
+
+With --checkpoint, the conversion is done as with --batched, but to --outfile
+(or the --binary store), and every --checkpoint_interval seconds the input
+offset reached, the length of the output so far, and the number of sites are
+recorded in the checkpoint file.  Lines that cannot be converted are written to
+the --quarantine file instead of stopping the conversion.  If the conversion is
+interrupted, running the same command with --resume truncates the output (and
+quarantine) to their checkpointed lengths and continues from the checkpointed
+offset.  For example:
+
+python  VCF.py  --checkpoint out.ckpt --outfile out.txt  [--resume]  VCF_file_name
+
+The VCF file may be bgzipped, in which case it is decompressed in a
+background thread while being parsed.  If it also has a tabix (.tbi) or CSI
+(.csi) index, then --regions restricts the output to records whose CHROM and
+POS fall in the given regions (as "chrom", "chrom:start" or "chrom:start-end",
+1-based and inclusive), read by seeking to the relevant blocks.
 """
 
 
 
-from sys import argv, stdout, stderr
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+from sys import stdout, stderr
 
+import numpy as np
 
-def _util(line, w=stdout):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pylostruct.genobin import GenoBinWriter, NA_INT8, concatenate_genobin, genobin_files
+from pylostruct.recode import recode_numeric, numeric_text_rows
+from pylostruct.bgzf import BgzfReader, BgzfIndex, is_bgzf, find_index, parse_region, region_lines, \
+        block_offsets
+
+
+def _format(line):
     items = line.rstrip().split("\t")
     out = [items[1], items[2]]
     for i in items[9:]:
@@ -19,28 +83,845 @@ def _util(line, w=stdout):
         assert len(temp) == 3
         out.append(temp[0])
         out.append(temp[-1])
-    w.write("\t".join(out) + "\n")
+    return "\t".join(out) + "\n"
+
+
+def _util(line, w=stdout):
+    w.write(_format(line))
     w.flush()
     return
 
 
+class _BatchUtil(object):
+    '''
+    Parses lines as _util() does, but collects the positions and alleles of
+    batch_size sites at a time, to recode and/or write to a GenoBinWriter
+    (or, if writer is None, as text to w).
+    '''
+
+    def __init__(self, writer=None, recode=False, triallelic=True, w=stdout, batch_size=10000):
+        self.writer = writer
+        self.recode = recode
+        self.triallelic = triallelic
+        self.w = w
+        self.batch_size = batch_size
+        self.codes = {str(k): k for k in range(10)}
+        self.prefixes = []
+        self.positions = []
+        self.rows = []
+
+    def __call__(self, line):
+        items = line.rstrip().split("\t")
+        row = []
+        for i in items[9:]:
+            temp = i.split(":")[0]
+            assert len(temp) == 3
+            row.append(self.codes.get(temp[0], NA_INT8))
+            row.append(self.codes.get(temp[-1], NA_INT8))
+        self.positions.append(int(items[1]))
+        self.prefixes.append((items[1] + "\t" + items[2] + "\t").encode())
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def block(self, gt):
+        '''
+        Add the sites in a GTBlock.
+        '''
+        prefixes = gt.prefixes()
+        self.positions.extend(int(p.split(b"\t", 1)[0]) for p in prefixes)
+        self.prefixes.extend(prefixes)
+        self.rows.extend(gt.codes())
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) > 0:
+            geno = np.array(self.rows, dtype=np.int8)
+            if self.recode:
+                geno = recode_numeric(geno, ploidy=2, triallelic=self.triallelic, nalleles=4)
+            if self.writer is None:
+                self.w.write(numeric_text_rows(self.prefixes, geno).decode())
+                self.w.flush()
+            else:
+                self.writer.write(self.positions, geno)
+        self.prefixes = []
+        self.positions = []
+        self.rows = []
+
+
+class _TextSink(object):
+    '''
+    Writes the default output for lines and GTBlocks to the binary stream w.
+    '''
+
+    def __init__(self, w):
+        self.w = w
+
+    def __call__(self, line):
+        self.w.write(_format(line).encode())
+
+    def block(self, gt):
+        self.w.write(gt.text())
+
+    def flush(self):
+        self.w.flush()
+
+
+# allele characters to integer codes
+GT_CODES = np.full(256, NA_INT8, dtype=np.int8)
+for _k in range(10):
+    GT_CODES[ord(str(_k))] = _k
+
+# bytes that end a GT field
+_GT_END = np.zeros(256, dtype=bool)
+_GT_END[[ord(":"), ord("\t"), ord("\n")]] = True
+
+# bytes that str.rstrip() might remove (or that might be part of a multibyte space)
+_STRIPPABLE = np.array([chr(c).isspace() for c in range(128)] + [True] * 128)
+
+_TAB, _NEWLINE, _CR = ord("\t"), ord("\n"), ord("\r")
+
+
+class GTBlock(object):
+    '''
+    The POS and ID fields, and the GT alleles, of a block of consecutive lines
+    of a VCF file.  For the k-th line, data[prefix_start[k]:prefix_end[k]] is
+    "POS<tab>ID", and alleles[k] holds the first and last characters of the
+    GT field of each sample.
+    '''
+
+    def __init__(self, data, prefix_start, prefix_end, alleles):
+        self.data = data
+        self.prefix_start = prefix_start
+        self.prefix_end = prefix_end
+        self.alleles = alleles
+
+    def __len__(self):
+        return len(self.prefix_start)
+
+    def text(self):
+        '''
+        The lines of default output for these sites, as bytes.
+        '''
+        nlines = len(self)
+        width = 2 * self.alleles.shape[1] + 1
+        fixed = np.empty((nlines, width), dtype=np.uint8)
+        fixed[:, 0:-1:2] = _TAB
+        fixed[:, 1:-1:2] = self.alleles
+        fixed[:, -1] = _NEWLINE
+        plen = self.prefix_end - self.prefix_start
+        out_start = np.cumsum(plen + width) - (plen + width)
+        out = np.empty(plen.sum() + nlines * width, dtype=np.uint8)
+        # copy the variable-length prefixes, then the fixed-width remainders
+        offsets = np.arange(plen.sum()) - np.repeat(np.cumsum(plen) - plen, plen)
+        out[np.repeat(out_start, plen) + offsets] = self.data[np.repeat(self.prefix_start, plen) + offsets]
+        out[(out_start + plen)[:, np.newaxis] + np.arange(width)] = fixed
+        return out.tobytes()
+
+    def prefixes(self):
+        '''
+        The "POS<tab>ID<tab>" of each line, as bytes.
+        '''
+        return [self.data[a:b].tobytes() + b"\t"
+                for a, b in zip(self.prefix_start.tolist(), self.prefix_end.tolist())]
+
+    def lines(self, a, b):
+        '''
+        The GTBlock of lines a to b-1.
+        '''
+        return GTBlock(self.data, self.prefix_start[a:b], self.prefix_end[a:b], self.alleles[a:b])
+
+    def codes(self):
+        return GT_CODES[self.alleles]
+
+
+def extract_block(data, ntabs):
+    '''
+    Parse the lines in data (a uint8 array ending in a newline), returning a
+    GTBlock of all of them, a boolean array that says which lines have ntabs
+    tabs and well-formed GT fields, and would not have their output changed by
+    the stripping of trailing whitespace (the GTBlock is meaningless for the
+    others), and the offset of the newline ending each line.
+    '''
+    nsamples = ntabs - 8
+    ends = np.flatnonzero(data == _NEWLINE)
+    tabs = np.flatnonzero(data == _TAB)
+    if nsamples < 1 or len(tabs) == 0:
+        return None, np.zeros(len(ends), dtype=bool), ends
+    tab_end = np.searchsorted(tabs, ends)
+    tab_start = np.concatenate([[0], tab_end[:-1]])
+    ok = (tab_end - tab_start == ntabs)
+    # lines with the wrong number of tabs get some other line's tabs
+    line_tabs = tabs[np.minimum(tab_start[:, np.newaxis] + np.arange(ntabs), len(tabs) - 1)]
+    starts = line_tabs[:, 8:] + 1
+    # the final byte of data is a newline, which ends any field that runs past it
+    last = len(data) - 1
+    gt = [data[np.minimum(starts + k, last)] for k in range(4)]
+    ok &= ~(_GT_END[gt[0]] | _GT_END[gt[1]] | _GT_END[gt[2]]).any(axis=1)
+    ok &= _GT_END[gt[3]].all(axis=1)
+    ok &= ~_STRIPPABLE[data[ends - 1]]
+    ok[np.searchsorted(ends, np.flatnonzero(data == _CR))] = False
+    alleles = np.empty((len(ends), 2 * nsamples), dtype=np.uint8)
+    alleles[:, 0::2] = gt[0]
+    alleles[:, 1::2] = gt[2]
+    block = GTBlock(data, line_tabs[:, 0] + 1, line_tabs[:, 2], alleles)
+    return block, ok, ends
+
+
+class Throughput(object):
+    '''
+    Counts sites, reporting the rate to stream every interval seconds and at the end.
+    '''
+
+    def __init__(self, stream=stderr, interval=60):
+        self.stream = stream
+        self.interval = interval
+        self.nsites = 0
+        self.start = self.last = time.time()
+
+    def update(self, n):
+        self.nsites += n
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = max(now - self.start, 1e-9)
+        self.stream.write("{} sites in {:.1f} seconds: {:.0f} sites/sec\n".format(
+            self.nsites, elapsed, self.nsites / elapsed))
+        self.stream.flush()
+
+
+class _NoThroughput(object):
+
+    def update(self, n):
+        pass
+
+    def report(self):
+        pass
+
+
+class BadLine(Exception):
+    '''
+    Raised with the text of a line that could not be converted.
+    '''
+
+    def __init__(self, line):
+        super(BadLine, self).__init__(line)
+        self.line = line
+
+
+class Quarantine(object):
+    '''
+    Appends lines that could not be converted to the file path,
+    which is first truncated to nbytes bytes (and so to nlines lines).
+    '''
+
+    def __init__(self, path, nbytes=0, nlines=0):
+        self.path = path
+        self.nlines = nlines
+        if os.path.exists(path):
+            os.truncate(path, nbytes)
+        self.f = open(path, "ab")
+
+    def __call__(self, line):
+        self.f.write(line.encode())
+        self.nlines += 1
+
+    def tell(self):
+        '''
+        The length of the file, once what has been written has reached the disk.
+        '''
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+def _slow_lines(raw, util, quarantine=None):
+    '''
+    Convert the bytes raw, line by line as text mode would read them, with
+    util; on error, pass the offending line to quarantine or, if that is None,
+    raise BadLine with it.  Returns the number of lines converted.
+    '''
+    n = 0
+    for line in io.TextIOWrapper(io.BytesIO(raw)):
+        try:
+            util(line)
+        except Exception as e:
+            if quarantine is None:
+                raise BadLine(line)
+            quarantine(line)
+            continue
+        n += 1
+    return n
+
+
+def convert_lines(buf, ntabs, util, counter, quarantine=None):
+    '''
+    Convert the complete lines in buf (bytes ending in a newline) with util,
+    using extract_block() for as many as possible and _slow_lines() (which see,
+    for quarantine) for the rest.
+    '''
+    data = np.frombuffer(buf, dtype=np.uint8)
+    gt, ok, ends = extract_block(data, ntabs)
+    # runs of consecutive lines that extract_block() either did or did not parse
+    breaks = (np.flatnonzero(ok[1:] != ok[:-1]) + 1).tolist()
+    for a, b in zip([0] + breaks, breaks + [len(ok)]):
+        if ok[a]:
+            util.block(gt.lines(a, b))
+            counter.update(b - a)
+        else:
+            start = 0 if a == 0 else ends[a - 1] + 1
+            counter.update(_slow_lines(buf[start:ends[b - 1] + 1], util, quarantine))
+
+
+def file_chunks(read, block_size):
+    '''
+    Iterate over the bytes returned by calling read(block_size) until it
+    returns nothing, yielding only complete lines (adding a final newline if needed).
+    '''
+    leftover = b""
+    while True:
+        chunk = read(block_size)
+        if not chunk:
+            break
+        chunk = leftover + chunk
+        cut = chunk.rfind(b"\n") + 1
+        leftover = chunk[cut:]
+        if cut > 0:
+            yield chunk[:cut]
+    if len(leftover) > 0:
+        yield leftover + b"\n"
+
+
+def region_chunks(reader, index, regions, block_size):
+    '''
+    Iterate over the lines of the BgzfReader reader in the given regions,
+    about block_size bytes at a time.
+    '''
+    buf, n = [], 0
+    for region in regions:
+        for line in region_lines(reader, index, *parse_region(region)):
+            buf.append(line)
+            n += len(line)
+            if n >= block_size:
+                yield b"".join(buf)
+                buf, n = [], 0
+    if len(buf) > 0:
+        yield b"".join(buf)
+
+
+def line_chunks(f, block_size):
+    '''
+    Iterate over the remainder of the binary file object f (as from open_vcf()),
+    yielding about block_size bytes of complete lines at a time together with
+    the offset just after them (a virtual offset, for a BgzfReader).
+    '''
+    while True:
+        chunk = f.read(block_size)
+        if not chunk:
+            break
+        if not chunk.endswith(b"\n"):
+            chunk += f.readline()
+            if not chunk.endswith(b"\n"):
+                chunk += b"\n"
+        yield chunk, _tell(f)
+
+
+def _tell(f):
+    return f.tell_virtual() if isinstance(f, BgzfReader) else f.tell()
+
+
+def _seek(f, offset):
+    if isinstance(f, BgzfReader):
+        f.seek_virtual(offset)
+    else:
+        f.seek(offset)
+
+
+def open_vcf(path):
+    '''
+    Open a VCF file, possibly bgzipped or gzipped, as a binary file object.
+    '''
+    if is_bgzf(path):
+        return BgzfReader(path)
+    elif path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    else:
+        return open(path, "rb")
+
+
+def open_index(args):
+    '''
+    The index to use for --regions, or None if not using --regions.
+    '''
+    if not args.regions:
+        return None
+    if not is_bgzf(args.vcf):
+        raise ValueError("--regions requires a bgzipped VCF file.")
+    if args.index is None:
+        args.index = find_index(args.vcf)
+        if args.index is None:
+            raise ValueError("No .tbi or .csi index found for " + args.vcf + ".")
+    return BgzfIndex(args.index)
+
+
+def scan_header(path):
+    '''
+    Read the header of a VCF file, returning the header lines (as bytes),
+    the first data line (or None), and the offset of the first data line
+    (a virtual offset, for a BGZF file).
+    '''
+    header = []
+    with open_vcf(path) as f:
+        bgzf = isinstance(f, BgzfReader)
+        while True:
+            start = f.tell_virtual() if bgzf else f.tell()
+            line = f.readline()
+            if not line or not line.startswith(b"#"):
+                break
+            header.append(line)
+    return header, (line if line else None), start
+
+
+def shard_bounds(path, data_start, nshards):
+    '''
+    Split the data lines of a VCF file, beginning at offset data_start, into
+    at most nshards contiguous pieces of roughly equal (compressed) size, each
+    beginning at the start of a line, returning a list of (start, end) offsets;
+    these are virtual offsets for a BGZF file, and the last end is None.
+    For a BGZF file, pieces begin at the first line starting in some block.
+    '''
+    starts = [data_start]
+    if is_bgzf(path):
+        blocks = [b for b in block_offsets(path) if b[1] > 0 and b[0] > (data_start >> 16)]
+        with BgzfReader(path) as f:
+            for k in range(1, nshards):
+                j = (k * len(blocks)) // nshards
+                if j == 0 or j >= len(blocks):
+                    continue
+                # the line start at or after the beginning of block j
+                prev_coffset, prev_isize = blocks[j - 1]
+                f.seek_virtual((prev_coffset << 16) | (prev_isize - 1))
+                f.readline()
+                starts.append(f.tell_virtual())
+    else:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            for k in range(1, nshards):
+                f.seek(data_start + (k * (size - data_start)) // nshards - 1)
+                f.readline()
+                starts.append(f.tell())
+    starts = sorted(set(x for x in starts if x >= data_start))
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def shard_chunks(path, start, end, block_size):
+    '''
+    Iterate over the lines of path between offsets start and end (as from
+    shard_bounds()), about block_size bytes at a time.
+    '''
+    if is_bgzf(path):
+        with BgzfReader(path) as f:
+            f.seek_virtual(start)
+            for chunk in file_chunks(lambda n: f.read_to(end, n), block_size):
+                yield chunk
+    else:
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = [float("inf") if end is None else end - start]
+            def read(n):
+                n = int(min(n, remaining[0]))
+                remaining[0] -= n
+                return f.read(n)
+            for chunk in file_chunks(read, block_size):
+                yield chunk
+
+
+def _shard_output(args, k):
+    if args.binary is not None:
+        return "{}.part{:06d}".format(args.binary, k)
+    return os.path.join(args.tmpdir, "shard{:06d}.txt".format(k))
+
+
+def convert_shard(task):
+    '''
+    Convert one shard, as main_batched() would, to a temporary file (or
+    binary store); returns the number of sites and the text of the line
+    that could not be converted (or None).
+    '''
+    args, k, start, end, ntabs = task
+    counter = Throughput(interval=float("inf"))
+    writer, out = None, None
+    if args.binary is not None:
+        writer = GenoBinWriter(_shard_output(args, k))
+        util = _BatchUtil(writer, recode=args.recode, triallelic=args.triallelic)
+    elif args.recode:
+        out = open(_shard_output(args, k), "w")
+        util = _BatchUtil(recode=True, triallelic=args.triallelic, w=out)
+    else:
+        out = open(_shard_output(args, k), "wb")
+        util = _TextSink(out)
+    bad = None
+    try:
+        for chunk in shard_chunks(args.vcf, start, end, int(args.block_size * 1024 * 1024)):
+            convert_lines(chunk, ntabs, util, counter)
+        util.flush()
+    except BadLine as e:
+        # as in main_batched(), text already written up to the bad line is kept
+        bad = e.line
+    if writer is not None:
+        writer.close()
+    if out is not None:
+        out.close()
+    return counter.nsites, bad
+
+
+def main_parallel(args):
+    '''
+    Convert the file in args.nshards pieces using args.njobs processes,
+    concatenating the results in order.
+    '''
+    if args.regions:
+        raise ValueError("Cannot use --regions with --njobs.")
+    if args.vcf.endswith(".gz") and not is_bgzf(args.vcf):
+        stderr.write("Cannot split a gzipped (not bgzipped) file; converting with one process.\n")
+        return main_batched(args)
+    t0 = time.time()
+    header, first, data_start = scan_header(args.vcf)
+    samples = None
+    if args.binary is not None:
+        chrom_lines = [x.decode() for x in header if x.startswith(b"#CHROM")]
+        if len(chrom_lines) == 0:
+            raise ValueError("No #CHROM header line found in " + args.vcf + ".")
+        if args.recode:
+            samples = vcf_samples(chrom_lines[0])
+        else:
+            samples = [s + "_" + k for s in vcf_samples(chrom_lines[0]) for k in ("1", "2")]
+    if first is None:
+        if args.binary is not None:
+            GenoBinWriter(args.binary, samples=samples).close()
+        return
+    ntabs = first.count(b"\t")
+    nshards = args.njobs * 4 if args.nshards is None else args.nshards
+    bounds = shard_bounds(args.vcf, data_start, nshards)
+    args.tmpdir = tempfile.mkdtemp(dir=args.tmpdir)
+    tasks = [(args, k, a, b, ntabs) for k, (a, b) in enumerate(bounds)]
+    nsites, bad = 0, None
+    pool = multiprocessing.Pool(args.njobs)
+    try:
+        for k, (n, bad) in enumerate(pool.imap(convert_shard, tasks)):
+            nsites += n
+            if args.binary is None:
+                part = _shard_output(args, k)
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, stdout.buffer, 16 * 1024 * 1024)
+                os.remove(part)
+            if bad is not None:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(args.tmpdir, ignore_errors=True)
+    if bad is not None:
+        if args.binary is not None:
+            for k in range(len(tasks)):
+                for fn in genobin_files(_shard_output(args, k)).values():
+                    if os.path.exists(fn):
+                        os.remove(fn)
+        stdout.flush()
+        stderr.write(bad)
+        exit(1)
+    if args.binary is not None:
+        concatenate_genobin(args.binary, [_shard_output(args, k) for k in range(len(tasks))], samples)
+    stdout.flush()
+    if args.throughput:
+        counter = Throughput()
+        counter.start = t0
+        counter.nsites = nsites
+        counter.report()
+
+
+def vcf_samples(line):
+    '''
+    The sample names in the "#CHROM" header line.
+    '''
+    return line.rstrip().split("\t")[9:]
+
+
+def _binary_util(args, header_line):
+    if args.recode:
+        samples = vcf_samples(header_line)
+    else:
+        samples = [s + "_" + k for s in vcf_samples(header_line) for k in ("1", "2")]
+    writer = GenoBinWriter(args.binary, samples=samples)
+    return writer, _BatchUtil(writer, recode=args.recode, triallelic=args.triallelic)
+
+
 def main():
-    with open(argv[1]) as f:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("vcf", help="VCF file")
+    parser.add_argument("--binary", "-b", type=str, dest="binary",
+            help="write a binary genotype store with this prefix instead of text to stdout")
+    parser.add_argument("--recode", "-r", action="store_true", dest="recode",
+            help="write numeric genotypes, as lostruct::recode_numeric")
+    parser.add_argument("--no_triallelic", action="store_false", dest="triallelic",
+            help="with --recode, set sites with more than two alleles to NA (as triallelic=FALSE)")
+    parser.add_argument("--batched", action="store_true", dest="batched",
+            help="read and extract genotypes in large blocks")
+    parser.add_argument("--block_size", type=float, dest="block_size", default=64,
+            help="size of blocks, in megabytes, with --batched [default: %(default)s]")
+    parser.add_argument("--throughput", action="store_true", dest="throughput",
+            help="report the number of sites converted per second to stderr")
+    parser.add_argument("--regions", "-R", type=str, nargs="*", dest="regions",
+            help="only convert these regions (chrom, chrom:start, or chrom:start-end) of an indexed, bgzipped VCF")
+    parser.add_argument("--njobs", "-j", type=int, dest="njobs", default=1,
+            help="number of processes to convert pieces of the file in parallel (implies --batched)")
+    parser.add_argument("--nshards", type=int, dest="nshards",
+            help="number of pieces to split the file into, with --njobs [default: 4 * njobs]")
+    parser.add_argument("--tmpdir", type=str, dest="tmpdir",
+            help="directory for temporary files, with --njobs [default: a new temporary directory]")
+    parser.add_argument("--outfile", "-o", type=str, dest="outfile",
+            help="with --checkpoint, write the (text) output to this file instead of stdout")
+    parser.add_argument("--checkpoint", "-C", type=str, dest="checkpoint",
+            help="record progress in this file, so the conversion can be resumed (implies --batched)")
+    parser.add_argument("--checkpoint_interval", type=float, dest="checkpoint_interval", default=60,
+            help="seconds between checkpoints [default: %(default)s]")
+    parser.add_argument("--resume", action="store_true", dest="resume",
+            help="resume from the --checkpoint file, if it exists")
+    parser.add_argument("--quarantine", "-Q", type=str, dest="quarantine",
+            help="with --checkpoint, file for lines that cannot be converted [default: CHECKPOINT.quarantine]")
+    parser.add_argument("--index", type=str, dest="index",
+            help="name of the .tbi or .csi index [default: VCF file name plus .tbi or .csi]")
+    args = parser.parse_args()
+
+    if args.checkpoint is not None:
+        return main_resumable(args)
+    if args.resume:
+        parser.error("--resume requires --checkpoint.")
+    if args.outfile is not None:
+        parser.error("--outfile is only used with --checkpoint; otherwise, redirect stdout.")
+    if args.njobs > 1:
+        return main_parallel(args)
+    if args.batched:
+        return main_batched(args)
+
+    counter = Throughput() if args.throughput else _NoThroughput()
+    index = open_index(args)
+    writer = None
+    util = _util
+    if args.recode and args.binary is None:
+        util = _BatchUtil(recode=True, triallelic=args.triallelic)
+    with open_vcf(args.vcf) as raw:
+        f = io.TextIOWrapper(raw)
         for line in f:
             if not line.startswith("#"):
+                if args.binary is not None and writer is None:
+                    raise ValueError("No #CHROM header line found in " + args.vcf + ".")
+                if index is not None:
+                    break
                 try:
-                    _util(line)
+                    util(line)
                 except Exception as e:
                     stderr.write(line)
                     exit(1)
+                counter.update(1)
                 break
+            if args.binary is not None and line.startswith("#CHROM"):
+                writer, util = _binary_util(args, line)
+        if index is not None:
+            f = (line.decode() for region in args.regions
+                 for line in region_lines(raw, index, *parse_region(region)))
         for line in f:
             try:
-                _util(line)
+                util(line)
             except Exception as e:
                 stderr.write(line)
                 exit(1)
+            counter.update(1)
+    if util is not _util:
+        util.flush()
+    if writer is not None:
+        writer.close()
+    counter.report()
+
+
+def main_batched(args):
+    counter = Throughput() if args.throughput else _NoThroughput()
+    block_size = int(args.block_size * 1024 * 1024)
+    index = open_index(args)
+    writer = None
+    if args.binary is not None:
+        util = None
+    elif args.recode:
+        util = _BatchUtil(recode=True, triallelic=args.triallelic)
+    else:
+        util = _TextSink(stdout.buffer)
+    with open_vcf(args.vcf) as f:
+        first = None
+        for raw in f:
+            if not raw.startswith(b"#"):
+                first = raw
+                break
+            if args.binary is not None and raw.startswith(b"#CHROM"):
+                writer, util = _binary_util(args, raw.decode())
+        if first is not None:
+            if util is None:
+                raise ValueError("No #CHROM header line found in " + args.vcf + ".")
+            ntabs = first.count(b"\t")
+            try:
+                if index is not None:
+                    chunks = region_chunks(f, index, args.regions, block_size)
+                else:
+                    counter.update(_slow_lines(first, util))
+                    chunks = file_chunks(f.read, block_size)
+                for chunk in chunks:
+                    convert_lines(chunk, ntabs, util, counter)
+            except BadLine as e:
+                stderr.write(e.line)
+                exit(1)
+    if util is not None:
+        util.flush()
+    if writer is not None:
+        writer.close()
+    counter.report()
+
+def _options(args):
+    return {'vcf': os.path.abspath(args.vcf), 'size': os.path.getsize(args.vcf),
+            'binary': args.binary, 'recode': args.recode, 'triallelic': args.triallelic}
+
+
+def read_checkpoint(args):
+    '''
+    The checkpoint saved in args.checkpoint, checking that it was made by
+    a conversion of the same file with the same options.
+    '''
+    with open(args.checkpoint) as f:
+        state = json.load(f)
+    if state['options'] != _options(args):
+        raise ValueError("Checkpoint " + args.checkpoint + " was made with different options: "
+                         + json.dumps(state['options']))
+    return state
+
+
+def write_checkpoint(args, state):
+    '''
+    Save the state atomically, so that an interrupted write leaves the previous checkpoint.
+    '''
+    state['options'] = _options(args)
+    tmp = args.checkpoint + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, args.checkpoint)
+
+
+def main_resumable(args):
+    '''
+    Convert as main_batched(), but divert lines that cannot be converted to
+    args.quarantine, and every args.checkpoint_interval seconds (after the
+    output up to that point has been written out) record in args.checkpoint the
+    input offset reached, the length of the output, and the number of sites;
+    with args.resume, first truncate the output to the recorded length and
+    start from the recorded offset.
+    '''
+    if args.regions:
+        raise ValueError("Cannot use --regions with --checkpoint.")
+    if args.binary is None and args.outfile is None:
+        raise ValueError("Must specify --outfile (or --binary) with --checkpoint.")
+    if args.quarantine is None:
+        args.quarantine = args.checkpoint + ".quarantine"
+    state = read_checkpoint(args) if args.resume and os.path.exists(args.checkpoint) else None
+    if state is not None and state['done']:
+        stderr.write("Conversion already finished: {} sites, {} lines quarantined.\n".format(
+            state['nsites'], state['nquarantined']))
+        return
+    block_size = int(args.block_size * 1024 * 1024)
+    with open_vcf(args.vcf) as f:
+        header = []
+        while True:
+            data_start = _tell(f)
+            line = f.readline()
+            if not line.startswith(b"#"):
+                break
+            header.append(line.decode())
+        ntabs = line.count(b"\t")
+        writer, out = None, None
+        if args.binary is not None:
+            chrom_lines = [x for x in header if x.startswith("#CHROM")]
+            if len(chrom_lines) == 0:
+                raise ValueError("No #CHROM header line found in " + args.vcf + ".")
+            if args.recode:
+                samples = vcf_samples(chrom_lines[0])
+            else:
+                samples = [s + "_" + k for s in vcf_samples(chrom_lines[0]) for k in ("1", "2")]
+            writer = GenoBinWriter(args.binary, samples=samples,
+                                   resume_sites=None if state is None else state['nsites'])
+            util = _BatchUtil(writer, recode=args.recode, triallelic=args.triallelic)
+        else:
+            if state is None:
+                open(args.outfile, "wb").close()
+            else:
+                os.truncate(args.outfile, state['output_bytes'])
+            if args.recode:
+                out = open(args.outfile, "a")
+                util = _BatchUtil(recode=True, triallelic=args.triallelic, w=out)
+            else:
+                out = open(args.outfile, "ab")
+                util = _TextSink(out)
+        if state is None:
+            state = {'offset': data_start, 'output_bytes': 0, 'nsites': 0,
+                     'quarantine_bytes': 0, 'nquarantined': 0, 'done': False}
+            if os.path.exists(args.quarantine):
+                os.remove(args.quarantine)
+        else:
+            stderr.write("Resuming after {} sites.\n".format(state['nsites']))
+        quarantine = Quarantine(args.quarantine, state['quarantine_bytes'], state['nquarantined'])
+        counter = Throughput(interval=60 if args.throughput else float("inf"))
+        resumed_sites = state['nsites']
+        _seek(f, state['offset'])
+
+        def save(offset, done=False):
+            # the output and quarantine must be on disk before the checkpoint says they are,
+            # or resuming after a crash could extend them with zeros
+            util.flush()
+            if writer is not None:
+                writer.flush(sync=True)
+            else:
+                out.flush()
+                os.fsync(out.fileno())
+                state['output_bytes'] = os.path.getsize(args.outfile)
+            state.update(offset=offset, nsites=resumed_sites + counter.nsites,
+                         quarantine_bytes=quarantine.tell(), nquarantined=quarantine.nlines, done=done)
+            write_checkpoint(args, state)
+
+        last = time.time()
+        for chunk, offset in line_chunks(f, block_size):
+            convert_lines(chunk, ntabs, util, counter, quarantine)
+            if time.time() - last >= args.checkpoint_interval:
+                save(offset)
+                last = time.time()
+        save(_tell(f), done=True)
+    if writer is not None:
+        writer.close()
+    if out is not None:
+        out.close()
+    quarantine.close()
+    if state['nquarantined'] > 0:
+        stderr.write("{} lines could not be converted; see {}.\n".format(
+            state['nquarantined'], args.quarantine))
+    if args.throughput:
+        counter.report()
+
 
 if __name__ == '__main__':
     main()
-
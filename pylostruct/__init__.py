@@ -0,0 +1,4 @@
+'''
+Python helpers shared by the data-conversion and simulation scripts in this
+repository, for getting genotype data into (and out of) the lostruct R package.
+'''
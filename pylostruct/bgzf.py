@@ -0,0 +1,656 @@
+'''
+Reading and writing of BGZF-compressed files (e.g., bgzipped VCF) and reading
+of their tabix (.tbi) or CSI (.csi) indexes, without htslib.
+
+A BGZF file is a series of gzip members ("blocks") of at most 64KB of
+uncompressed data each, whose size is recorded in a "BC" extra field.  A
+position in the uncompressed stream is given by a "virtual offset":
+(offset of the block in the compressed file << 16) | (offset within the block).
+See the SAM/BAM format specification for details.
+'''
+
+import io
+import os
+import gzip
+import zlib
+import struct
+import bisect
+import threading
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# the empty block that ends a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# the most uncompressed data put in one block (as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_MAX_BLOCK = 0x10000
+
+
+def is_bgzf(path):
+    '''
+    Whether the file looks like it is BGZF-compressed.
+    '''
+    with open(path, "rb") as f:
+        head = f.read(16)
+    return len(head) == 16 and head[:4] == BGZF_MAGIC and head[12:14] == b"BC"
+
+
+def read_block(f):
+    '''
+    Read the next BGZF block from the binary file object f, returning
+    (uncompressed data, compressed size of the block), or (None, 0) at the end of the file.
+    '''
+    header = f.read(18)
+    if len(header) == 0:
+        return None, 0
+    if len(header) < 18 or header[:4] != BGZF_MAGIC:
+        raise ValueError("Not a BGZF block.")
+    xlen, = struct.unpack("<H", header[10:12])
+    extra = header[12:18] + f.read(xlen - 6)
+    bsize = None
+    k = 0
+    while k < xlen:
+        si, slen = extra[k:k+2], struct.unpack("<H", extra[k+2:k+4])[0]
+        if si == b"BC":
+            bsize = struct.unpack("<H", extra[k+4:k+6])[0] + 1
+        k += 4 + slen
+    if bsize is None:
+        raise ValueError("BGZF block has no BC field.")
+    rest = f.read(bsize - 12 - xlen)
+    data = zlib.decompress(rest[:-8], -15)
+    crc, isize = struct.unpack("<II", rest[-8:])
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError("Corrupt BGZF block.")
+    return data, bsize
+
+
+def block_offsets(path):
+    '''
+    The compressed offset and uncompressed size of every block of a BGZF file,
+    found by reading only the block headers and trailers.
+    '''
+    blocks = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        coffset = 0
+        while coffset < size:
+            f.seek(coffset)
+            header = f.read(18)
+            if header[:4] != BGZF_MAGIC or header[12:14] != b"BC":
+                raise ValueError("Not a BGZF block at offset {} of {}.".format(coffset, path))
+            bsize = struct.unpack("<H", header[16:18])[0] + 1
+            f.seek(coffset + bsize - 4)
+            isize, = struct.unpack("<I", f.read(4))
+            blocks.append((coffset, isize))
+            coffset += bsize
+    return blocks
+
+
+def compress_block(data, level=6):
+    '''
+    Compress data (at most BGZF_BLOCK_SIZE bytes) into one BGZF block.
+    '''
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    if len(cdata) + 26 > BGZF_MAX_BLOCK:
+        # incompressible: store it
+        c = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+    header = BGZF_MAGIC + struct.pack("<IBBHccH", 0, 0, 0xff, 6, b"B", b"C", 2)
+    return (header + struct.pack("<H", len(cdata) + 25) + cdata
+            + struct.pack("<II", zlib.crc32(data), len(data)))
+
+
+class BgzfWriter(io.BufferedIOBase):
+    '''
+    Writes a BGZF file (which any gzip reader can also read), compressing
+    blocks in threads worker threads (or in the calling thread, if threads is 1);
+    blocks are written in order, and the file ends with the BGZF EOF block.
+    tell() gives the offset in the uncompressed stream, which after flush()
+    can be converted to a virtual offset with virtual_offset().
+    '''
+
+    def __init__(self, path, mode="wb", level=6, threads=1):
+        self.raw_file = open(path, mode.replace("t", "").replace("b", "") + "b")
+        self.level = level
+        self._buf = bytearray()
+        self._pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._pending = collections.deque()
+        self._max_pending = 4 * threads
+        # uncompressed and compressed offsets of the starts of blocks
+        self._next_ustart = 0
+        self._ustarts = []
+        self._coffsets = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        if len(self._buf) >= BGZF_BLOCK_SIZE:
+            view = memoryview(self._buf)
+            k = 0
+            while len(self._buf) - k >= BGZF_BLOCK_SIZE:
+                self._add_block(bytes(view[k:k + BGZF_BLOCK_SIZE]))
+                k += BGZF_BLOCK_SIZE
+            view.release()
+            del self._buf[:k]
+        return len(data)
+
+    def tell(self):
+        return self._next_ustart + len(self._buf)
+
+    def virtual_offset(self, upos):
+        '''
+        The virtual offset of the uncompressed offset upos, which must have been
+        written out already (as by flush() or close(): see written()).
+        '''
+        k = bisect.bisect_right(self._ustarts, upos) - 1
+        return (self._coffsets[k] << 16) | (upos - self._ustarts[k])
+
+    def written(self):
+        '''
+        The uncompressed offset before which virtual_offset() can be used:
+        the start of the first block not yet written out.
+        '''
+        n = len(self._coffsets)
+        return self._ustarts[n] if n < len(self._ustarts) else self._next_ustart
+
+    def _add_block(self, data):
+        self._ustarts.append(self._next_ustart)
+        self._next_ustart += len(data)
+        if self._pool is None:
+            self._write_block(compress_block(data, self.level))
+            return
+        self._pending.append(self._pool.submit(compress_block, data, self.level))
+        while len(self._pending) > self._max_pending or (self._pending and self._pending[0].done()):
+            self._write_block(self._pending.popleft().result())
+
+    def _write_block(self, block):
+        self._coffsets.append(self.raw_file.tell())
+        self.raw_file.write(block)
+
+    def _drain(self):
+        while self._pending:
+            self._write_block(self._pending.popleft().result())
+
+    def flush(self):
+        '''
+        Write out all data so far, ending the current block.
+        '''
+        if self.closed:
+            return
+        if len(self._buf) > 0:
+            self._add_block(bytes(self._buf))
+            self._buf = bytearray()
+        self._drain()
+        self.raw_file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        # this flushes the remaining data
+        super(BgzfWriter, self).close()
+        self._ustarts.append(self._next_ustart)
+        self._write_block(BGZF_EOF)
+        self.raw_file.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class _Prefetcher(threading.Thread):
+    '''
+    Reads and decompresses blocks starting at compressed offset coffset in a
+    background thread (zlib releases the GIL, so this overlaps with parsing),
+    putting (coffset, data) on a queue, and None at the end.
+    '''
+
+    def __init__(self, path, coffset, nblocks):
+        super(_Prefetcher, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.coffset = coffset
+        self.queue = queue.Queue(maxsize=nblocks)
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.coffset)
+                coffset = self.coffset
+                while not self.stopped.is_set():
+                    data, bsize = read_block(f)
+                    if data is None:
+                        break
+                    self._put((coffset, data))
+                    coffset += bsize
+        except Exception as e:
+            self._put(e)
+        self._put(None)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+class BgzfReader(io.BufferedIOBase):
+    '''
+    A read-only binary file object for the uncompressed contents of a BGZF
+    file, which is decompressed (prefetch_blocks blocks ahead) in a background
+    thread.  Supports read(), readline(), iteration over lines, and seeking to
+    and telling virtual offsets; it can be wrapped in io.TextIOWrapper.
+    '''
+
+    def __init__(self, path, prefetch_blocks=64):
+        super(BgzfReader, self).__init__()
+        self.path = path
+        self.prefetch_blocks = prefetch_blocks
+        self._thread = None
+        self.seek_virtual(0)
+
+    def seek_virtual(self, voffset):
+        self._stop()
+        coffset, uoffset = voffset >> 16, voffset & 0xFFFF
+        self._thread = _Prefetcher(self.path, coffset, self.prefetch_blocks)
+        self._thread.start()
+        self._eof = False
+        self._coffset = coffset
+        self._data = b""
+        self._pos = 0
+        self._next_block()
+        self._pos = uoffset
+
+    def tell_virtual(self):
+        if self._pos == len(self._data) and not self._eof:
+            self._next_block()
+        return (self._coffset << 16) | self._pos
+
+    def _next_block(self):
+        '''
+        Move on to the next (nonempty) block; returns False at the end of the file.
+        '''
+        while not self._eof:
+            item = self._thread.queue.get()
+            if item is None:
+                self._eof = True
+                self._data, self._pos = b"", 0
+                return False
+            if isinstance(item, Exception):
+                raise item
+            self._coffset, self._data = item
+            self._pos = 0
+            if len(self._data) > 0:
+                return True
+        return False
+
+    def read(self, n=-1):
+        out = []
+        while n != 0:
+            if self._pos == len(self._data) and not self._next_block():
+                break
+            if n < 0:
+                piece = self._data[self._pos:]
+            else:
+                piece = self._data[self._pos:self._pos + n]
+                n -= len(piece)
+            self._pos += len(piece)
+            out.append(piece)
+        return b"".join(out)
+
+    def read_to(self, vend, n=-1):
+        '''
+        Read up to n bytes (or all, if n is negative), but not past the virtual
+        offset vend (or to the end of the file, if vend is None).
+        '''
+        if vend is None:
+            return self.read(n)
+        cend, uend = vend >> 16, vend & 0xFFFF
+        out = []
+        while n != 0:
+            if self._pos == len(self._data) and not self._next_block():
+                break
+            if self._coffset > cend:
+                break
+            limit = len(self._data) if self._coffset < cend else min(uend, len(self._data))
+            if self._pos >= limit:
+                break
+            stop = limit if n < 0 else min(limit, self._pos + n)
+            piece = self._data[self._pos:stop]
+            self._pos = stop
+            if n > 0:
+                n -= len(piece)
+            out.append(piece)
+        return b"".join(out)
+
+    def read1(self, n=-1):
+        if self._pos == len(self._data) and not self._next_block():
+            return b""
+        end = len(self._data) if n < 0 else self._pos + n
+        piece = self._data[self._pos:end]
+        self._pos += len(piece)
+        return piece
+
+    def readinto(self, b):
+        piece = self.read(len(b))
+        b[:len(piece)] = piece
+        return len(piece)
+
+    def readline(self, size=-1):
+        out = []
+        while True:
+            if self._pos == len(self._data) and not self._next_block():
+                break
+            end = self._data.find(b"\n", self._pos)
+            if end < 0:
+                out.append(self._data[self._pos:])
+                self._pos = len(self._data)
+            else:
+                out.append(self._data[self._pos:end + 1])
+                self._pos = end + 1
+                break
+        return b"".join(out)
+
+    def readable(self):
+        return True
+
+    def _stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self._stop()
+        super(BgzfReader, self).close()
+
+
+def reg2bins(beg, end, min_shift, depth):
+    '''
+    The bins that may contain features overlapping the 0-based, half-open
+    interval [beg, end), for a binning index with the given parameters
+    (min_shift=14, depth=5 for tabix).
+    '''
+    end -= 1
+    bins = []
+    s = min_shift + 3 * depth
+    t = 0
+    for level in range(depth + 1):
+        bins.extend(range(t + (beg >> s), t + (end >> s) + 1))
+        s -= 3
+        t += 1 << (3 * level)
+    return bins
+
+
+def reg2bin(beg, end, min_shift, depth):
+    '''
+    The smallest bin containing the 0-based, half-open interval [beg, end).
+    '''
+    end -= 1
+    s = min_shift
+    t = ((1 << (3 * depth)) - 1) // 7
+    for level in range(depth, 0, -1):
+        if beg >> s == end >> s:
+            return t + (beg >> s)
+        s += 3
+        t -= 1 << (3 * (level - 1))
+    return 0
+
+
+def csi_depth(max_length, min_shift=14):
+    '''
+    The depth of the CSI binning index that htslib uses for contigs of at
+    most max_length bp (or, if that is None or 0, of up to 2^31 bp).
+    '''
+    if not max_length:
+        max_length = (1 << 31) - 1
+    max_length += 256
+    depth, s = 0, 1 << min_shift
+    while max_length > s:
+        depth += 1
+        s <<= 3
+    return depth
+
+
+class CsiIndexWriter(object):
+    '''
+    Builds a CSI index (as "bcftools index" would) of a position-sorted
+    BGZF-compressed file as its records are written: call add() with the
+    reference (sequence) number, 0-based half-open interval, and virtual
+    offsets of the start and end of each record, in order, and then write().
+    If names is given (for a VCF), these are stored in the index as tabix does;
+    a BCF index has no names, but nref gives the number of contigs in its header.
+    Unless depth is given, it is chosen from the length of the longest contig,
+    max_length, as htslib does (which for an unknown length is deep enough for 2^31 bp).
+    '''
+
+    def __init__(self, names=None, nref=None, min_shift=14, depth=None, max_length=None):
+        self.names = names
+        self.nref = len(names) if names is not None else nref
+        self.min_shift = min_shift
+        self.depth = depth if depth is not None else csi_depth(max_length, min_shift)
+        self.refs = collections.OrderedDict()
+
+    def add(self, ref, beg, end, vstart, vend):
+        if ref not in self.refs:
+            self.refs[ref] = {'bins': collections.OrderedDict(), 'linear': {},
+                              'first': vstart, 'last': vend, 'n': 0}
+        r = self.refs[ref]
+        b = reg2bin(beg, end, self.min_shift, self.depth)
+        chunks = r['bins'].setdefault(b, [])
+        if chunks and chunks[-1][1] == vstart:
+            chunks[-1][1] = vend
+        else:
+            chunks.append([vstart, vend])
+        for w in range(beg >> self.min_shift, ((max(end, beg + 1) - 1) >> self.min_shift) + 1):
+            if w not in r['linear']:
+                r['linear'][w] = vstart
+        r['last'] = vend
+        r['n'] += 1
+
+    def _aux(self):
+        if self.names is None:
+            return b""
+        names = b"".join(x.encode() + b"\x00" for x in self.names)
+        # format (VCF), col_seq, col_beg, col_end, meta ('#'), skip, l_nm
+        return struct.pack("<iiiiiii", 2, 1, 2, 0, ord("#"), 0, len(names)) + names
+
+    def write(self, path):
+        aux = self._aux()
+        out = [b"CSI\x01", struct.pack("<iii", self.min_shift, self.depth, len(aux)), aux]
+        nref = self.nref if self.nref is not None else (max(self.refs) + 1 if self.refs else 0)
+        out.append(struct.pack("<i", nref))
+        pseudo_bin = ((1 << (3 * (self.depth + 1))) - 1) // 7 + 1
+        for ref in range(nref):
+            r = self.refs.get(ref)
+            if r is None:
+                out.append(struct.pack("<i", 0))
+                continue
+            # the smallest virtual offset of any record overlapping each window or later ones
+            windows = sorted(r['linear'])
+            loff = {}
+            low = None
+            for w in reversed(windows):
+                low = r['linear'][w] if low is None else min(low, r['linear'][w])
+                loff[w] = low
+            out.append(struct.pack("<i", len(r['bins']) + 1))
+            for b in sorted(r['bins']):
+                level_start = 0
+                level = 0
+                while b >= level_start + (1 << (3 * level)):
+                    level_start += 1 << (3 * level)
+                    level += 1
+                shift = self.min_shift + 3 * (self.depth - level)
+                w0 = ((b - level_start) << shift) >> self.min_shift
+                k = bisect.bisect_left(windows, w0)
+                chunks = r['bins'][b]
+                out.append(struct.pack("<IQi", b, loff[windows[k]] if k < len(windows) else 0, len(chunks)))
+                out.append(b"".join(struct.pack("<QQ", *c) for c in chunks))
+            out.append(struct.pack("<IQiQQQQ", pseudo_bin, 0, 2, r['first'], r['last'], r['n'], 0))
+        # the number of records without coordinates
+        out.append(struct.pack("<Q", 0))
+        with BgzfWriter(path) as f:
+            f.write(b"".join(out))
+
+
+class BgzfIndex(object):
+    '''
+    A tabix (.tbi) or CSI (.csi) index of a BGZF-compressed, position-sorted file.
+    A CSI index of a BCF file does not contain the sequence names, which must
+    then be given as names (in the order of the contigs in the BCF header).
+    '''
+
+    def __init__(self, path, names=None):
+        with open(path, "rb") as f:
+            raw = gzip.decompress(f.read())
+        magic = raw[:4]
+        if magic == b"TBI\x01":
+            self.min_shift, self.depth = 14, 5
+            self.names, k = self._parse_names(raw, 8)
+            nref, = struct.unpack("<i", raw[4:8])
+            csi = False
+        elif magic == b"CSI\x01":
+            self.min_shift, self.depth, l_aux = struct.unpack("<iii", raw[4:16])
+            if l_aux >= 28:
+                self.names, _ = self._parse_names(raw, 16)
+            elif names is not None:
+                self.names = list(names)
+            else:
+                raise ValueError("CSI index " + path + " has no sequence names (is it for a BCF file?).")
+            k = 16 + l_aux
+            nref, = struct.unpack("<i", raw[k:k+4])
+            k += 4
+            csi = True
+        else:
+            raise ValueError(path + " is not a .tbi or .csi index.")
+        self.bins = []
+        self.loffsets = []
+        self.linear = []
+        for _ in range(nref):
+            n_bin, = struct.unpack("<i", raw[k:k+4])
+            k += 4
+            bins, loffsets = {}, {}
+            for _ in range(n_bin):
+                if csi:
+                    b, loff, n_chunk = struct.unpack("<IQi", raw[k:k+16])
+                    k += 16
+                    loffsets[b] = loff
+                else:
+                    b, n_chunk = struct.unpack("<Ii", raw[k:k+8])
+                    k += 8
+                chunks = struct.unpack("<%dQ" % (2 * n_chunk), raw[k:k + 16 * n_chunk])
+                k += 16 * n_chunk
+                bins[b] = list(zip(chunks[0::2], chunks[1::2]))
+            linear = []
+            if not csi:
+                n_intv, = struct.unpack("<i", raw[k:k+4])
+                k += 4
+                linear = list(struct.unpack("<%dQ" % n_intv, raw[k:k + 8 * n_intv]))
+                k += 8 * n_intv
+            self.bins.append(bins)
+            self.loffsets.append(loffsets)
+            self.linear.append(linear)
+
+    @staticmethod
+    def _parse_names(raw, k):
+        # format, col_seq, col_beg, col_end, meta, skip, l_nm
+        l_nm, = struct.unpack("<i", raw[k+24:k+28])
+        names = raw[k+28:k+28+l_nm].split(b"\x00")
+        return [x.decode() for x in names if len(x) > 0], k + 28 + l_nm
+
+    def chunks(self, chrom, start=None, end=None):
+        '''
+        The (merged) ranges of virtual offsets that may contain records on chrom
+        overlapping the 1-based, closed interval [start, end]; an empty list if
+        chrom is not in the index.
+        '''
+        if chrom not in self.names:
+            return []
+        ref = self.names.index(chrom)
+        beg = 0 if start is None else max(0, start - 1)
+        maxpos = 1 << (self.min_shift + 3 * self.depth)
+        stop = maxpos if end is None else min(end, maxpos)
+        min_off = 0
+        if self.linear[ref]:
+            i = min(beg >> 14, len(self.linear[ref]) - 1)
+            min_off = self.linear[ref][i]
+        elif self.loffsets[ref]:
+            # loffset of the smallest bin containing beg
+            for b in reversed(reg2bins(beg, beg + 1, self.min_shift, self.depth)):
+                if b in self.loffsets[ref]:
+                    min_off = self.loffsets[ref][b]
+                    break
+        found = []
+        for b in reg2bins(beg, stop, self.min_shift, self.depth):
+            for cbeg, cend in self.bins[ref].get(b, []):
+                if cend > min_off:
+                    found.append((max(cbeg, min_off), cend))
+        found.sort()
+        merged = []
+        for cbeg, cend in found:
+            if merged and cbeg <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], cend))
+            else:
+                merged.append((cbeg, cend))
+        return merged
+
+
+def find_index(path):
+    '''
+    The name of the .tbi or .csi index of path, or None if there is none.
+    '''
+    for ext in (".tbi", ".csi"):
+        if os.path.exists(path + ext):
+            return path + ext
+    return None
+
+
+def parse_region(region):
+    '''
+    Parse a region string "chrom", "chrom:start", or "chrom:start-end" (1-based,
+    inclusive; commas in numbers are ignored) into (chrom, start, end),
+    with None for missing start or end.
+    '''
+    if ":" not in region:
+        return region, None, None
+    chrom, rng = region.rsplit(":", 1)
+    rng = rng.replace(",", "")
+    if "-" in rng:
+        start, end = rng.split("-", 1)
+        return chrom, int(start), (int(end) if end else None)
+    return chrom, int(rng), None
+
+
+def region_lines(reader, index, chrom, start=None, end=None):
+    '''
+    Iterate over the lines of the BgzfReader reader whose first two columns
+    (chromosome and position) fall in the given region, using index to find
+    the relevant blocks.
+    '''
+    bchrom = chrom.encode()
+    for cbeg, cend in index.chunks(chrom, start, end):
+        reader.seek_virtual(cbeg)
+        while reader.tell_virtual() < cend:
+            line = reader.readline()
+            if not line:
+                break
+            if line.startswith(b"#"):
+                continue
+            fields = line.split(b"\t", 2)
+            if fields[0] != bchrom:
+                continue
+            pos = int(fields[1])
+            if end is not None and pos > end:
+                return
+            if start is None or pos >= start:
+                yield line
@@ -0,0 +1,93 @@
+'''
+Stepping-stone migration between populations on a one- or two-dimensional
+grid, as used by the simulation scripts, built from the list of pairs of
+neighbouring populations (so in time proportional to the number of
+populations) rather than by comparing every pair of populations.
+
+Population k is at row k // n and column k % n of an m x n grid (a grid with
+m = 1 or n = 1 is one-dimensional); each population sends a proportion migr
+of itself to each of its (up to four) neighbours each generation.  A barrier
+between rows b and b + 1 removes migration across it.  A simulation can have
+several time phases, each with its own migration (e.g., a barrier that is
+present for some period), given as a list of Phase tuples.
+
+The same structure can be produced in the forms needed by:
+
+    msprime     migration_matrix() (zero diagonal)
+    simuPOP     migration_matrix(diagonal=True) (with diagonal entries
+                1 - the rest of the row, for Migrator(mode=BY_PROBABILITY)),
+                and for time phases, simupop_phases()
+
+See sims/demography-benchmark.py for timings over grid widths.
+'''
+
+import collections
+
+import numpy as np
+
+# a period of a simulation, from generation begin up to end, with migration
+# rate migr and with or without the barrier
+Phase = collections.namedtuple("Phase", ["begin", "end", "migr", "barrier"])
+
+
+class SteppingStone(object):
+
+    def __init__(self, m, n=None, migr=0.01, barrier=None):
+        '''
+        An m x n grid (n = m by default), with migration rate migr between
+        neighbours; barrier, if not None, is the row b such that a barrier
+        (when present) is between rows b and b + 1.
+        '''
+        self.m = int(m)
+        self.n = self.m if n is None else int(n)
+        self.npops = self.m * self.n
+        self.migr = migr
+        if barrier is not None and not 0 <= barrier < self.m - 1:
+            raise ValueError("The barrier must be between two rows of the grid.")
+        self.barrier = barrier
+
+    def neighbors(self, barrier=False):
+        '''
+        The pairs of neighbouring populations, as two arrays (source, dest),
+        with each pair in both orders; pairs across the barrier are omitted
+        if barrier is True.
+        '''
+        index = np.arange(self.npops).reshape((self.m, self.n))
+        # across columns, then across rows
+        a = [index[:, :-1].ravel(), index[:-1, :].ravel()]
+        b = [index[:, 1:].ravel(), index[1:, :].ravel()]
+        if barrier and self.barrier is not None:
+            keep = (a[1] // self.n) != self.barrier
+            a[1], b[1] = a[1][keep], b[1][keep]
+        a, b = np.concatenate(a), np.concatenate(b)
+        return np.concatenate([a, b]), np.concatenate([b, a])
+
+    def migration_array(self, barrier=False, diagonal=False, migr=None):
+        '''
+        The migration matrix as a numpy array; see migration_matrix().
+        '''
+        if migr is None:
+            migr = self.migr
+        M = np.zeros((self.npops, self.npops))
+        source, dest = self.neighbors(barrier=barrier)
+        M[source, dest] = migr
+        if diagonal:
+            M[np.diag_indices(self.npops)] = 1.0 - M.sum(axis=1)
+        return M
+
+    def migration_matrix(self, barrier=False, diagonal=False, migr=None):
+        '''
+        The migration matrix, as a list of lists: entry [u][v] is migr (or the
+        rate given) if u and v are neighbours (and not separated by the barrier,
+        if barrier is True); if diagonal, entry [u][u] is one minus the rest of
+        row u, as simuPOP expects, and otherwise is zero, as msprime expects.
+        '''
+        return self.migration_array(barrier=barrier, diagonal=diagonal, migr=migr).tolist()
+
+    def simupop_phases(self, phases):
+        '''
+        For each phase, the tuple (rates, begin, end) to pass to
+        simuPOP.Migrator(rate=rates, mode=BY_PROBABILITY, begin=begin, end=end).
+        '''
+        return [(self.migration_matrix(barrier=p.barrier, diagonal=True, migr=p.migr), p.begin, p.end)
+                for p in phases]
@@ -0,0 +1,69 @@
+'''
+Opening of input and output files for the simulation scripts, replacing the
+fileopt() helper that each of them used to define.  Output files are written
+through large buffers, and output to a file ending in ".gz" is written as
+BGZF (see bgzf.py), compressed in several threads, so that a VCF written as
+"sim.vcf.gz" can be indexed directly by "bcftools index" or "tabix -p vcf".
+'''
+
+import io
+import os
+import sys
+import gzip
+
+from .bgzf import BgzfWriter
+
+# size of the buffers used for (uncompressed) output files
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# number of threads used to compress .gz output
+COMPRESS_THREADS = 4
+
+
+class _Unclosed(object):
+    '''
+    stdin or stdout, which closing (e.g. at the end of a with block) only
+    flushes, so that the rest of the process can still use it.
+    '''
+
+    def __init__(self, fobj):
+        self._fobj = fobj
+
+    def __getattr__(self, name):
+        return getattr(self._fobj, name)
+
+    def __iter__(self):
+        return iter(self._fobj)
+
+    def close(self):
+        if self._fobj.writable():
+            self._fobj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fileopt(fname, opts, threads=COMPRESS_THREADS, level=6):
+    '''Return the file referred to by fname, open with options opts;
+    if fname is "-" return stdin/stdout (which closing does not close); if fname
+    ends with .gz, read it with gzip or write it as BGZF, compressing with
+    threads threads at the given level.
+    '''
+    if fname == "-":
+        if "r" in opts:
+            fobj = _Unclosed(sys.stdin)
+        else:
+            fobj = _Unclosed(sys.stdout)
+    elif fname.endswith(".gz"):
+        if "r" in opts:
+            fobj = gzip.open(fname, opts if "b" in opts else opts + "t")
+        else:
+            fobj = BgzfWriter(fname, opts, level=level, threads=threads)
+            if "b" not in opts:
+                fobj = io.TextIOWrapper(fobj, write_through=False)
+    else:
+        fobj = open(fname, opts, buffering=BUFFER_SIZE)
+    return fobj
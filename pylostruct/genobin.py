@@ -0,0 +1,273 @@
+'''
+A binary "sidecar" store for genotype matrices, which can be loaded into R
+without any text parsing.  A store with prefix PREFIX consists of three files:
+
+    PREFIX.geno     the genotype matrix, as signed 8-bit integers, written one
+                    site after another: the first nsamples bytes are the
+                    values of all samples at the first site, and so on
+                    (i.e., a row-major sites x samples matrix).
+                    Missing values are NA_INT8 = -128.
+    PREFIX.pos      the positions of the sites, as little-endian signed 64-bit integers.
+    PREFIX.samples  the names of the columns of the matrix, one per line (UTF-8).
+
+The number of sites is therefore the size of PREFIX.pos divided by 8,
+and the size of PREFIX.geno is the number of sites times the number of samples.
+In R, this is read by lostruct::read_genobin(), which does:
+
+    samples <- readLines(paste0(prefix, ".samples"))
+    nsites <- file.size(paste0(prefix, ".pos")) / 8
+    pos <- readBin(paste0(prefix, ".pos"), what="integer", size=8, n=nsites, endian="little")
+    geno <- readBin(paste0(prefix, ".geno"), what="integer", size=1, signed=TRUE, n=nsites*length(samples))
+    geno[geno == -128L] <- NA
+    geno <- matrix(geno, nrow=nsites, byrow=TRUE)
+
+(or the files can be memory-mapped, e.g. with mmap::mmap(..., mode=int8())).
+
+A store may also have a window table, and a table of regions, written by write_windows():
+
+    PREFIX.windows      for each window, four little-endian signed 64-bit integers:
+                        the index of its first site, one more than the index of
+                        its last site, and its first and last positions (inclusive).
+    PREFIX.regions.csv  the chromosome, first and last positions of each window,
+                        as run_lostruct.R writes region(win.fn)().
+
+Windows are chosen as by lostruct::vcf_windower() (see windower.py) for a
+single chromosome, so window n of an analysis is the rows first:end of the
+matrix, which start at byte first * nsamples of PREFIX.geno and can be read
+with a single seek (read_window() here; lostruct::genobin_windower() in R).
+A store written for windows of a given type and size has a prefix ending in
+.TYPESIZE (e.g., sim00.snp1000; see windowed_prefix()), which is where
+run_lostruct.R looks for one before windowing a VCF with bcftools.
+'''
+
+import os
+import re
+import numpy as np
+
+NA_INT8 = -128
+
+GENO_EXT = ".geno"
+POS_EXT = ".pos"
+SAMPLES_EXT = ".samples"
+WINDOWS_EXT = ".windows"
+REGIONS_EXT = ".regions.csv"
+
+
+def genobin_files(prefix):
+    '''
+    The names of the three files making up the store with the given prefix.
+    '''
+    return {'geno': prefix + GENO_EXT, 'pos': prefix + POS_EXT, 'samples': prefix + SAMPLES_EXT}
+
+
+def window_files(prefix):
+    '''
+    The names of the window table and regions table of the store with the given prefix.
+    '''
+    return [prefix + WINDOWS_EXT, prefix + REGIONS_EXT]
+
+
+def windowed_prefix(stem, size, type):
+    '''
+    The prefix of a store with windows of the given size and type, for the
+    genotypes otherwise in (e.g.) stem.vcf.
+    '''
+    return "{}.{}{}".format(stem, type, size)
+
+
+def vcf_stem(path):
+    '''
+    path without its .vcf, .vcf.gz, or .bcf extension.
+    '''
+    return re.match("(.*?)(?:[.]vcf(?:[.]gz)?|[.]bcf)?$", path).group(1)
+
+
+def rate_vcf_name(path, rate, rep=None):
+    '''
+    path with the mutation rate (and, unless rep is None, the replicate) added
+    before its .vcf, .vcf.gz, or .bcf extension (or before .vcf, if it has none):
+    e.g., sim00_u1e-08_r2.vcf.
+    '''
+    stem, ext = re.match("(.*?)((?:[.]vcf(?:[.]gz)?|[.]bcf)?)$", path).groups()
+    name = stem + "_u{:g}".format(rate)
+    if rep is not None:
+        name += "_r{}".format(rep)
+    return name + (ext or ".vcf")
+
+
+def write_samples(prefix, samples):
+    with open(prefix + SAMPLES_EXT, "w") as f:
+        for s in samples:
+            f.write(str(s) + "\n")
+
+
+class GenoBinWriter(object):
+    '''
+    Writes a binary genotype store one block of sites at a time.
+    If samples is None, the .samples file is not written (e.g., for pieces
+    that will be concatenated later, with concatenate_genobin()).
+    If resume_sites is not None, an existing store (with the given samples)
+    is truncated to its first resume_sites sites and appended to.
+    '''
+
+    def __init__(self, prefix, samples=None, resume_sites=None):
+        self.prefix = prefix
+        self.nsamples = None if samples is None else len(samples)
+        self.nsites = 0
+        if resume_sites is not None:
+            if self.nsamples is None:
+                raise ValueError("Must know the samples to resume writing a store.")
+            os.truncate(prefix + GENO_EXT, resume_sites * self.nsamples)
+            os.truncate(prefix + POS_EXT, resume_sites * 8)
+            self.nsites = resume_sites
+            self.geno_file = open(prefix + GENO_EXT, "ab")
+            self.pos_file = open(prefix + POS_EXT, "ab")
+            return
+        if samples is not None:
+            write_samples(prefix, samples)
+        self.geno_file = open(prefix + GENO_EXT, "wb")
+        self.pos_file = open(prefix + POS_EXT, "wb")
+
+    def write(self, positions, geno):
+        '''
+        Append sites at the given positions, with geno an integer array of
+        shape (number of sites, number of samples) whose missing values are NA_INT8.
+        '''
+        geno = np.ascontiguousarray(geno, dtype=np.int8)
+        positions = np.ascontiguousarray(positions, dtype='<i8')
+        if geno.ndim != 2 or geno.shape[0] != len(positions):
+            raise ValueError("Genotypes must be a (sites x samples) matrix with one row per position.")
+        if self.nsamples is None:
+            self.nsamples = geno.shape[1]
+        elif geno.shape[1] != self.nsamples:
+            raise ValueError("Expected {} samples, got {}.".format(self.nsamples, geno.shape[1]))
+        self.geno_file.write(geno.tobytes())
+        self.pos_file.write(positions.tobytes())
+        self.nsites += len(positions)
+
+    def flush(self, sync=False):
+        '''
+        Write out what has been written so far; if sync, also make sure it
+        has reached the disk (e.g., before recording how many sites there are).
+        '''
+        self.geno_file.flush()
+        self.pos_file.flush()
+        if sync:
+            os.fsync(self.geno_file.fileno())
+            os.fsync(self.pos_file.fileno())
+
+    def close(self):
+        self.geno_file.close()
+        self.pos_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def concatenate_genobin(prefix, pieces, samples):
+    '''
+    Concatenate the .geno and .pos files of the stores with prefixes pieces
+    (in the order given) into a single store, removing the pieces.
+    '''
+    write_samples(prefix, samples)
+    for ext in (GENO_EXT, POS_EXT):
+        with open(prefix + ext, "wb") as out:
+            for piece in pieces:
+                with open(piece + ext, "rb") as f:
+                    while True:
+                        buf = f.read(16 * 1024 * 1024)
+                        if not buf:
+                            break
+                        out.write(buf)
+    for piece in pieces:
+        for ext in (GENO_EXT, POS_EXT):
+            os.remove(piece + ext)
+
+
+def read_genobin(prefix, mmap=True):
+    '''
+    Returns (geno, positions, samples) from the store with the given prefix;
+    geno is an int8 array of shape (number of sites, number of samples),
+    with missing values equal to NA_INT8.  If mmap is True the arrays are
+    read-only memory maps of the files.
+    '''
+    files = genobin_files(prefix)
+    with open(files['samples']) as f:
+        samples = [line.rstrip("\n") for line in f]
+    if mmap and os.path.getsize(files['pos']) > 0:
+        positions = np.memmap(files['pos'], dtype='<i8', mode='r')
+        geno = np.memmap(files['geno'], dtype=np.int8, mode='r',
+                         shape=(len(positions), len(samples)))
+    else:
+        positions = np.fromfile(files['pos'], dtype='<i8')
+        geno = np.fromfile(files['geno'], dtype=np.int8).reshape((len(positions), len(samples)))
+    return geno, positions, samples
+
+
+def window_table(positions, size, type):
+    '''
+    The windows of the given size ("bp" or "snp") over the sorted positions,
+    as an int64 array with one row (first site, end site, start, end) per window.
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    if type == "snp":
+        first = np.arange(len(positions) // size, dtype=np.int64) * size
+        last = first + size
+        start, end = positions[first], positions[last - 1]
+    elif type == "bp":
+        nwin = (positions[-1] - positions[0]) // size if len(positions) > 0 else 0
+        start = positions[:1] + np.arange(nwin, dtype=np.int64) * size
+        end = start + size - 1
+        first = np.searchsorted(positions, start, side="left")
+        last = np.searchsorted(positions, end, side="right")
+    else:
+        raise ValueError("Window type must be 'bp' or 'snp'.")
+    return np.column_stack([first, last, start, end]).astype('<i8')
+
+
+def write_windows(prefix, size, type, chrom="1"):
+    '''
+    Write the window table PREFIX.windows, and the regions table
+    PREFIX.regions.csv (on chromosome chrom), for the store with the given
+    prefix, returning the number of windows.
+    '''
+    table = window_table(np.fromfile(prefix + POS_EXT, dtype='<i8'), size, type)
+    table.tofile(prefix + WINDOWS_EXT)
+    with open(prefix + REGIONS_EXT, "w") as f:
+        f.write('"chrom","start","end"\n')
+        for start, end in table[:, 2:].tolist():
+            f.write('"{}",{},{}\n'.format(chrom, start, end))
+    return len(table)
+
+
+def read_windows(prefix):
+    '''
+    The window table of the store with the given prefix (see window_table()).
+    '''
+    return np.fromfile(prefix + WINDOWS_EXT, dtype='<i8').reshape((-1, 4))
+
+
+def read_window(prefix, n, windows=None, nsamples=None):
+    '''
+    Returns (geno, positions) for the n-th window (n = 1, 2, ...) of the store
+    with the given prefix; the window table and number of samples are read
+    from the store unless given.
+    '''
+    if windows is None:
+        windows = read_windows(prefix)
+    if nsamples is None:
+        with open(prefix + SAMPLES_EXT) as f:
+            nsamples = sum(1 for _ in f)
+    if n < 1 or n > len(windows):
+        raise IndexError("No such window.")
+    first, last = (int(x) for x in windows[n - 1, :2])
+    with open(prefix + GENO_EXT, "rb") as f:
+        f.seek(first * nsamples)
+        geno = np.fromfile(f, dtype=np.int8, count=(last - first) * nsamples)
+    with open(prefix + POS_EXT, "rb") as f:
+        f.seek(first * 8)
+        positions = np.fromfile(f, dtype='<i8', count=last - first)
+    return geno.reshape((last - first, nsamples)), positions
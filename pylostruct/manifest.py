@@ -0,0 +1,99 @@
+'''
+A record of the jobs (e.g., simulated chromosomes) that a run has finished,
+so that a rerun into the same directory can skip them.
+
+The manifest is a JSON file holding, for each job, the parameters it was run
+with (including its random seed) and the size and SHA-256 checksum of each
+of its output files.  A job is complete if it has an entry with the same
+parameters and all of its outputs still exist with the recorded size and
+checksum; anything else (a missing entry, changed parameters, a missing,
+truncated, or otherwise changed output) means the job must be redone.
+
+Output paths are stored relative to the directory of the manifest, so that
+a run can be resumed from another working directory (or after the directory
+has been moved).
+
+The file is rewritten atomically after each job is recorded, so a run that is
+killed leaves the manifest as it was after the last finished job.
+'''
+
+import os
+import json
+import hashlib
+
+
+def file_checksum(path, block_size=4 * 1024 * 1024):
+    '''
+    Size and SHA-256 (hex) of the file at path.
+    '''
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return {'size' : os.path.getsize(path), 'sha256' : h.hexdigest()}
+
+
+class Manifest(object):
+
+    def __init__(self, path):
+        '''
+        The manifest stored at path (empty if there is none yet).
+        '''
+        self.path = path
+        self.dir = os.path.dirname(os.path.abspath(path))
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.jobs = json.load(f).get('jobs', {})
+
+    def _entry(self, key):
+        return self.jobs.get(str(key))
+
+    def status(self, key, params):
+        '''
+        "complete" if job key was run with params and all its outputs verify;
+        otherwise "missing", "changed" (different parameters), or "corrupt"
+        (an output is missing or does not match its checksum).
+        '''
+        entry = self._entry(key)
+        if entry is None:
+            return "missing"
+        if entry['params'] != _normalize(params):
+            return "changed"
+        for relpath, recorded in entry['outputs'].items():
+            path = os.path.join(self.dir, relpath)
+            if not os.path.exists(path) or os.path.getsize(path) != recorded['size']:
+                return "corrupt"
+            if file_checksum(path) != recorded:
+                return "corrupt"
+        return "complete"
+
+    def record(self, key, params, outputs):
+        '''
+        Record that job key has been run with params, writing the files in
+        outputs (a list of paths, or a dict mapping each path to its
+        file_checksum(), if already computed), and save the manifest.
+        '''
+        if not isinstance(outputs, dict):
+            outputs = {path : file_checksum(path) for path in outputs}
+        outputs = {os.path.relpath(os.path.abspath(path), self.dir) : checksum
+                   for path, checksum in outputs.items()}
+        self.jobs[str(key)] = {'params' : _normalize(params), 'outputs' : outputs}
+        self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({'jobs' : self.jobs}, f, indent=1, sort_keys=True)
+            f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def _normalize(params):
+    # as the parameters will be after a round trip through JSON
+    return json.loads(json.dumps(params, sort_keys=True))
@@ -0,0 +1,178 @@
+'''
+Neutral mutations added to a tree sequence and written out as genotypes in a
+single pass along the genome, without building the site and mutation tables
+and a second, mutated, tree sequence (as msprime.MutationGenerator and
+load_tables() do), so that memory use is that of the tree sequence itself,
+one tree, and one buffer of output, however many mutations there are.
+
+Mutations are placed as msprime does (infinite sites): on each tree, the
+number on the branch above each node is Poisson with mean mut_rate times the
+length of the branch (in generations) times the span of the tree (in bp),
+and their positions are uniform along the span.  The branches and their
+total length are kept up to date from the edges that change between trees
+(as in treestats.py), so the number on the whole tree is drawn first, and
+each is then put on a branch chosen in proportion to its length.  The random
+numbers are drawn differently, so the mutations are not the same as
+msprime's for the same seed.  The genotype of each sample at a mutation is 1
+if it is below the branch, and 0 otherwise.
+
+overlay_variants() gives the sites one at a time, in order along the genome;
+write_overlay() writes them to a VCF, vcf.gz, or BCF file (see vcfwriter.py)
+and/or to a binary genotype store (see genobin.py), as it goes.
+'''
+
+import numpy as np
+
+from .genobin import GenoBinWriter, write_windows
+from .tsexport import CHUNK_SITES, _alt_counts
+from .treestats import node_times
+from .vcfwriter import open_writer
+
+
+def _samples(ts):
+    return np.array(list(ts.samples()), dtype=np.int64)
+
+
+class BranchState(object):
+    '''
+    The state of a sweep along the tree sequence ts, kept up to date from
+    ts.edge_diffs() as in treestats.BranchSweep: the parent and children of
+    each node, the length of the branch above it (0 if it has no parent), and
+    the total length of the branches of the current tree.  The nodes with a
+    parent are kept in edges[:nedges] (in no particular order), with
+    slot[u] the index of u there (or -1), so that a branch can be chosen
+    without looking at the nodes not in the current tree.
+    '''
+
+    def __init__(self, ts):
+        self.time = node_times(ts)
+        nnodes = len(self.time)
+        self.parent = np.full(nnodes, -1, dtype=np.int64)
+        self.children = [[] for _ in range(nnodes)]
+        self.length = np.zeros(nnodes)
+        self.total = 0.0
+        self.edges = np.zeros(nnodes, dtype=np.int64)
+        self.slot = [-1] * nnodes
+        self.nedges = 0
+
+    def remove(self, parent, child):
+        self.total -= self.length[child]
+        self.length[child] = 0.0
+        self.parent[child] = -1
+        self.children[parent].remove(child)
+        # move the last of the current edges into the one removed
+        k = self.slot[child]
+        self.nedges -= 1
+        last = int(self.edges[self.nedges])
+        self.edges[k] = last
+        self.slot[last] = k
+        self.slot[child] = -1
+
+    def insert(self, parent, child):
+        self.parent[child] = parent
+        self.children[parent].append(child)
+        self.length[child] = self.time[parent] - self.time[child]
+        self.total += self.length[child]
+        self.edges[self.nedges] = child
+        self.slot[child] = self.nedges
+        self.nedges += 1
+
+    def mutations(self, left, right, mut_rate, rng):
+        '''
+        The positions (sorted) of the mutations on the tree over [left, right),
+        and the nodes below them: the number is Poisson with mean mut_rate times
+        the total length times the span, and each is on a branch chosen with
+        probability proportional to its length.
+        '''
+        n = rng.poisson(mut_rate * max(self.total, 0.0) * (right - left))
+        if n == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        edges = self.edges[:self.nedges]
+        cumulative = np.cumsum(self.length[edges])
+        below = edges[np.searchsorted(cumulative, rng.uniform(0, cumulative[-1], size=n), side="right")]
+        positions = rng.uniform(left, right, size=n)
+        order = np.argsort(positions, kind="mergesort")
+        return positions[order], below[order]
+
+    def samples_below(self, u, column):
+        # the columns of the samples below u (column[v] is -1 if v is not a sample)
+        out, stack = [], [u]
+        while stack:
+            v = stack.pop()
+            if column[v] >= 0:
+                out.append(column[v])
+            stack.extend(self.children[v])
+        return np.array(out, dtype=np.int64)
+
+
+def overlay_variants(ts, mut_rate, seed):
+    '''
+    For each mutation added to the tree sequence ts at rate mut_rate (per bp
+    per generation) with the given random seed, in order along the genome,
+    yields its position and the genotypes of the samples (an int8 array,
+    in the order of ts.samples()).  The array is reused: copy it to keep it.
+    '''
+    rng = np.random.RandomState(seed)
+    state = BranchState(ts)
+    samples = _samples(ts)
+    column = np.full(len(state.time), -1, dtype=np.int64)
+    column[samples] = np.arange(len(samples))
+    column = column.tolist()
+    genotypes = np.zeros(len(samples), dtype=np.int8)
+    for (left, right), edges_out, edges_in in ts.edge_diffs():
+        for edge in edges_out:
+            state.remove(edge.parent, edge.child)
+        for edge in edges_in:
+            state.insert(edge.parent, edge.child)
+        positions, below = state.mutations(left, right, mut_rate, rng)
+        # the columns of the samples below each node, found once per tree
+        columns = {}
+        for pos, u in zip(positions.tolist(), below.tolist()):
+            if u not in columns:
+                columns[u] = state.samples_below(u, column)
+            genotypes[:] = 0
+            genotypes[columns[u]] = 1
+            yield pos, genotypes
+
+
+def write_overlay(ts, mut_rate, seed, path=None, ploidy=1, chrom="1", genobin_prefix=None,
+                  window_size=None, window_type="snp", chunk_sites=CHUNK_SITES):
+    '''
+    Add mutations to ts (see overlay_variants()) and write them, in the same
+    pass, to path (if not None), as for vcfwriter.open_writer(), and to the
+    binary genotype store with prefix genobin_prefix (if not None), with its
+    tables of windows of window_size (if not None) and window_type.
+    Positions are rounded and made distinct as by msprime's write_vcf().
+    Returns the number of sites written.
+    '''
+    nsamples = len(_samples(ts))
+    nind = nsamples // ploidy
+    samples = ["msp_{}".format(k) for k in range(nind)]
+    length = ts.get_sequence_length() if hasattr(ts, "get_sequence_length") else ts.sequence_length
+    writer = None if path is None else open_writer(path, samples, [(chrom, max(1, int(round(length))))], ploidy=ploidy)
+    store = None if genobin_prefix is None else GenoBinWriter(genobin_prefix, samples=samples)
+    haps = np.empty((chunk_sites, nind * ploidy), dtype=np.int8)
+    positions = np.empty(chunk_sites, dtype=np.int64)
+    last, k, nsites = 0, 0, 0
+    for position, genotypes in overlay_variants(ts, mut_rate, seed):
+        pos = max(int(round(position)), last + 1)
+        last = pos
+        nsites += 1
+        if writer is not None:
+            writer.write(chrom, pos, ["A", "T"], genotypes[:nind * ploidy])
+        if store is not None:
+            haps[k] = genotypes[:nind * ploidy]
+            positions[k] = pos
+            k += 1
+            if k == chunk_sites:
+                store.write(positions, _alt_counts(haps, ploidy))
+                k = 0
+    if writer is not None:
+        writer.close()
+    if store is not None:
+        if k > 0:
+            store.write(positions[:k], _alt_counts(haps[:k], ploidy))
+        store.close()
+        if window_size is not None:
+            write_windows(genobin_prefix, window_size, window_type, chrom=chrom)
+    return nsites
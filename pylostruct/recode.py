@@ -0,0 +1,57 @@
+'''
+Recoding of allele codes into numeric genotypes, as done by
+lostruct::recode_numeric() (in lostruct/R/read_data.R), so that converters
+can do this while streaming through the data instead of in R.
+'''
+
+import numpy as np
+
+from .genobin import NA_INT8
+
+
+def recode_numeric(codes, ploidy=2, triallelic=True, nalleles=4):
+    '''
+    Recode a (sites x columns) integer array of allele codes, where each
+    ploidy consecutive columns are the alleles of one individual, into the
+    number of minor alleles carried by each individual, as lostruct::recode_numeric.
+    Codes 0, ..., nalleles-1 are alleles (e.g., A, C, G, T, matching the
+    "alleles" argument to recode_numeric); anything else is missing.
+
+    The major allele at a site is the most common one; ties are broken in
+    favor of the allele with the larger code, as in recode_numeric.
+    An individual is NA if any of its alleles are missing; if triallelic is
+    False, all individuals are NA at sites with more than two alleles.
+    Returns an int8 (sites x individuals) array with missing values NA_INT8.
+    '''
+    codes = np.asarray(codes)
+    nsites, ncols = codes.shape
+    if ncols % ploidy != 0:
+        raise ValueError("Number of columns must be a multiple of ploidy.")
+    missing = (codes < 0) | (codes >= nalleles)
+    totals = np.stack([(codes == k).sum(axis=1) for k in range(nalleles)], axis=1)
+    maxcounts = totals.max(axis=1)
+    # the last allele with the maximum count
+    major = nalleles - 1 - np.argmax((totals == maxcounts[:, np.newaxis])[:, ::-1], axis=1)
+    coded = (codes != major[:, np.newaxis]).astype(np.int8)
+    coded = coded.reshape((nsites, ncols // ploidy, ploidy))
+    missing = missing.reshape(coded.shape).any(axis=2)
+    out = coded.sum(axis=2, dtype=np.int8)
+    out[missing] = NA_INT8
+    if not triallelic:
+        out[(totals > 0).sum(axis=1) > 2, :] = NA_INT8
+    return out
+
+
+# text representations of values, as written by R's write.table,
+# indexed by int8 value (so negative values index from the end)
+_VALUE_TEXT = [str(k).encode() for k in range(128)] + [b"NA"] + [str(k).encode() for k in range(-127, 0)]
+
+
+def numeric_text_rows(prefixes, values):
+    '''
+    Format rows of a numeric int8 array as tab-separated text, with
+    missing values as "NA", each row preceded by the corresponding element
+    of prefixes (bytes, including any trailing tab); returns bytes.
+    '''
+    return b"".join(p + b"\t".join([_VALUE_TEXT[v] for v in row]) + b"\n"
+                    for p, row in zip(prefixes, np.asarray(values, dtype=np.int8).tolist()))
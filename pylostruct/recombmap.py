@@ -0,0 +1,57 @@
+'''
+Loading of recombination maps (as used by the simulation scripts), parsed
+once per process and cached by path, modification time, and size.
+
+A map file has a header line and then whitespace-separated columns, of which
+the second is the position (in bp) and the third the recombination rate (in
+cM/Mb), as in the deCODE maps, e.g.:
+
+    "Chromosome" "Position.bp." "Rate.cM.Mb." "Map.cM."
+    1 0 2.08762984817151 0
+
+Loading the map before starting a multiprocessing.Pool means that the worker
+processes inherit the parsed arrays (on systems that fork), instead of each
+parsing the file again.
+'''
+
+import os
+import collections
+
+import numpy as np
+
+from .fileio import fileopt
+
+RecombMap = collections.namedtuple("RecombMap", ["positions", "rates"])
+
+_cache = {}
+
+
+def load_map(path):
+    '''
+    The positions (in bp) and per-base recombination rates (converted from
+    cM/Mb) in the map file path, as a RecombMap of float arrays.
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    if key not in _cache:
+        with fileopt(path, "r") as f:
+            f.readline()
+            first = f.readline()
+            ncols = len(first.split())
+            fields = np.array((first + f.read()).split())
+        if ncols < 3 or len(fields) % ncols != 0:
+            raise ValueError("Map file " + path + " should have the same number (at least 3) of columns on each line.")
+        table = fields.reshape((-1, ncols))
+        # Rate is expressed in centimorgans per megabase, which
+        # we convert to per-base rates
+        _cache[key] = RecombMap(table[:, 1].astype(float), table[:, 2].astype(float) * 1e-8)
+    return _cache[key]
+
+
+def recombination_map(path):
+    '''
+    An msprime.RecombinationMap made from the map file path (see load_map()).
+    '''
+    import msprime
+    m = load_map(path)
+    return msprime.RecombinationMap(m.positions.tolist(), m.rates.tolist())
@@ -0,0 +1,247 @@
+'''
+Ordering of independent jobs (e.g., chromosomes of a simulation) by their
+predicted cost, and a record of what each job actually cost, so that the
+predictions improve from one run to the next.
+
+A job is described by a dict of positive numeric features (e.g., length,
+popsize, recombination rate).  A CostModel predicts a target (e.g., wall time
+in seconds) as
+
+    prior(features) * exp(a + sum_i b_i * log(features[i]))
+
+where prior() is a rough guess at how the cost scales, and the correction
+(a, b) is fit by ridge regression on the log scale to the observations in the
+history file: with no history the prediction is just the prior, and the
+correction grows as observations accumulate.
+
+The history file is tab-separated, with a header line; each row is one job,
+with its features and the observed targets.  Columns not known to the model
+are ignored, so several models can share a history file.
+
+PhaseTimer records the wall time, CPU time, and peak memory of the phases
+of a job (e.g., simulating, and writing the output).
+
+run_admitted() runs jobs in a process pool as long as their predicted memory
+use fits in a budget, so that large jobs are not started together.
+
+replicate_grid() and grouped_chunksize() split work on a few input files into
+many small jobs that are handed out so that each worker mostly reuses the
+file it has already loaded.
+'''
+
+import os
+import csv
+import time
+import queue
+import random
+import resource
+import contextlib
+import collections
+
+import numpy as np
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process (and any waited-for children), in MB.
+    '''
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 2**20 if os.uname().sysname == "Darwin" else 2**10
+    return max(self_rss, child_rss) / scale
+
+
+class PhaseTimer(object):
+    '''
+    Records, for each phase of a job, in the order run, a dict of
+    "elapsed" (wall time), "user" and "system" (CPU time), all in seconds,
+    and "max_rss_mb", the peak memory use of the process so far at the end
+    of the phase (so, including earlier phases).  If telemetry (a
+    telemetry.Telemetry) is given, "start" and "end" events are sent for each
+    phase, with the given fields (e.g., chrom=3) and, at the end, the
+    measures and any others added to the dict yielded by phase().
+    '''
+
+    def __init__(self, telemetry=None, **fields):
+        self.phases = collections.OrderedDict()
+        self.telemetry = telemetry
+        self.fields = fields
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.telemetry is not None:
+            self.telemetry.event("start", phase=name, **self.fields)
+        t0 = time.time()
+        r0 = resource.getrusage(resource.RUSAGE_SELF)
+        extra = {}
+        yield extra
+        r1 = resource.getrusage(resource.RUSAGE_SELF)
+        self.phases[name] = {'elapsed' : time.time() - t0,
+                             'user' : r1.ru_utime - r0.ru_utime,
+                             'system' : r1.ru_stime - r0.ru_stime,
+                             'max_rss_mb' : peak_rss_mb()}
+        self.phases[name].update(extra)
+        if self.telemetry is not None:
+            fields = dict(self.fields)
+            fields.update(self.phases[name])
+            self.telemetry.event("end", phase=name, **fields)
+
+    def summary(self):
+        '''
+        The elapsed time of each phase, as text for a log.
+        '''
+        return ", ".join("{}: {:.2f}".format(name, p['elapsed']) for name, p in self.phases.items())
+
+
+def read_history(path):
+    '''
+    The rows of the history file path, as a list of dicts (empty if path does
+    not exist); values that parse as numbers are converted to float.
+    '''
+    if path is None or not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            for key, value in row.items():
+                try:
+                    row[key] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            rows.append(row)
+    return rows
+
+
+def append_history(path, rows, columns):
+    '''
+    Append rows (dicts) to the history file path, writing the header first if
+    the file is new; a "time" column records when the rows were added.
+    '''
+    columns = ["time"] + [c for c in columns if c != "time"]
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, delimiter="\t", extrasaction="ignore")
+        if new:
+            writer.writeheader()
+        for row in rows:
+            out = dict(row)
+            out.setdefault("time", now)
+            writer.writerow(out)
+
+
+class CostModel(object):
+
+    def __init__(self, features, prior, target, history=(), ridge=1.0):
+        '''
+        Predicts the column target of the history from the given features,
+        using the rows of history that have all of them (and the target)
+        positive; prior is a function of a dict of features.  A larger ridge
+        keeps the prediction closer to the prior when there are few rows.
+        '''
+        self.features = list(features)
+        self.prior = prior
+        self.target = target
+        self.ridge = ridge
+        self.coef = np.zeros(len(self.features) + 1)
+        self.nobs = 0
+        self.fit(history)
+
+    def _design(self, rows):
+        return np.array([[1.0] + [np.log(float(row[f])) for f in self.features] for row in rows])
+
+    def _usable(self, row):
+        return all(_positive(row.get(f)) for f in self.features + [self.target])
+
+    def fit(self, history):
+        rows = [row for row in history if self._usable(row)]
+        self.nobs = len(rows)
+        if self.nobs == 0:
+            return self
+        X = self._design(rows)
+        y = np.log([float(row[self.target]) / self.prior(row) for row in rows])
+        # centre the features, so that the intercept is not penalized
+        mean = X[:, 1:].mean(axis=0)
+        Xc = X[:, 1:] - mean
+        b = np.linalg.solve(Xc.T.dot(Xc) + self.ridge * np.eye(Xc.shape[1]), Xc.T.dot(y - y.mean()))
+        self.coef = np.concatenate([[y.mean() - mean.dot(b)], b])
+        return self
+
+    def predict(self, features):
+        '''
+        The predicted target for a dict of features.
+        '''
+        x = self._design([features])[0]
+        return self.prior(features) * float(np.exp(x.dot(self.coef)))
+
+
+def _positive(x):
+    try:
+        return float(x) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def largest_first(jobs, cost):
+    '''
+    The keys of the dict jobs, ordered by decreasing cost(jobs[key]).
+    '''
+    return sorted(jobs, key=lambda k: cost(jobs[k]), reverse=True)
+
+
+def run_admitted(pool, func, order, memory, budget, max_running):
+    '''
+    Run func on each of the jobs in order with pool.apply_async(), yielding
+    the results as they finish; at most max_running jobs run at once, and a
+    job is only started when its predicted memory (memory(job)) and that of
+    the jobs running add up to at most budget.  When the next job in order
+    does not fit, the first one after it that does is started instead; a job
+    that alone exceeds the budget is run by itself.  If budget is None,
+    only max_running limits the jobs.
+    '''
+    done = queue.Queue()
+    waiting = list(order)
+    running = {}
+    while waiting or running:
+        while waiting and len(running) < max_running:
+            in_use = sum(running.values())
+            fits = [job for job in waiting if budget is None or in_use + memory(job) <= budget]
+            if not fits:
+                if running:
+                    break
+                fits = waiting[:1]
+            job = fits[0]
+            waiting.remove(job)
+            running[job] = memory(job)
+            pool.apply_async(func, (job,),
+                             callback=lambda result, job=job: done.put((job, result, None)),
+                             error_callback=lambda err, job=job: done.put((job, None, err)))
+        job, result, err = done.get()
+        del running[job]
+        if err is not None:
+            raise err
+        yield result
+
+
+def replicate_grid(nfiles, rates, nreps, seed):
+    '''
+    The (file, rate, replicate, seed) of every combination of the nfiles input
+    files (by index), the rates, and nreps replicates, in order of file, rate,
+    and replicate; the seeds are drawn in that order by random.randrange(1,1000)
+    after random.seed(seed).
+    '''
+    rng = random.Random(seed)
+    return [(k, rate, rep, rng.randrange(1,1000))
+            for k in range(nfiles) for rate in rates for rep in range(nreps)]
+
+
+def grouped_chunksize(ntasks, ngroups, njobs):
+    '''
+    The chunksize for Pool.imap() over ntasks tasks made of ngroups equal runs
+    of consecutive tasks (e.g., those of one file, as from replicate_grid()),
+    that keeps each run in as few chunks as still give all njobs workers a chunk.
+    '''
+    per_group = -(-ntasks // max(ngroups, 1))
+    splits = -(-njobs // max(ngroups, 1))
+    return max(1, per_group // splits)
@@ -0,0 +1,53 @@
+'''
+Nested subsets of the samples of one simulated tree sequence, so that the
+same scenario can be studied at several sample sizes without simulating it
+again: each subset is produced by simplifying the tree sequence to its
+samples, which is much cheaper than the simulation itself.
+
+The subsets are prefixes of a single ordering of the samples that takes them
+from each population in turn, so that every subset has (as nearly as
+possible) the same number from each population, and each is contained in the
+larger ones.  Samples are passed to simplify() in that order, so sample j of
+a subset (msp_j in its VCF) is the same individual in every subset it is in.
+'''
+
+import os
+
+import numpy as np
+
+
+def interleaved_order(populations):
+    '''
+    The indices of the samples, whose populations are given, in the order
+    that takes the first sample of each population, then the second of each,
+    and so on.
+    '''
+    populations = np.asarray(populations)
+    # the rank of each sample within its population, then the population itself
+    rank = np.empty(len(populations), dtype=np.int64)
+    for pop in np.unique(populations):
+        which = np.flatnonzero(populations == pop)
+        rank[which] = np.arange(len(which))
+    return np.lexsort((populations, rank))
+
+
+def nested_samples(populations, sizes):
+    '''
+    For each of the sizes, the list of that many samples (of those whose
+    populations are given) to simplify to; see interleaved_order().
+    '''
+    order = interleaved_order(populations)
+    for k in sizes:
+        if not 0 < k <= len(order):
+            raise ValueError("Cannot take a subset of {} of {} samples.".format(k, len(order)))
+    return [order[:k].tolist() for k in sizes]
+
+
+def subsample_path(path, k):
+    '''
+    The name of the output for the subset of k samples corresponding to
+    path: e.g., sim00.vcf.gz becomes sim00_k50.vcf.gz.
+    '''
+    dirname, name = os.path.split(path)
+    stem, dot, ext = name.partition(".")
+    return os.path.join(dirname, "{}_k{}{}{}".format(stem, k, dot, ext))
@@ -0,0 +1,114 @@
+'''
+Structured progress and timing events from the worker processes of a
+simulation run, sent through a queue to a single writer process, so that
+lines from different workers do not interleave and none are lost.
+
+Each event is a dict, written as one line of JSON to the telemetry file, with
+"time" (seconds since the epoch), "pid", and "event", which is one of
+
+    "start", "end"  the beginning and end of a phase (e.g., "simulate") of a
+                    job (e.g., a chromosome); "end" events have the measures
+                    recorded by schedule.PhaseTimer (elapsed, user, system,
+                    max_rss_mb), and any others given (e.g., bytes written)
+    "info"          other facts about a job (e.g., the number of trees)
+    "log"           a message, which is also written to the text log (if any)
+
+and any other fields given (e.g., "chrom", "phase").  When the run is done,
+close() writes a table summarizing the "end" events of each phase to the
+summary file and the text log.
+
+The writer process must be started (by creating the Telemetry) before the
+worker processes are forked, so that they inherit the queue; nothing else
+should write to the text log while it runs.
+'''
+
+import os
+import json
+import time
+import collections
+import multiprocessing
+
+# measures summed over the jobs in the summary table
+SUMMED = ['elapsed', 'user', 'system', 'bytes']
+
+
+class Telemetry(object):
+
+    def __init__(self, path, log=None, summary_path=None, mode="w"):
+        '''
+        Write events to path (opened with mode, "w" or "a"), log messages to
+        the file object log, and the summary table to summary_path.
+        '''
+        self.path = path
+        self.queue = multiprocessing.Queue()
+        if log is not None:
+            log.flush()
+        self.writer = multiprocessing.Process(target=_writer, args=(self.queue, path, mode, log, summary_path))
+        self.writer.start()
+
+    def event(self, event, **fields):
+        fields.update(time=time.time(), pid=os.getpid(), event=event)
+        self.queue.put(fields)
+
+    def log(self, message, **fields):
+        self.event("log", message=message, **fields)
+
+    def info(self, **fields):
+        self.event("info", **fields)
+
+    def close(self):
+        '''
+        Stop the writer, once it has written all events and the summary.
+        '''
+        self.queue.put(None)
+        self.writer.join()
+        self.queue.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def summary_table(ends):
+    '''
+    A tab-separated table with a row for each phase: the number of "end"
+    events, the totals of the SUMMED measures, and the largest elapsed time
+    and max_rss_mb.
+    '''
+    phases = collections.OrderedDict()
+    for ev in ends:
+        phases.setdefault(ev.get('phase'), []).append(ev)
+    lines = ["\t".join(["phase", "n"] + ["total_" + m for m in SUMMED] + ["max_elapsed", "max_rss_mb"])]
+    for phase, evs in phases.items():
+        row = [str(phase), str(len(evs))]
+        row += ["{:.2f}".format(sum(ev.get(m, 0) for ev in evs)) if m != 'bytes'
+                else str(sum(ev.get(m, 0) for ev in evs)) for m in SUMMED]
+        row += ["{:.2f}".format(max(ev.get('elapsed', 0) for ev in evs)),
+                "{:.1f}".format(max(ev.get('max_rss_mb', 0) for ev in evs))]
+        lines.append("\t".join(row))
+    return "\n".join(lines) + "\n"
+
+
+def _writer(queue, path, mode, log, summary_path):
+    ends = []
+    with open(path, mode) as out:
+        while True:
+            ev = queue.get()
+            if ev is None:
+                break
+            out.write(json.dumps(ev) + "\n")
+            out.flush()
+            if ev['event'] == "end":
+                ends.append(ev)
+            elif ev['event'] == "log" and log is not None:
+                log.write(ev['message'])
+                log.flush()
+    summary = summary_table(ends)
+    if summary_path is not None:
+        with open(summary_path, "w") as f:
+            f.write(summary)
+    if log is not None:
+        log.write("Summary of phases (seconds, bytes, MB):\n" + summary)
+        log.flush()
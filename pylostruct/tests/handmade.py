@@ -0,0 +1,54 @@
+'''
+A small tree sequence written out by hand, with the parts of the msprime and
+tskit interface that treestats.py and mutoverlay.py use, so that they can be
+tested against values worked out on paper without msprime installed.
+
+Four samples, 0-3 (0 and 1 in population 0, 2 and 3 in population 1), on a
+sequence of length 10, with two trees:
+
+    [0, 4):   6 (t=4)               [4, 10):      6 (t=4)
+             /      \\                           /      \\
+          4 (t=1)  5 (t=2)                  7 (t=3)    3
+          /  \\     /  \\                     /    \\
+         0    1   2    3                 4 (t=1)  2
+                                         /  \\
+                                        0    1
+'''
+
+import collections
+
+Node = collections.namedtuple("Node", ["time", "population"])
+Edge = collections.namedtuple("Edge", ["left", "right", "parent", "child"])
+
+NODES = [Node(0, 0), Node(0, 0), Node(0, 1), Node(0, 1), Node(1, 0), Node(2, 1), Node(4, 0), Node(3, 0)]
+EDGES = [Edge(0, 10, 4, 0), Edge(0, 10, 4, 1), Edge(0, 4, 5, 2), Edge(0, 4, 5, 3), Edge(0, 4, 6, 4),
+         Edge(0, 4, 6, 5), Edge(4, 10, 7, 4), Edge(4, 10, 7, 2), Edge(4, 10, 6, 7), Edge(4, 10, 6, 3)]
+
+# the mean TMRCA of pairs within population 0, between the two, and within 1, on each tree
+TMRCA = {(0, 4): (1.0, 4.0, 2.0), (4, 10): (1.0, 3.5, 4.0)}
+
+# the sets of samples below each branch, and the length of the branch times the span of the tree
+CLADES = {(0,): 1 * 4 + 1 * 6, (1,): 1 * 4 + 1 * 6, (2,): 2 * 4 + 3 * 6, (3,): 2 * 4 + 4 * 6,
+          (0, 1): 3 * 4 + 2 * 6, (2, 3): 2 * 4, (0, 1, 2): 1 * 6}
+
+
+class HandmadeTreeSequence(object):
+
+    def __init__(self, nodes=NODES, edges=EDGES, sequence_length=10.0):
+        self.nodes = nodes
+        self.edges = edges
+        self.sequence_length = sequence_length
+        self.num_nodes = len(nodes)
+
+    def node(self, u):
+        return self.nodes[u]
+
+    def samples(self):
+        return [u for u, node in enumerate(self.nodes) if node.time == 0]
+
+    def edge_diffs(self):
+        breaks = sorted(set([e.left for e in self.edges] + [e.right for e in self.edges]))
+        for left, right in zip(breaks[:-1], breaks[1:]):
+            edges_out = [e for e in self.edges if e.right == left]
+            edges_in = [e for e in self.edges if e.left == left]
+            yield (left, right), edges_out, edges_in
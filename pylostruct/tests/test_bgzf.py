@@ -0,0 +1,108 @@
+'''
+BGZF reading and writing in bgzf.py: BgzfWriter to BgzfReader (and gzip)
+round trips, virtual offsets, and region queries against an htslib index of
+one of lostruct's test files.
+'''
+
+import os
+import gzip
+
+import numpy as np
+import pytest
+
+from pylostruct.bgzf import (BGZF_BLOCK_SIZE, BGZF_EOF, BgzfIndex, BgzfReader, BgzfWriter, block_offsets,
+                             find_index, is_bgzf, parse_region, region_lines)
+
+TESTTHAT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "lostruct", "tests", "testthat")
+
+
+def some_lines(n, seed=1):
+    rng = np.random.RandomState(seed)
+    return [("line {}\t{}\n".format(k, "x" * rng.randint(0, 300))).encode() for k in range(n)]
+
+
+def write_lines(path, lines, threads=1):
+    # returns the virtual offset of the start of each line
+    offsets = []
+    with BgzfWriter(path, threads=threads) as f:
+        upos = []
+        for line in lines:
+            upos.append(f.tell())
+            f.write(line)
+            # end blocks at odd places, as a writer of an indexed file does
+            if len(upos) % 97 == 0:
+                f.flush()
+                offsets += [f.virtual_offset(u) for u in upos]
+                upos = []
+        f.flush()
+        offsets += [f.virtual_offset(u) for u in upos]
+    return offsets
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_roundtrip(tmp_path, threads):
+    path = str(tmp_path / "x.gz")
+    lines = some_lines(2000)
+    write_lines(path, lines, threads=threads)
+    data = b"".join(lines)
+    assert len(data) > 4 * BGZF_BLOCK_SIZE
+    assert is_bgzf(path)
+    with gzip.open(path) as f:
+        assert f.read() == data
+    with BgzfReader(path, prefetch_blocks=2) as f:
+        assert f.read() == data
+    with BgzfReader(path) as f:
+        assert list(f) == lines
+    with open(path, "rb") as f:
+        assert f.read()[-len(BGZF_EOF):] == BGZF_EOF
+    blocks = block_offsets(path)
+    assert sum(size for _, size in blocks) == len(data)
+    assert all(size <= BGZF_BLOCK_SIZE for _, size in blocks)
+
+
+def test_virtual_offsets(tmp_path):
+    path = str(tmp_path / "x.gz")
+    lines = some_lines(1000)
+    offsets = write_lines(path, lines)
+    with BgzfReader(path) as f:
+        for k in [0, 1, 96, 97, 500, 998, 3]:
+            f.seek_virtual(offsets[k])
+            assert f.tell_virtual() == offsets[k]
+            assert f.readline() == lines[k]
+            assert f.tell_virtual() == offsets[k + 1]
+        f.seek_virtual(offsets[10])
+        assert f.read_to(offsets[200]) == b"".join(lines[10:200])
+        f.seek_virtual(offsets[10])
+        assert f.read_to(offsets[200], 5) == lines[10][:5]
+
+
+def test_not_bgzf(tmp_path):
+    path = str(tmp_path / "x.gz")
+    with gzip.open(path, "wb") as f:
+        f.write(b"hello\n")
+    assert not is_bgzf(path)
+    with pytest.raises(ValueError):
+        block_offsets(path)
+
+
+def test_parse_region():
+    assert parse_region("LG1") == ("LG1", None, None)
+    assert parse_region("LG1:1,000") == ("LG1", 1000, None)
+    assert parse_region("LG1:1,000-2000") == ("LG1", 1000, 2000)
+    assert parse_region("chr:un:5-") == ("chr:un", 5, None)
+
+
+def test_region_lines():
+    # regions of lostruct's small_test.vcf.gz, with its index from htslib
+    path = os.path.join(TESTTHAT, "small_test.vcf.gz")
+    with gzip.open(path) as f:
+        records = [line for line in f if not line.startswith(b"#")]
+    index = BgzfIndex(find_index(path))
+    assert index.names == ["LG1", "LG2"]
+    for chrom, start, end in [("LG1", None, None), ("LG2", None, None), ("LG1", 9388766, 16550984),
+                              ("LG2", 1, 5000000), ("LG2", 20000000, None), ("LG3", None, None)]:
+        expected = [line for line in records if line.split(b"\t")[0] == chrom.encode()
+                    and (start is None or int(line.split(b"\t")[1]) >= start)
+                    and (end is None or int(line.split(b"\t")[1]) <= end)]
+        with BgzfReader(path) as reader:
+            assert list(region_lines(reader, index, chrom, start, end)) == expected
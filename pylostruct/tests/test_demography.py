@@ -0,0 +1,50 @@
+'''
+demography.SteppingStone against migration matrices built by comparing every
+pair of populations.
+'''
+
+import numpy as np
+import pytest
+
+from pylostruct.demography import Phase, SteppingStone
+
+
+def all_pairs(m, n, migr, barrier=None):
+    M = np.zeros((m * n, m * n))
+    for u in range(m * n):
+        for v in range(m * n):
+            (ru, cu), (rv, cv) = divmod(u, n), divmod(v, n)
+            if abs(ru - rv) + abs(cu - cv) == 1 and not (barrier is not None and min(ru, rv) == barrier and ru != rv):
+                M[u, v] = migr
+    return M
+
+
+@pytest.mark.parametrize("m,n", [(1, 1), (1, 5), (4, 1), (3, 3), (4, 6), (7, 2)])
+def test_migration_matrix(m, n):
+    grid = SteppingStone(m, n, migr=0.01)
+    assert np.array_equal(np.array(grid.migration_matrix()), all_pairs(m, n, 0.01))
+    M = np.array(grid.migration_matrix(diagonal=True))
+    assert np.allclose(M.sum(axis=1), 1)
+    assert np.array_equal(M - np.diag(np.diag(M)), all_pairs(m, n, 0.01))
+
+
+@pytest.mark.parametrize("m,n,barrier", [(2, 2, 0), (4, 3, 1), (6, 6, 2), (5, 1, 3)])
+def test_barrier(m, n, barrier):
+    grid = SteppingStone(m, n, migr=0.02, barrier=barrier)
+    assert np.array_equal(grid.migration_array(barrier=True), all_pairs(m, n, 0.02, barrier))
+    # the barrier is only there when asked for
+    assert np.array_equal(grid.migration_array(), all_pairs(m, n, 0.02))
+
+
+def test_bad_barrier():
+    for m, barrier in [(1, 0), (3, 2), (3, -1)]:
+        with pytest.raises(ValueError):
+            SteppingStone(m, barrier=barrier)
+
+
+def test_simupop_phases():
+    grid = SteppingStone(4, 3, migr=0.01, barrier=1)
+    phases = grid.simupop_phases([Phase(0, 10, 0.01, False), Phase(11, 20, 0.03, True)])
+    assert [(begin, end) for _, begin, end in phases] == [(0, 10), (11, 20)]
+    assert phases[0][0] == grid.migration_matrix(diagonal=True)
+    assert phases[1][0] == grid.migration_matrix(barrier=True, diagonal=True, migr=0.03)
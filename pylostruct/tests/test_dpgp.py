@@ -0,0 +1,110 @@
+'''
+dpgp/DPGP_seq_to_SNP.py: the memory-mapped engine against the original
+text mode, on small .seq files, and DPGP_parallel_seq_to_SNP.py against both.
+'''
+
+import importlib.util
+import io
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pytest
+
+DPGP = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "dpgp")
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(DPGP, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+seq_to_snp = load_script("DPGP_seq_to_SNP")
+
+
+def write_seqs(tmp_path, nseqs=7, length=503, seed=1, name="s{}.seq"):
+    '''
+    Write .seq files of random bases, some of whose columns are entirely or
+    all but one N, and return their names.
+    '''
+    rng = np.random.RandomState(seed)
+    seqs = rng.choice(list("ACGTN"), size=(nseqs, length), p=[.05, .05, .05, .8, .05])
+    seqs[:, 10:20] = "N"
+    seqs[0, 12] = "A"
+    seqs[1:3, 14] = ["A", "C"]
+    seqs[:, 30] = "G"
+    seqs[3, 30] = "N"
+    fns = []
+    for k, row in enumerate(seqs):
+        fn = str(tmp_path / name.format(k))
+        with open(fn, "w") as f:
+            # with and without a final newline or trailing space
+            f.write("".join(row) + ["\n", "", " \n"][k % 3])
+        fns.append(fn)
+    return fns
+
+
+def text_output(fns):
+    out = io.StringIO()
+    seq_to_snp.text_seq_to_snp(fns, out=out)
+    return out.getvalue().encode()
+
+
+def mmap_output(fns, chunk_size):
+    out = io.BytesIO()
+    nsnps = seq_to_snp.mmap_seq_to_snp(fns, out=out, chunk_size=chunk_size)
+    return out.getvalue(), nsnps
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1000000])
+def test_mmap_vs_text(tmp_path, chunk_size):
+    fns = write_seqs(tmp_path)
+    expected = text_output(fns)
+    out, nsnps = mmap_output(fns, chunk_size)
+    assert out == expected
+    assert nsnps == len(expected.splitlines()) - 1
+    positions = [int(line.split(b"\t")[0]) for line in out.splitlines()[1:]]
+    # N-masked columns (1-based positions 11-20) are polymorphic only if two bases show through
+    assert [p for p in positions if 11 <= p <= 20] == [15]
+    assert 31 not in positions
+
+
+def test_empty(tmp_path):
+    fns = []
+    for k in range(3):
+        fns.append(str(tmp_path / "e{}.seq".format(k)))
+        open(fns[-1], "w").close()
+    expected = text_output(fns)
+    assert expected.splitlines() == [b"\t".join(fn[:-4].encode() for fn in fns)]
+    assert mmap_output(fns, 10) == (expected, 0)
+
+
+def run_parallel(*args):
+    subprocess.run([sys.executable, os.path.join(DPGP, "DPGP_parallel_seq_to_SNP.py")] + list(args),
+                   check=True, stderr=subprocess.PIPE)
+
+
+def test_parallel_arms(tmp_path):
+    # slices that do and do not line up with the chunks, merged across three workers
+    fns = {arm: write_seqs(tmp_path, length=length, seed=len(arm), name="s{}_Chr" + arm + ".seq")
+           for arm, length in [("2L", 503), ("X", 97)]}
+    run_parallel("-j", "3", "-s", "40", "-c", "16", "-a", "2L", "X",
+                 "-p", str(tmp_path / "s*_Chr{arm}.seq"), "-o", str(tmp_path / "out_{arm}.txt"))
+    for arm in fns:
+        with open(str(tmp_path / "out_{}.txt".format(arm)), "rb") as f:
+            assert f.read() == text_output(sorted(fns[arm]))
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        ["out_2L.txt", "out_X.txt"] + [os.path.basename(fn) for arm in fns for fn in fns[arm]])
+
+
+def test_parallel_recode(tmp_path):
+    fns = write_seqs(tmp_path, nseqs=8)
+    outfile = str(tmp_path / "recoded.txt")
+    run_parallel("-j", "4", "-s", "50", "--recode", "-P", "2", "-o", outfile, *fns)
+    serial = io.BytesIO()
+    seq_to_snp.mmap_seq_to_snp(fns, out=serial, recode=True, ploidy=2)
+    with open(outfile, "rb") as f:
+        assert f.read() == serial.getvalue()
@@ -0,0 +1,53 @@
+'''
+fileio.fileopt(): plain, gzipped (BGZF), and standard input and output.
+'''
+
+import io
+import gzip
+import sys
+
+from pylostruct.bgzf import is_bgzf
+from pylostruct.fileio import fileopt
+
+
+def test_plain(tmp_path):
+    path = str(tmp_path / "x.txt")
+    with fileopt(path, "w") as f:
+        f.write("a\tb\n")
+    with fileopt(path, "r") as f:
+        assert f.read() == "a\tb\n"
+
+
+def test_gz(tmp_path):
+    path = str(tmp_path / "x.vcf.gz")
+    text = "".join("line {}\n".format(k) for k in range(100000))
+    with fileopt(path, "w") as f:
+        f.write(text)
+    assert is_bgzf(path)
+    with gzip.open(path, "rt") as f:
+        assert f.read() == text
+    with fileopt(path, "r") as f:
+        assert f.read() == text
+    with fileopt(path, "wb", threads=1) as f:
+        f.write(b"binary\n")
+    with fileopt(path, "rb") as f:
+        assert f.read() == b"binary\n"
+
+
+def test_stdout(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", out)
+    with fileopt("-", "w") as f:
+        f.write("hello\n")
+    f.close()
+    # still open, for the rest of the process
+    assert not out.closed
+    print("again")
+    assert out.getvalue() == "hello\nagain\n"
+
+
+def test_stdin(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO("a\nb\n"))
+    with fileopt("-", "r") as f:
+        assert list(f) == ["a\n", "b\n"]
+    assert not sys.stdin.closed
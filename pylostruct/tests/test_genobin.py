@@ -0,0 +1,114 @@
+'''
+The binary genotype store in genobin.py: writing it in blocks, reading it
+back whole or a window at a time, and the window tables.
+'''
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import (NA_INT8, GenoBinWriter, concatenate_genobin, read_genobin, read_window,
+                                read_windows, window_table, windowed_prefix, vcf_stem, write_windows)
+
+SAMPLES = ["a", "b", "c", "d"]
+
+
+def random_store(nsites, seed=1):
+    rng = np.random.RandomState(seed)
+    positions = np.cumsum(rng.randint(1, 50, size=nsites))
+    geno = rng.randint(0, 3, size=(nsites, len(SAMPLES))).astype(np.int8)
+    geno[rng.uniform(size=geno.shape) < 0.05] = NA_INT8
+    return positions, geno
+
+
+def write_store(prefix, positions, geno, block=7):
+    with GenoBinWriter(prefix, samples=SAMPLES) as writer:
+        for k in range(0, len(positions), block):
+            writer.write(positions[k:k + block], geno[k:k + block])
+    return writer.nsites
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_roundtrip(tmp_path, mmap):
+    prefix = str(tmp_path / "x")
+    positions, geno = random_store(100)
+    assert write_store(prefix, positions, geno) == 100
+    g, p, samples = read_genobin(prefix, mmap=mmap)
+    assert samples == SAMPLES
+    assert np.array_equal(p, positions)
+    assert np.array_equal(g, geno)
+
+
+def test_resume(tmp_path):
+    # a store truncated to its first sites and appended to is as if written at once
+    prefix = str(tmp_path / "x")
+    positions, geno = random_store(50)
+    write_store(prefix, positions, geno)
+    with GenoBinWriter(prefix, samples=SAMPLES, resume_sites=20) as writer:
+        writer.write(positions[20:], geno[20:])
+    g, p, _ = read_genobin(prefix)
+    assert np.array_equal(p, positions)
+    assert np.array_equal(g, geno)
+
+
+def test_concatenate(tmp_path):
+    positions, geno = random_store(60)
+    pieces = [str(tmp_path / "piece{}".format(k)) for k in range(3)]
+    for k, piece in enumerate(pieces):
+        with GenoBinWriter(piece) as writer:
+            writer.write(positions[20 * k:20 * (k + 1)], geno[20 * k:20 * (k + 1)])
+    prefix = str(tmp_path / "x")
+    concatenate_genobin(prefix, pieces, SAMPLES)
+    g, p, samples = read_genobin(prefix, mmap=False)
+    assert samples == SAMPLES
+    assert np.array_equal(p, positions)
+    assert np.array_equal(g, geno)
+
+
+def test_wrong_shape(tmp_path):
+    with GenoBinWriter(str(tmp_path / "x"), samples=SAMPLES) as writer:
+        with pytest.raises(ValueError):
+            writer.write([1, 2], np.zeros((2, 3)))
+        with pytest.raises(ValueError):
+            writer.write([1, 2, 3], np.zeros((2, 4)))
+
+
+def test_window_table_snp():
+    positions = np.array([3, 5, 8, 13, 21, 34, 55])
+    table = window_table(positions, 3, "snp")
+    # the leftover site at the end is trimmed, as by lostruct::vcf_windower()
+    assert table.tolist() == [[0, 3, 3, 8], [3, 6, 13, 34]]
+
+
+def test_window_table_bp():
+    positions = np.array([10, 12, 19, 20, 35, 41, 60, 61])
+    table = window_table(positions, 10, "bp")
+    assert table.tolist() == [[0, 3, 10, 19], [3, 4, 20, 29], [4, 5, 30, 39], [5, 6, 40, 49], [6, 6, 50, 59]]
+    with pytest.raises(ValueError):
+        window_table(positions, 10, "cM")
+
+
+@pytest.mark.parametrize("size,type", [(9, "snp"), (200, "bp")])
+def test_read_window(tmp_path, size, type):
+    prefix = str(tmp_path / "x")
+    positions, geno = random_store(100)
+    write_store(prefix, positions, geno)
+    nwin = write_windows(prefix, size, type, chrom="2")
+    windows = read_windows(prefix)
+    assert len(windows) == nwin
+    with open(prefix + ".regions.csv") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == '"chrom","start","end"'
+    assert lines[1:] == ['"2",{},{}'.format(start, end) for start, end in windows[:, 2:].tolist()]
+    for n in range(1, nwin + 1):
+        g, p = read_window(prefix, n)
+        first, last, start, end = windows[n - 1].tolist()
+        assert np.array_equal(p, positions[first:last])
+        assert np.array_equal(g, geno[first:last])
+        assert np.all((p >= start) & (p <= end))
+    with pytest.raises(IndexError):
+        read_window(prefix, nwin + 1)
+
+
+def test_names():
+    assert windowed_prefix("sim00", 1000, "snp") == "sim00.snp1000"
+    assert [vcf_stem(x) for x in ["a/sim.vcf", "sim.vcf.gz", "sim.bcf", "sim"]] == ["a/sim", "sim", "sim", "sim"]
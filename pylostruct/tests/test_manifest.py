@@ -0,0 +1,47 @@
+'''
+manifest.Manifest: which jobs are complete, and why the others are not.
+'''
+
+import os
+import json
+
+from pylostruct.manifest import Manifest, file_checksum
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def test_status(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    out = write(str(tmp_path / "chrom1.vcf"), "data\n")
+    params = {'length': 1e6, 'seed': 12, 'rates': [1, 2]}
+    m = Manifest(path)
+    assert m.status(1, params) == "missing"
+    m.record(1, params, [out])
+    assert m.status(1, params) == "complete"
+    assert m.status("1", dict(params)) == "complete"
+    assert m.status(1, dict(params, seed=13)) == "changed"
+    # reloaded from the file
+    assert Manifest(path).status(1, params) == "complete"
+    write(out, "datb\n")
+    assert Manifest(path).status(1, params) == "corrupt"
+    write(out, "data")
+    assert Manifest(path).status(1, params) == "corrupt"
+    os.remove(out)
+    assert Manifest(path).status(1, params) == "corrupt"
+
+
+def test_relative_paths(tmp_path):
+    # a run can be resumed after the directory is moved
+    base = tmp_path / "run"
+    base.mkdir()
+    out = write(str(base / "chrom2.trees"), "trees\n")
+    Manifest(str(base / "manifest.json")).record(2, {'seed': 1}, {out: file_checksum(out)})
+    with open(str(base / "manifest.json")) as f:
+        assert list(json.load(f)['jobs']['2']['outputs']) == ["chrom2.trees"]
+    os.rename(str(base), str(tmp_path / "moved"))
+    assert Manifest(str(tmp_path / "moved" / "manifest.json")).status(2, {'seed': 1}) == "complete"
+    assert not os.path.exists(str(tmp_path / "moved" / "manifest.json.tmp"))
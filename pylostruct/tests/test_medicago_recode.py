@@ -0,0 +1,204 @@
+'''
+medicago/Medicago_VCF_recode.py: the batched and parallel conversions
+against the line-by-line conversion of the default mode, and resuming an
+interrupted conversion.
+'''
+
+import importlib.util
+import io
+import os
+import json
+import sys
+import subprocess
+
+import numpy as np
+import pytest
+
+from pylostruct.bgzf import BgzfWriter, block_offsets
+from pylostruct.genobin import read_genobin
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "medicago", "Medicago_VCF_recode.py")
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("Medicago_VCF_recode", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+recode = load_script()
+
+
+def vcf_lines(nlines, nsamples, seed, newline="\n"):
+    rng = np.random.RandomState(seed)
+    lines = []
+    for k in range(nlines):
+        gts = ["{}{}{}:{}".format(rng.choice(list("01.")), rng.choice(["/", "|"]), rng.choice(list("0123")),
+                                  rng.randint(100)) for _ in range(nsamples)]
+        lines.append("\t".join(["chr1", str(100 + 7 * k), "snp" + str(k), "A", "T", "50", "PASS", ".", "GT:DP"]
+                               + gts) + newline)
+    return lines
+
+
+def malformed(lines):
+    '''
+    Spoil some of lines, each in a way that the default mode may or may not accept.
+    '''
+    lines = list(lines)
+    fields = [x.rstrip("\r\n").split("\t") for x in lines]
+    newline = lines[0][len(lines[0].rstrip("\r\n")):]
+    fields[3][10] = "0/1/" + fields[3][10]              # GT too long
+    fields[4][-1] += " "                                # trailing whitespace
+    fields[5][6:8] = ["PASS."]                          # a tab short
+    fields[9].append("")                                # a tab too many
+    fields[10][9] = fields[10][9][0] + fields[10][9][2:]  # GT too short
+    fields[-1][9] = fields[-1][9].replace(":", "\t")     # GT ends the field
+    lines = ["\t".join(x) + newline for x in fields]
+    lines[11] = lines[11].rstrip("\r\n") + "\r\n"       # CRLF
+    return lines
+
+
+def line_by_line(lines):
+    '''
+    The default output of _util(), and the lines it fails on.
+    '''
+    out, bad = io.StringIO(), []
+    for line in io.TextIOWrapper(io.BytesIO("".join(lines).encode())):
+        try:
+            recode._util(line, out)
+        except Exception:
+            bad.append(line)
+    return out.getvalue().encode(), bad
+
+
+def batched(lines, block_size):
+    out, bad = io.BytesIO(), []
+    sink = recode._TextSink(out)
+    counter = recode.Throughput(interval=float("inf"))
+    ntabs = lines[0].count("\t")
+    data = "".join(lines).encode()
+    for chunk in recode.file_chunks(io.BytesIO(data).read, block_size):
+        recode.convert_lines(chunk, ntabs, sink, counter, bad.append)
+    sink.flush()
+    return out.getvalue(), bad, counter.nsites
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+@pytest.mark.parametrize("spoil", [False, True])
+@pytest.mark.parametrize("block_size", [500, 1 << 20])
+def test_batched_matches_line_by_line(newline, spoil, block_size):
+    lines = vcf_lines(60, 5, seed=len(newline), newline=newline)
+    if spoil:
+        lines = malformed(lines)
+    expected, expected_bad = line_by_line(lines)
+    out, bad, nsites = batched(lines, block_size)
+    assert out == expected
+    assert bad == expected_bad
+    assert nsites == out.count(b"\n")
+    if spoil:
+        assert len(bad) > 0
+
+
+def test_extract_block_mask():
+    lines = malformed(vcf_lines(20, 3, seed=1))
+    data = np.frombuffer("".join(lines).encode(), dtype=np.uint8)
+    gt, ok, ends = recode.extract_block(data, lines[0].count("\t"))
+    assert ok.tolist() == [k not in (3, 4, 5, 9, 10, 11, 19) for k in range(20)]
+    assert np.array_equal(ends, np.cumsum([len(x) for x in lines]) - 1)
+    # the parsed lines come out as _util() would write them
+    good = [k for k in range(20) if ok[k]]
+    for k in good:
+        assert gt.lines(k, k + 1).text() == recode._format(lines[k]).encode()
+    assert gt.lines(0, 3).prefixes() == [x.encode() for x in
+                                         ("100\tsnp0\t", "107\tsnp1\t", "114\tsnp2\t")]
+
+
+def write_vcf(path, lines):
+    header = "##fileformat=VCFv4.2\n" + "\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+        + ["ind{}".format(k) for k in range(lines[0].count("\t") - 8)]) + "\n"
+    with (BgzfWriter(path) if path.endswith(".gz") else open(path, "wb")) as f:
+        f.write((header + "".join(lines)).encode())
+
+
+def run_script(*args):
+    return subprocess.run([sys.executable, SCRIPT] + list(args), check=True, stdout=subprocess.PIPE).stdout
+
+
+@pytest.mark.parametrize("name", ["many.vcf", "many.vcf.gz"])
+def test_shards(tmp_path, name):
+    path = str(tmp_path / name)
+    write_vcf(path, vcf_lines(3000, 40, seed=3))
+    serial = run_script(path)
+    header, first, data_start = recode.scan_header(path)
+    bounds = recode.shard_bounds(path, data_start, 7)
+    assert len(bounds) == 7
+    if name.endswith(".gz"):
+        # lines run across block boundaries, so shards start partway into blocks
+        assert len(block_offsets(path)) > 10
+        assert all(a & 0xffff > 0 for a, _ in bounds[1:])
+    else:
+        # the even split points are mid-line
+        size = os.path.getsize(path)
+        even = [data_start + (k * (size - data_start)) // 7 for k in range(1, 7)]
+        assert not set(even) & set(a for a, _ in bounds)
+    assert run_script("--njobs", "3", "--nshards", "7", "--block_size", "0.01", path) == serial
+    assert (run_script("--njobs", "3", "--nshards", "7", "--recode", path)
+            == run_script("--recode", path))
+    run_script("--binary", str(tmp_path / "serial"), path)
+    run_script("--njobs", "2", "--nshards", "5", "--binary", str(tmp_path / "sharded"), path)
+    (geno, pos, samples), (shard_geno, shard_pos, shard_samples) = (
+        read_genobin(str(tmp_path / "serial")), read_genobin(str(tmp_path / "sharded")))
+    assert np.array_equal(geno, shard_geno) and np.array_equal(pos, shard_pos)
+    assert samples == shard_samples and len(pos) == 3000
+
+
+# runs the script, but kills the process just after the given number of
+# chunks have been converted
+CRASH = """
+import importlib.util, os, sys
+spec = importlib.util.spec_from_file_location("Medicago_VCF_recode", sys.argv[1])
+recode = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(recode)
+ncalls, crash_after, convert_lines = [0], int(sys.argv[2]), recode.convert_lines
+def crashing(*args):
+    convert_lines(*args)
+    ncalls[0] += 1
+    if ncalls[0] == crash_after:
+        # what was written since the checkpoint reached the disk
+        args[2].flush()
+        args[4].f.flush()
+        os._exit(3)
+recode.convert_lines = crashing
+sys.argv = sys.argv[:1] + sys.argv[3:]
+recode.main()
+"""
+
+
+@pytest.mark.parametrize("name", ["bad.vcf", "bad.vcf.gz"])
+def test_resume(tmp_path, name):
+    path = str(tmp_path / name)
+    # malformed lines all along, to be quarantined
+    write_vcf(path, sum((malformed(vcf_lines(100, 5, seed=k)) for k in range(20)), []))
+    options = ["--block_size", "0.002", "--checkpoint_interval", "0"]
+    whole = [str(tmp_path / x) for x in ("whole.txt", "whole.ckpt", "whole.quarantine")]
+    run_script("--checkpoint", whole[1], "--outfile", whole[0], "--quarantine", whole[2], *(options + [path]))
+    parts = [str(tmp_path / x) for x in ("part.txt", "part.ckpt", "part.quarantine")]
+    args = ["--checkpoint", parts[1], "--outfile", parts[0], "--quarantine", parts[2]] + options + [path]
+    crash = subprocess.run([sys.executable, "-c", CRASH, SCRIPT, "37"] + args, stdout=subprocess.PIPE)
+    assert crash.returncode == 3
+    with open(parts[1]) as f:
+        state = json.load(f)
+    assert not state['done'] and state['nsites'] > 0 and state['nquarantined'] > 0
+    # the crash left output after the checkpoint, which resuming discards
+    assert os.path.getsize(parts[0]) > state['output_bytes']
+    run_script("--resume", *args)
+    for a, b in zip(whole, parts):
+        with open(a, "rb") as f, open(b, "rb") as g:
+            if a.endswith(".ckpt"):
+                assert json.load(f)['nsites'] == json.load(g)['nsites']
+            else:
+                assert f.read() == g.read()
+    with open(whole[2]) as f:
+        assert 0 < state['nquarantined'] < len(f.readlines())
@@ -0,0 +1,88 @@
+'''
+mutoverlay.py: the mutations added to a small hand-made tree sequence, and
+writing them out.
+'''
+
+import gzip
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import read_genobin, read_windows
+from pylostruct.mutoverlay import BranchState, overlay_variants, write_overlay
+from pylostruct.tests.handmade import CLADES, HandmadeTreeSequence
+
+
+def test_branch_state():
+    ts = HandmadeTreeSequence()
+    state = BranchState(ts)
+    totals = []
+    for _, edges_out, edges_in in ts.edge_diffs():
+        for edge in edges_out:
+            state.remove(edge.parent, edge.child)
+        for edge in edges_in:
+            state.insert(edge.parent, edge.child)
+        totals.append(state.total)
+        assert state.total == state.length.sum()
+        edges = state.edges[:state.nedges].tolist()
+        assert sorted(edges) == np.flatnonzero(state.parent >= 0).tolist()
+        assert all(state.slot[u] == k for k, u in enumerate(edges))
+    assert totals == [11.0, 12.0]
+    column = [0, 1, 2, 3, -1, -1, -1, -1]
+    assert sorted(state.samples_below(7, column).tolist()) == [0, 1, 2]
+    assert sorted(state.samples_below(6, column).tolist()) == [0, 1, 2, 3]
+
+
+def test_overlay_variants():
+    # each mutation is below a branch of the tree it is on, as often as that
+    # branch's length times the span of the tree
+    ts = HandmadeTreeSequence()
+    total = sum(CLADES.values())
+    counts = dict((clade, 0) for clade in CLADES)
+    nreps, mut_rate = 200, 0.5
+    for seed in range(1, nreps + 1):
+        last = 0
+        for pos, genotypes in overlay_variants(ts, mut_rate, seed):
+            assert last <= pos < 10
+            last = pos
+            clade = tuple(np.flatnonzero(genotypes).tolist())
+            assert clade in CLADES
+            if clade == (2, 3):
+                assert pos < 4
+            if clade == (0, 1, 2):
+                assert pos >= 4
+            counts[clade] += 1
+    n = sum(counts.values())
+    expected = nreps * mut_rate * total
+    assert abs(n - expected) < 4 * np.sqrt(expected)
+    for clade, weight in CLADES.items():
+        p = weight / total
+        assert abs(counts[clade] - n * p) < 4 * np.sqrt(n * p * (1 - p)), clade
+
+
+def test_seed():
+    ts = HandmadeTreeSequence()
+    first = [(pos, g.copy()) for pos, g in overlay_variants(ts, 0.2, 7)]
+    again = [(pos, g.copy()) for pos, g in overlay_variants(ts, 0.2, 7)]
+    assert len(first) > 0
+    assert all(p == q and np.array_equal(g, h) for (p, g), (q, h) in zip(first, again))
+
+
+@pytest.mark.parametrize("ploidy", [1, 2])
+def test_write_overlay(tmp_path, ploidy):
+    # the VCF and the store have the same sites, as written in one pass
+    ts = HandmadeTreeSequence(sequence_length=10.0)
+    vcf = str(tmp_path / "sim.vcf.gz")
+    prefix = str(tmp_path / "sim.snp3")
+    nsites = write_overlay(ts, 0.3, 3, vcf, ploidy=ploidy, genobin_prefix=prefix, window_size=3,
+                           window_type="snp", chunk_sites=4)
+    with gzip.open(vcf, "rt") as f:
+        records = [line.split("\t") for line in f if not line.startswith("#")]
+    geno, positions, samples = read_genobin(prefix)
+    assert nsites == len(records) == len(positions) > 0
+    assert samples == ["msp_{}".format(k) for k in range(4 // ploidy)]
+    assert [int(r[1]) for r in records] == positions.tolist()
+    assert np.all(np.diff(positions) > 0)
+    counts = [[sum(int(a) for a in gt.strip().replace("/", "|").split("|")) for gt in r[9:]] for r in records]
+    assert np.array_equal(geno, np.array(counts))
+    assert len(read_windows(prefix)) == nsites // 3
@@ -0,0 +1,48 @@
+'''
+recode.py against a line-by-line transcription of lostruct::recode_numeric().
+'''
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import NA_INT8
+from pylostruct.recode import numeric_text_rows, recode_numeric
+
+
+def r_recode_numeric(codes, ploidy=2, triallelic=True, nalleles=4):
+    # as in lostruct/R/read_data.R, one site at a time (None is NA)
+    out = []
+    for row in codes.tolist():
+        geno = [x if 0 <= x < nalleles else None for x in row]
+        totals = [sum(1 for x in geno if x == k) for k in range(nalleles)]
+        if not triallelic and sum(t > 0 for t in totals) > 2:
+            out.append([None] * (len(row) // ploidy))
+            continue
+        major = max(k for k in range(nalleles) if totals[k] == max(totals))
+        coded = [None if x is None else int(x != major) for x in geno]
+        inds = [coded[j:j + ploidy] for j in range(0, len(coded), ploidy)]
+        out.append([None if None in ind else sum(ind) for ind in inds])
+    return np.array([[NA_INT8 if x is None else x for x in row] for row in out], dtype=np.int8)
+
+
+@pytest.mark.parametrize("ploidy", [1, 2])
+@pytest.mark.parametrize("triallelic", [True, False])
+def test_recode_numeric(ploidy, triallelic):
+    rng = np.random.RandomState(ploidy)
+    # few alleles per site, some missing (-1 or 4)
+    codes = rng.choice([-1, 0, 1, 2, 3, 4], size=(200, 12), p=[.03, .5, .3, .1, .05, .02])
+    out = recode_numeric(codes, ploidy=ploidy, triallelic=triallelic)
+    assert out.dtype == np.int8
+    assert np.array_equal(out, r_recode_numeric(codes, ploidy=ploidy, triallelic=triallelic))
+
+
+def test_ties():
+    # ties go to the allele with the larger code
+    assert recode_numeric(np.array([[0, 0, 3, 3]]), ploidy=1).tolist() == [[1, 1, 0, 0]]
+    with pytest.raises(ValueError):
+        recode_numeric(np.zeros((2, 3)), ploidy=2)
+
+
+def test_numeric_text_rows():
+    values = np.array([[0, 1, NA_INT8], [2, NA_INT8, 0]], dtype=np.int8)
+    assert numeric_text_rows([b"1\t10\t", b"1\t20\t"], values) == b"1\t10\t0\t1\tNA\n1\t20\t2\tNA\t0\n"
@@ -0,0 +1,45 @@
+'''
+recombmap.load_map(): parsing of map files, and the cache.
+'''
+
+import os
+import gzip
+
+import numpy as np
+import pytest
+
+from pylostruct.recombmap import load_map
+
+MAP = '''"Chromosome" "Position.bp." "Rate.cM.Mb." "Map.cM."
+1 0 2.08762984817151 0
+1 10000 0.5 0.0208762984817151
+1 25000  1.25 0.0283762984817151
+1 40000 0 0.0471262984817151
+'''
+
+
+def write_map(path, text=MAP):
+    with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as f:
+        f.write(text)
+    return path
+
+
+@pytest.mark.parametrize("name", ["map.txt", "map.txt.gz"])
+def test_load_map(tmp_path, name):
+    m = load_map(write_map(str(tmp_path / name)))
+    assert m.positions.tolist() == [0, 10000, 25000, 40000]
+    assert np.allclose(m.rates, [2.08762984817151e-8, 0.5e-8, 1.25e-8, 0])
+
+
+def test_cache(tmp_path):
+    path = write_map(str(tmp_path / "map.txt"))
+    assert load_map(path) is load_map(path)
+    # a changed file is read again
+    write_map(path, MAP + "1 50000 3 0.0471262984817151\n")
+    os.utime(path, (0, 1))
+    assert load_map(path).positions.tolist() == [0, 10000, 25000, 40000, 50000]
+
+
+def test_bad_map(tmp_path):
+    with pytest.raises(ValueError):
+        load_map(write_map(str(tmp_path / "map.txt"), MAP + "1 50000\n"))
@@ -0,0 +1,149 @@
+'''
+schedule.py: the cost model and its history file, largest-first ordering,
+timing phases, and running jobs within a memory budget.
+'''
+
+import time
+import random
+import itertools
+import threading
+import multiprocessing.pool
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import rate_vcf_name
+from pylostruct.schedule import (CostModel, PhaseTimer, append_history, grouped_chunksize, largest_first,
+                                 read_history, replicate_grid, run_admitted)
+
+
+def prior(row):
+    return float(row['length'])
+
+
+def test_no_history():
+    model = CostModel(["length", "popsize"], prior, "seconds")
+    assert model.nobs == 0
+    assert model.predict({'length': 1e6, 'popsize': 100}) == pytest.approx(1e6)
+
+
+def test_fit():
+    # cost = 3 * length * popsize^0.5, which the model should learn from enough rows
+    rng = np.random.RandomState(1)
+    history = [{'length': L, 'popsize': N, 'seconds': 3 * L * N ** 0.5}
+               for L, N in zip(rng.uniform(1e4, 1e7, 50), rng.uniform(10, 1e4, 50))]
+    history.append({'length': 1e5, 'popsize': 0, 'seconds': 1})
+    history.append({'length': 1e5, 'popsize': 100, 'seconds': "NA"})
+    model = CostModel(["length", "popsize"], prior, "seconds", history=history, ridge=1e-6)
+    assert model.nobs == 50
+    assert model.predict({'length': 2e6, 'popsize': 400}) == pytest.approx(3 * 2e6 * 20, rel=1e-4)
+
+
+def test_history(tmp_path):
+    path = str(tmp_path / "costs.tsv")
+    assert read_history(path) == []
+    append_history(path, [{'chrom': 1, 'length': 1e6, 'seconds': 2.5}], ["chrom", "length", "seconds"])
+    append_history(path, [{'chrom': 2, 'length': 2e6, 'seconds': 4}], ["chrom", "length", "seconds"])
+    rows = read_history(path)
+    assert [(r['chrom'], r['length'], r['seconds']) for r in rows] == [(1, 1e6, 2.5), (2, 2e6, 4)]
+    assert all(isinstance(r['time'], str) for r in rows)
+
+
+def test_largest_first():
+    jobs = {0: {'length': 5}, 1: {'length': 50}, 2: {'length': 1}, 3: {'length': 20}}
+    assert largest_first(jobs, prior) == [1, 3, 0, 2]
+
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    with timer.phase("one") as phase:
+        time.sleep(0.01)
+        phase['bytes'] = 10
+    with timer.phase("two"):
+        pass
+    assert list(timer.phases) == ["one", "two"]
+    assert timer.phases["one"]['elapsed'] >= 0.01
+    assert timer.phases["one"]['bytes'] == 10
+    assert timer.summary().startswith("one: 0.0")
+
+
+class Tracker(object):
+    # a job that records the memory of the jobs running at once
+    def __init__(self, memory):
+        self.memory = memory
+        self.running = set()
+        self.peaks = []
+        self.lock = threading.Lock()
+
+    def __call__(self, job):
+        with self.lock:
+            self.running.add(job)
+            self.peaks.append((len(self.running), sum(self.memory[j] for j in self.running)))
+        time.sleep(0.01)
+        with self.lock:
+            self.running.remove(job)
+        if job == "bad":
+            raise RuntimeError("failed")
+        return job
+
+
+def test_run_admitted():
+    memory = {0: 6, 1: 5, 2: 4, 3: 3, 4: 2, 5: 12, 6: 1}
+    track = Tracker(memory)
+    pool = multiprocessing.pool.ThreadPool(4)
+    results = list(run_admitted(pool, track, sorted(memory, key=memory.get, reverse=True),
+                                memory.get, budget=10, max_running=3))
+    pool.close()
+    pool.join()
+    assert sorted(results) == sorted(memory)
+    assert max(n for n, _ in track.peaks) <= 3
+    # only the job too big for the budget goes over it, alone
+    assert all(m <= 10 or n == 1 for n, m in track.peaks)
+
+
+def test_run_admitted_unlimited():
+    memory = dict((k, 100) for k in range(6))
+    track = Tracker(memory)
+    pool = multiprocessing.pool.ThreadPool(6)
+    assert sorted(run_admitted(pool, track, list(memory), memory.get, budget=None, max_running=2)) == list(range(6))
+    pool.close()
+    pool.join()
+    assert max(n for n, _ in track.peaks) <= 2
+
+
+def test_run_admitted_error():
+    memory = {"ok": 1, "bad": 1}
+    pool = multiprocessing.pool.ThreadPool(2)
+    with pytest.raises(RuntimeError):
+        list(run_admitted(pool, Tracker(memory), ["bad", "ok"], memory.get, budget=None, max_running=1))
+    pool.close()
+    pool.join()
+
+
+def test_replicate_grid():
+    rates, vcffiles = [1e-8, 2.5e-9], ["sim00.vcf", "sim01.vcf.gz", "sim02"]
+    grid = replicate_grid(len(vcffiles), rates, 4, seed=23)
+    assert [x[:3] for x in grid] == list(itertools.product(range(3), rates, range(4)))
+    # the seeds are those msp-add-mutation.py has always drawn
+    random.seed(23)
+    assert [x[3] for x in grid] == [random.randrange(1,1000) for _ in grid]
+    names = [rate_vcf_name(vcffiles[k], rate, rep) for k, rate, rep, seed in grid]
+    assert len(set(names)) == len(grid)
+    assert names[:5] == ["sim00_u1e-08_r0.vcf", "sim00_u1e-08_r1.vcf", "sim00_u1e-08_r2.vcf",
+                         "sim00_u1e-08_r3.vcf", "sim00_u2.5e-09_r0.vcf"]
+    assert names[-1] == "sim02_u2.5e-09_r3.vcf"
+    assert rate_vcf_name("sim01.vcf.gz", 1e-8) == "sim01_u1e-08.vcf.gz"
+
+
+@pytest.mark.parametrize("nfiles,njobs", [(1, 8), (3, 8), (8, 8), (20, 4), (5, 1)])
+def test_grouped_chunksize(nfiles, njobs):
+    grid = replicate_grid(nfiles, [1e-8, 1e-9, 1e-7], 4, seed=1)
+    size = grouped_chunksize(len(grid), nfiles, njobs)
+    chunks = [grid[k:k + size] for k in range(0, len(grid), size)]
+    assert len(chunks) >= min(njobs, len(grid))
+    # each file is in about as few chunks as can keep the workers busy
+    for k in range(nfiles):
+        assert sum(k in set(x[0] for x in chunk) for chunk in chunks) <= 2 * -(-njobs // nfiles) + 1
+    if nfiles >= njobs:
+        assert all(len(set(x[0] for x in chunk)) == 1 for chunk in chunks)
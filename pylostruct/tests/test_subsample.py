@@ -0,0 +1,36 @@
+'''
+subsample.py: nested, balanced subsets of samples, and the names of their outputs.
+'''
+
+import numpy as np
+import pytest
+
+from pylostruct.subsample import interleaved_order, nested_samples, subsample_path
+
+
+def test_interleaved_order():
+    populations = [0, 0, 0, 1, 1, 1, 2, 2, 2]
+    assert interleaved_order(populations).tolist() == [0, 3, 6, 1, 4, 7, 2, 5, 8]
+    # unequal, unsorted populations
+    assert interleaved_order([1, 0, 1, 1, 0]).tolist() == [1, 0, 4, 2, 3]
+
+
+def test_nested_samples():
+    populations = np.repeat(np.arange(4), 10)
+    subsets = nested_samples(populations, [8, 20, 4])
+    assert [len(s) for s in subsets] == [8, 20, 4]
+    for s in subsets:
+        counts = np.bincount(populations[s], minlength=4)
+        assert counts.max() - counts.min() <= 1
+    # each subset is a prefix of the larger ones, in the same order
+    assert subsets[1][:8] == subsets[0] and subsets[0][:4] == subsets[2]
+    for k in [0, 41]:
+        with pytest.raises(ValueError):
+            nested_samples(populations, [k])
+
+
+def test_subsample_path():
+    assert subsample_path("out/sim00.vcf.gz", 50) == "out/sim00_k50.vcf.gz"
+    assert subsample_path("samples.tsv", 8) == "samples_k8.tsv"
+    assert subsample_path("sim.snp1000", 8) == "sim_k8.snp1000"
+    assert subsample_path("trees", 8) == "trees_k8"
@@ -0,0 +1,57 @@
+'''
+telemetry.Telemetry: events from several worker processes, the text log,
+and the summary table.
+'''
+
+import json
+import multiprocessing
+
+from pylostruct.schedule import PhaseTimer
+from pylostruct.telemetry import Telemetry, summary_table
+
+
+def work(args):
+    telemetry, chrom = args
+    timer = PhaseTimer(telemetry, chrom=chrom)
+    for name in ["simulate", "write"]:
+        with timer.phase(name) as phase:
+            if name == "write":
+                phase['bytes'] = 100 * chrom
+    telemetry.log("done {}\n".format(chrom), chrom=chrom)
+
+
+def test_workers(tmp_path):
+    path = str(tmp_path / "run.telemetry.jsonl")
+    summary_path = str(tmp_path / "run.summary.tsv")
+    log_path = str(tmp_path / "run.log")
+    with open(log_path, "w") as log:
+        telemetry = Telemetry(path, log=log, summary_path=summary_path)
+        procs = [multiprocessing.Process(target=work, args=((telemetry, chrom),)) for chrom in range(1, 5)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        telemetry.close()
+    with open(path) as f:
+        events = [json.loads(line) for line in f]
+    # every event of every worker, each phase started before it ended
+    assert sorted(ev['chrom'] for ev in events if ev['event'] == "end") == sorted(2 * [1, 2, 3, 4])
+    for chrom in range(1, 5):
+        mine = [(ev['event'], ev.get('phase')) for ev in events if ev['chrom'] == chrom]
+        assert mine == [("start", "simulate"), ("end", "simulate"), ("start", "write"), ("end", "write"),
+                        ("log", None)]
+    with open(summary_path) as f:
+        rows = [line.split("\t") for line in f.read().splitlines()]
+    assert rows[0][:2] == ["phase", "n"]
+    write = [row for row in rows if row[0] == "write"][0]
+    assert write[1] == "4" and write[rows[0].index("total_bytes")] == "1000"
+    with open(log_path) as f:
+        log = f.read()
+    assert sorted(line for line in log.splitlines() if line.startswith("done")) == ["done 1", "done 2", "done 3", "done 4"]
+    assert "Summary of phases" in log
+
+
+def test_summary_table():
+    ends = [{'phase': "a", 'elapsed': 1.0, 'user': 0.5, 'system': 0.1, 'max_rss_mb': 10},
+            {'phase': "a", 'elapsed': 2.0, 'user': 0.5, 'system': 0.1, 'max_rss_mb': 30, 'bytes': 7}]
+    assert summary_table(ends).splitlines()[1] == "a\t2\t3.00\t1.00\t0.20\t7\t2.00\t30.0"
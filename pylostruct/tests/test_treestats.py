@@ -0,0 +1,144 @@
+'''
+treestats.py: windowed mean TMRCA, and the other statistics of GenomeScan,
+from a single sweep, against values worked out by hand for the tree sequence
+in handmade.py (or by tskit), and in pieces against the whole.
+'''
+
+import numpy as np
+import pytest
+
+from pylostruct.tests.handmade import TMRCA, HandmadeTreeSequence
+from pylostruct.treestats import (GenomeScan, PairwiseTmrca, WindowSums, population_sample_sets, read_regions,
+                                  regular_windows, sweep)
+
+
+def expected_tmrca(starts, ends):
+    # the mean over each window of the TMRCA on each tree, weighted by overlap
+    out = []
+    for start, end in zip(starts, ends):
+        total = np.zeros(3)
+        for (left, right), values in TMRCA.items():
+            total += max(0, min(end, right) - max(start, left)) * np.array(values)
+        out.append(total / (end - start))
+    return np.array(out)
+
+
+def tmrca_sweep(ts, windows, **kwargs):
+    names, sample_sets = population_sample_sets(ts)
+    return sweep(ts, sample_sets, PairwiseTmrca(names, sample_sets), windows, **kwargs)
+
+
+def test_population_sample_sets():
+    assert population_sample_sets(HandmadeTreeSequence()) == (["0", "1"], [[0, 1], [2, 3]])
+    names, sample_sets = population_sample_sets(HandmadeTreeSequence())
+    assert PairwiseTmrca(names, sample_sets).names == ["0_0", "0_1", "1_1"]
+
+
+def test_regular_windows():
+    starts, ends = regular_windows(10, 3)
+    assert starts.tolist() == [0, 3, 6, 9] and ends.tolist() == [3, 6, 9, 10]
+    # 1e6 / 29 does not go exactly 29 times into 1e6
+    for n in [29, 49, 3, 7]:
+        for starts, ends in [regular_windows(1e6, n=n), regular_windows(1e6, 1e6 / n)]:
+            assert len(starts) == n
+            assert starts[0] == 0 and ends[-1] == 1e6
+            assert np.all(ends > starts)
+            assert np.array_equal(starts[1:], ends[:-1])
+            assert np.allclose(ends - starts, 1e6 / n)
+
+
+def test_hand_computed():
+    ts = HandmadeTreeSequence()
+    windows = [regular_windows(10, 10), regular_windows(10, 5), regular_windows(10, 3)]
+    sums = tmrca_sweep(ts, windows)
+    for (starts, ends), means in zip(windows, sums.means()):
+        assert np.allclose(means, expected_tmrca(starts, ends))
+    # e.g., over the whole sequence
+    assert np.allclose(sums.means()[0], [[1.0, 3.7, 3.2]])
+    # the breakpoint at 4 is inside [0, 5), and [3, 6)
+    assert sums.breakpoints[1].tolist() == [1, 0]
+    assert sums.breakpoints[2].tolist() == [0, 1, 0, 0]
+
+
+@pytest.mark.parametrize("njobs", [2, 3, 4, 7])
+def test_pieces(njobs):
+    # as tree-stats.py does with --njobs: sweep equal pieces and add them up
+    ts = HandmadeTreeSequence()
+    windows = [regular_windows(10, 5), regular_windows(10, 1)]
+    whole = tmrca_sweep(ts, windows)
+    total = WindowSums(windows, 3)
+    for k in range(njobs):
+        total.merge(tmrca_sweep(ts, windows, left=10 * k / njobs, right=10 * (k + 1) / njobs))
+    for a, b in zip(whole.sums, total.sums):
+        assert np.allclose(a, b)
+    for a, b in zip(whole.spans, total.spans):
+        assert np.allclose(a, b)
+    for a, b in zip(whole.breakpoints, total.breakpoints):
+        assert np.array_equal(a, b)
+
+
+def test_unswept_windows():
+    ts = HandmadeTreeSequence()
+    sums = tmrca_sweep(ts, [regular_windows(10, 2)], left=2, right=6)
+    means = sums.means()[0]
+    assert np.all(np.isnan(means[[0, 3, 4]]))
+    assert np.allclose(means[1:3], expected_tmrca([2, 4], [4, 6]))
+
+
+def test_regions(tmp_path):
+    path = str(tmp_path / "regions.csv")
+    with open(path, "w") as f:
+        f.write('"chrom","start","end"\n"1",5,9\n"1",0,4\n"2",0,100\n')
+    starts, ends = read_regions(path, chrom="1")
+    assert starts.tolist() == [0, 5] and ends.tolist() == [5, 10]
+    with pytest.raises(ValueError):
+        read_regions(path)
+
+
+def test_tskit():
+    # the mean TMRCA is half tskit's branch-mode divergence
+    msprime = pytest.importorskip("msprime")
+    if not hasattr(msprime, "sim_ancestry"):
+        pytest.skip("needs msprime >= 1.0 to simulate")
+    demography = msprime.Demography.island_model([1e3, 1e3], 1e-3)
+    ts = msprime.sim_ancestry(samples={"pop_0": 5, "pop_1": 4}, demography=demography, sequence_length=1e5,
+                              recombination_rate=1e-8, random_seed=4)
+    windows = [0, 2e4, 5e4, 1e5]
+    sets = [ts.samples(population=k).tolist() for k in range(2)]
+    means = sweep(ts, sets, PairwiseTmrca(["0", "1"], sets),
+                  [(np.array(windows[:-1]), np.array(windows[1:]))]).means()[0]
+    expected = ts.divergence(sets, indexes=[(0, 0), (0, 1), (1, 1)], windows=windows, mode="branch") / 2
+    assert np.allclose(means, expected)
+
+
+def test_genome_scan():
+    ts = HandmadeTreeSequence()
+    names, sample_sets = population_sample_sets(ts)
+    scan = GenomeScan(names, sample_sets, ["tmrca", "diversity", "fst", "trees", "breakpoints"], mut_rate=0.5)
+    assert scan.names == ["0_0", "0_1", "1_1", "pi_0", "pi_1", "Fst_0_1", "num_trees", "breakpoint_density"]
+    windows = [regular_windows(10, 10), regular_windows(10, 5)]
+    tables = scan.table(sweep(ts, sample_sets, scan.summary, windows))
+    fst = 1 - 2 * (1 + 3.2) / ((1 + 3.2) + 2 * 3.7)
+    assert np.allclose(tables[0], [[1.0, 3.7, 3.2, 1.0, 3.2, fst, 2, 0.1]])
+    assert tables[1][:, 6].tolist() == [2, 1]
+    assert tables[1][:, 7].tolist() == [0.2, 0]
+    with pytest.raises(ValueError):
+        GenomeScan(names, sample_sets, ["tmrca", "heterozygosity"])
+
+
+def test_genome_scan_tskit():
+    # diversity, Fst, and Tajima's D as tskit's branch mode
+    msprime = pytest.importorskip("msprime")
+    if not hasattr(msprime, "sim_ancestry"):
+        pytest.skip("needs msprime >= 1.0 to simulate")
+    demography = msprime.Demography.island_model([1e3, 1e3, 1e3], 1e-3)
+    ts = msprime.sim_ancestry(samples={"pop_0": 6, "pop_1": 5, "pop_2": 4}, demography=demography,
+                              sequence_length=1e5, recombination_rate=1e-8, random_seed=8, ploidy=1)
+    windows = [0, 3e4, 1e5]
+    sets = [ts.samples(population=k).tolist() for k in range(3)]
+    scan = GenomeScan(["a", "b", "c"], sets, ["diversity", "fst", "tajima_d"])
+    table = scan.table(sweep(ts, sets, scan.summary, [(np.array(windows[:-1]), np.array(windows[1:]))]))[0]
+    pairs = [(0, 1), (0, 2), (1, 2)]
+    assert np.allclose(table[:, :3], ts.diversity(sets, windows=windows, mode="branch"))
+    assert np.allclose(table[:, 3:6], ts.Fst(sets, indexes=pairs, windows=windows, mode="branch"))
+    assert np.allclose(table[:, 6:], ts.Tajimas_D(sets, windows=windows, mode="branch"))
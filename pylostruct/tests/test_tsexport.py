@@ -0,0 +1,75 @@
+'''
+tsexport.export_tree_sequence(): the store and window table written for the
+genotypes of a tree sequence.
+'''
+
+import collections
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import NA_INT8, read_genobin, read_windows, window_table, vcf_stem
+from pylostruct.tsexport import distinct_positions, export_tree_sequence
+
+Variant = collections.namedtuple("Variant", ["position", "genotypes"])
+
+
+class Sites(object):
+    # the part of a tree sequence that export_tree_sequence() uses
+    def __init__(self, positions, haps):
+        self.positions = positions
+        self.haps = haps
+        self.num_samples = haps.shape[1]
+
+    def variants(self):
+        for pos, g in zip(self.positions, self.haps):
+            yield Variant(pos, g)
+
+
+def random_sites(nsites, nsamples, seed=1):
+    rng = np.random.RandomState(seed)
+    positions = np.sort(rng.uniform(0, nsites * 3, size=nsites))
+    haps = (rng.uniform(size=(nsites, nsamples)) < 0.3).astype(np.int8)
+    return Sites(positions, haps)
+
+
+def test_distinct_positions():
+    assert distinct_positions(np.array([0.2, 0.4, 1.6, 2.1, 2.2, 9.7])).tolist() == [1, 2, 3, 4, 5, 10]
+    assert distinct_positions(np.array([3.0, 3.1, 8.0]), last=4).tolist() == [5, 6, 8]
+
+
+@pytest.mark.parametrize("ploidy", [1, 2])
+@pytest.mark.parametrize("size,type", [(10, "snp"), (50, "bp")])
+def test_export(tmp_path, ploidy, size, type):
+    ts = random_sites(203, 8)
+    ts.haps[5, 3] = -1
+    prefix = str(tmp_path / "sim.{}{}".format(type, size))
+    # chunks smaller than the windows, so positions are made distinct across chunks
+    nsites, nwin = export_tree_sequence(ts, prefix, size, type, ploidy=ploidy, chunk_sites=7)
+    geno, positions, samples = read_genobin(prefix)
+    assert nsites == 203
+    assert samples == ["msp_{}".format(k) for k in range(8 // ploidy)]
+    assert np.array_equal(positions, distinct_positions(ts.positions))
+    expected = (ts.haps > 0).reshape((203, -1, ploidy)).sum(axis=2)
+    expected[(ts.haps < 0).reshape((203, -1, ploidy)).any(axis=2)] = NA_INT8
+    assert np.array_equal(geno, expected)
+    assert np.array_equal(read_windows(prefix), window_table(positions, size, type))
+    assert nwin == len(read_windows(prefix))
+
+
+def test_tree_sequence(tmp_path):
+    msprime = pytest.importorskip("msprime")
+    if not hasattr(msprime, "sim_ancestry"):
+        pytest.skip("needs msprime >= 1.0 to simulate")
+    ts = msprime.sim_mutations(msprime.sim_ancestry(5, sequence_length=1e5, recombination_rate=1e-8,
+                                                    population_size=1e4, random_seed=2),
+                               rate=1e-8, random_seed=2, discrete_genome=False)
+    prefix = str(tmp_path / "sim")
+    export_tree_sequence(ts, prefix, 10, "snp", ploidy=2)
+    geno, positions, _ = read_genobin(prefix)
+    assert np.array_equal(geno, ts.genotype_matrix().reshape((ts.num_sites, 5, 2)).sum(axis=2))
+    assert np.array_equal(positions, distinct_positions(ts.tables.sites.position))
+
+
+def test_vcf_stem():
+    assert [vcf_stem(x) for x in ["a/sim.vcf", "sim.vcf.gz", "sim.bcf", "sim"]] == ["a/sim", "sim", "sim", "sim"]
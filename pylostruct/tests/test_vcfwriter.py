@@ -0,0 +1,169 @@
+'''
+vcfwriter.py and the BGZF/CSI writing in bgzf.py, against files in data/
+that were checked with htslib: data/small.vcf is what "bcftools view" gives
+for both data/small.vcf.gz and data/small.bcf (which is what BcfWriter
+writes), and the .csi files are those written by "bcftools index".
+'''
+
+import os
+import gzip
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from pylostruct.bgzf import BgzfIndex, BgzfReader, csi_depth, region_lines
+from pylostruct.vcfwriter import BcfWriter, VcfGzWriter, VcfWriter, open_writer, write_tree_sequence
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+CONTIGS = [("1", 2000000), ("2", 50000)]
+SAMPLES = ["a", "b", "c"]
+
+
+def small_sites():
+    '''
+    The sites in data/small.vcf: (chrom, pos, alleles, genotypes), diploid.
+    '''
+    for k, pos in enumerate(range(1, 1500000, 15001)):
+        genotypes = np.array([(k * j) % 2 for j in range(1, 7)])
+        if k % 7 == 0:
+            genotypes[0] = -1
+        yield "1", pos, ["A", "T"], genotypes
+    for k, pos in enumerate(range(10, 40000, 997)):
+        yield "2", pos, ["C", "G", "TT"], np.array([(k + j) % 3 for j in range(6)])
+
+
+def write_small(writer_class, path):
+    with writer_class(path, SAMPLES, CONTIGS, ploidy=2) as writer:
+        for site in small_sites():
+            writer.write(*site)
+    return writer.nsites
+
+
+def read_data(name):
+    with open(os.path.join(DATA, name), "rb") as f:
+        return f.read()
+
+
+def records(text):
+    return [line for line in text.splitlines() if not line.startswith(b"##")]
+
+
+def test_vcfgz(tmp_path):
+    path = str(tmp_path / "small.vcf.gz")
+    nsites = write_small(VcfGzWriter, path)
+    with gzip.open(path) as f:
+        assert f.read() == read_data("small.vcf")
+    assert nsites == len(records(read_data("small.vcf"))) - 1
+
+
+def test_bcf(tmp_path):
+    path = str(tmp_path / "small.bcf")
+    write_small(BcfWriter, path)
+    with gzip.open(path) as f, gzip.open(os.path.join(DATA, "small.bcf")) as g:
+        assert f.read() == g.read()
+
+
+def test_vcf(tmp_path):
+    path = str(tmp_path / "small.vcf")
+    write_small(VcfWriter, path)
+    with open(path, "rb") as f:
+        assert f.read() == read_data("small.vcf")
+    assert not os.path.exists(path + ".csi")
+
+
+@pytest.mark.parametrize("name", ["small.vcf.gz", "small.bcf"])
+def test_index(tmp_path, name):
+    # the same bins, chunks, and offsets as bcftools index (which writes the bins in another order)
+    path = str(tmp_path / name)
+    write_small(open_writer, path)
+    names = [chrom for chrom, _ in CONTIGS]
+    ours = BgzfIndex(path + ".csi", names=names)
+    theirs = BgzfIndex(os.path.join(DATA, name + ".csi"), names=names)
+    assert (ours.min_shift, ours.depth) == (theirs.min_shift, theirs.depth)
+    assert ours.names == theirs.names
+    assert ours.bins == theirs.bins
+    assert ours.loffsets == theirs.loffsets
+
+
+@pytest.mark.parametrize("writer_class,name", [(VcfGzWriter, "many.vcf.gz"), (BcfWriter, "many.bcf")])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_index_pending(tmp_path, monkeypatch, writer_class, name, threads):
+    # sites are indexed as their blocks are written out, with the same index
+    # as if they were all indexed at the end
+    rng = np.random.RandomState(2)
+    samples = ["s{}".format(k) for k in range(200)]
+    sites = [("1", pos, ["A", "T"], rng.randint(0, 2, size=400)) for pos in range(1, 2000000, 1001)]
+    indexes = []
+    for pending_sites in [3, len(sites) + 1]:
+        monkeypatch.setattr(writer_class, "pending_sites", pending_sites)
+        path = str(tmp_path / "{}.{}".format(pending_sites, name))
+        with writer_class(path, samples, CONTIGS, ploidy=2, threads=threads) as writer:
+            for site in sites:
+                writer.write(*site)
+            if pending_sites == 3 and threads == 1:
+                # about the sites of one block, not all of them
+                assert len(writer._pending) < len(sites) // 10
+        with open(path + ".csi", "rb") as f:
+            indexes.append(f.read())
+        assert len(BgzfIndex(path + ".csi", names=["1", "2"]).bins[0]) > 10
+    assert indexes[0] == indexes[1]
+
+
+@pytest.mark.parametrize("region", [("1", 1, 1), ("1", 600000, 700000), ("1", 1490000, None),
+                                    ("2", 5000, 6000), ("2", None, None), ("3", None, None)])
+def test_region_lines(tmp_path, region):
+    path = str(tmp_path / "small.vcf.gz")
+    write_small(VcfGzWriter, path)
+    chrom, start, end = region
+    expected = [line + b"\n" for line in records(read_data("small.vcf"))[1:]
+                if line.split(b"\t")[0] == chrom.encode()
+                and (start is None or int(line.split(b"\t")[1]) >= start)
+                and (end is None or int(line.split(b"\t")[1]) <= end)]
+    with BgzfReader(path) as reader:
+        assert list(region_lines(reader, BgzfIndex(path + ".csi"), chrom, start, end)) == expected
+
+
+def test_csi_depth():
+    # as htslib: enough levels that 2^(14 + 3 depth) > max_length + 256
+    assert csi_depth(2000000) == 3
+    assert csi_depth((1 << 23) - 256) == 3
+    assert csi_depth((1 << 23) - 255) == 4
+    assert csi_depth(None) == 6
+
+
+@pytest.mark.skipif(shutil.which("bcftools") is None, reason="bcftools is not installed")
+@pytest.mark.parametrize("name", ["small.vcf.gz", "small.bcf"])
+def test_bcftools(tmp_path, name):
+    path = str(tmp_path / name)
+    write_small(open_writer, path)
+    view = subprocess.run(["bcftools", "view", "--no-version", path], check=True, stdout=subprocess.PIPE).stdout
+    assert records(view) == records(read_data("small.vcf"))
+    stats = subprocess.run(["bcftools", "index", "--stats", path], check=True, stdout=subprocess.PIPE).stdout
+    assert stats.decode().split() == ["1", "2000000", "100", "2", "50000", "41"]
+    region = subprocess.run(["bcftools", "view", "-H", "-r", "1:600000-700000", path],
+                            check=True, stdout=subprocess.PIPE).stdout
+    assert len(region.splitlines()) == 7
+
+
+def test_tree_sequence(tmp_path):
+    msprime = pytest.importorskip("msprime")
+    ts = msprime.simulate(sample_size=8, length=1e5, Ne=1e4, recombination_rate=1e-8,
+                          mutation_rate=1e-8, random_seed=5)
+    variants = list(ts.variants())
+    for name in ["ts.vcf.gz", "ts.bcf"]:
+        path = str(tmp_path / name)
+        assert write_tree_sequence(ts, path, ploidy=2) == len(variants)
+        if name.endswith(".gz"):
+            with gzip.open(path) as f:
+                lines = records(f.read())[1:]
+            last = 0
+            for line, v in zip(lines, variants):
+                fields = line.split(b"\t")
+                pos = max(int(round(v.position)), last + 1)
+                last = pos
+                assert int(fields[1]) == pos
+                genotypes = b"".join(x.replace(b"|", b"") for x in fields[9:])
+                assert genotypes == "".join(str(g) for g in v.genotypes).encode()
+        assert os.path.exists(path + ".csi")
@@ -0,0 +1,147 @@
+'''
+windower.py against the cases of lostruct's tests/testthat/test_vcf_windower.R,
+on the same files, and against the genotypes read directly from the VCF text.
+'''
+
+import os
+import gzip
+import warnings
+
+import numpy as np
+import pytest
+
+from pylostruct.genobin import NA_INT8
+from pylostruct.vcfwriter import BcfWriter, VcfGzWriter
+from pylostruct.windower import trees_windower, vcf_windower
+
+TESTTHAT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "lostruct", "tests", "testthat")
+NA = NA_INT8
+
+
+def r_matrix(values, nrow, ncol):
+    # an R matrix, from its values in column-major order
+    return np.array(values, dtype=np.int8).reshape((ncol, nrow)).T
+
+
+def windower(name, size, type, **kwargs):
+    with warnings.catch_warnings():
+        # about trimming the ends of chromosomes
+        warnings.simplefilter("ignore")
+        return vcf_windower(os.path.join(TESTTHAT, name), size, type, **kwargs)
+
+
+def vcf_text_genotypes(name):
+    # the sample names, and the number of non-reference alleles in each genotype ("." is NA)
+    path = os.path.join(TESTTHAT, name)
+    with (gzip.open(path, "rt") if name.endswith(".gz") else open(path)) as f:
+        lines = [line.rstrip("\n").split("\t") for line in f if not line.startswith("##")]
+    samples = lines[0][9:]
+    geno = [[NA if gt.split(":")[0].startswith(".") else
+             sum(a != "0" for a in gt.split(":")[0].replace("/", "|").split("|"))
+             for gt in row[9:]] for row in lines[1:]]
+    return samples, np.array(geno, dtype=np.int8)
+
+
+def test_snp_windows():
+    with windower("test.bcf", 7, "snp") as f:
+        assert f.max_n == 10
+        assert f.region() == [("2", s, e) for s, e in zip(
+            [10179, 10199, 10574, 13630, 13811, 13970, 14058, 14151, 14238, 14411],
+            [10190, 10572, 10753, 13750, 13949, 14027, 14146, 14234, 14393, 14494])]
+        assert f.samples == ["HG00096", "HG00097", "HG00099", "HG00100", "HG00101", "HG00102", "HG00103"]
+        assert np.array_equal(f(1), r_matrix(
+            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1, 0, NA, 0, 0, 0, 0, 0, 0, 0, 0,
+             0, 0, 0, 2, 0, 2, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0], 7, 7))
+        assert np.array_equal(f(2), r_matrix(
+            [0, 0, NA, 0, 0, 0, 0, 0, 0, NA, 0, 0, 0, 0, NA, 0, NA, 0, 1, 0, 0, NA, 0, NA, 1, 1, 0, 0, 0,
+             0, NA, 0, 0, 0, 1, 0, 0, NA, 0, 0, 0, 2, 0, 0, NA, 0, 0, 0, 0], 7, 7))
+        with pytest.raises(IndexError):
+            f(11)
+
+
+def test_bp_windows():
+    with windower("test.bcf", 400, "bp") as f:
+        assert f.max_n == 10
+        assert f.region() == [("2", 10179 + 400 * k, 10578 + 400 * k) for k in range(10)]
+        assert [f(n).size for n in range(1, 11)] == [105, 42, 0, 0, 0, 0, 0, 0, 49, 154]
+        assert np.array_equal(f(1), r_matrix(
+            [0, 0, 0, 0, 0, 0, 0, 0, 0, NA, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, NA, 0, 0, 0, 0,
+             2, 0, 0, 0, 0, 1, 0, NA, NA, 0, NA, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, NA, 0, NA, 1, 1, 0,
+             0, 0, 0, 0, 0, 0, 2, 0, 2, 0, 0, NA, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, NA, 0, 0,
+             0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, NA, 0, 0, 0, 0, 0], 15, 7))
+        assert f(3).shape == (0, 7)
+
+
+@pytest.mark.parametrize("size,type", [(7, "snp"), (3, "snp"), (400, "bp"), (150, "bp")])
+def test_bcf_vs_text(size, type):
+    # every window is the corresponding rows of test.vcf (of which test.bcf is a copy)
+    samples, geno = vcf_text_genotypes("test.vcf")
+    with open(os.path.join(TESTTHAT, "test.vcf")) as f:
+        positions = np.array([int(line.split("\t")[1]) for line in f if not line.startswith("#")])
+    with windower("test.bcf", size, type) as f:
+        assert f.samples == samples
+        for n in range(1, f.max_n + 1):
+            _, start, end = f.region(n)
+            rows = np.flatnonzero((positions >= start) & (positions <= end))
+            if type == "snp":
+                rows = rows[:size]
+            assert np.array_equal(f(n), geno[rows]), n
+
+
+@pytest.mark.parametrize("writer_class,ext", [(VcfGzWriter, ".vcf.gz"), (BcfWriter, ".bcf")])
+@pytest.mark.parametrize("chroms,r_order", [(["10", "2"], ["2", "10"]), (["chr2", "chr10"], ["chr10", "chr2"])])
+def test_chromosome_order(tmp_path, writer_class, ext, chroms, r_order):
+    # chromosomes are windowed in the order of the levels of R's factor(fread(...)$chrom),
+    # whatever their order in the file
+    path = str(tmp_path / ("two" + ext))
+    writer = writer_class(path, ["a", "b"], [(c, 1000) for c in chroms], ploidy=1)
+    for k, chrom in enumerate(chroms):
+        for pos in range(10, 70, 10):
+            writer.write(chrom, pos + k, ["A", "T"], np.array([k, pos % 20 == 0]))
+    writer.close()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        f = vcf_windower(path, 3, "snp")
+    with f:
+        assert list(f.sites.keys()) == r_order
+        assert f.region() == [(c, 10 + chroms.index(c) + s, 10 + chroms.index(c) + e)
+                              for c in r_order for s, e in [(0, 20), (30, 50)]]
+        first = chroms.index(r_order[0])
+        assert np.array_equal(f(1)[:, 0], [first] * 3)
+        assert np.array_equal(f(3)[:, 0], [1 - first] * 3)
+
+
+def test_vcfgz():
+    # "0/1" genotypes with other fields, on two chromosomes
+    samples, geno = vcf_text_genotypes("small_test.vcf.gz")
+    with windower("small_test.vcf.gz", 7, "snp") as f:
+        assert f.max_n == 2
+        assert f.region() == [("LG1", 7945842, 16550984), ("LG2", 1031678, 12045447)]
+        assert f.samples == samples
+        assert np.array_equal(f(1), geno[:7])
+        assert np.array_equal(f(2), geno[7:14])
+
+
+def test_samples():
+    samples, geno = vcf_text_genotypes("test.vcf")
+    chosen = ["HG00103", "HG00096"]
+    with windower("test.bcf", 7, "snp", samples=chosen, prefetch=False) as f:
+        assert f.samples == chosen
+        assert np.array_equal(f(2), geno[7:14][:, [6, 0]])
+
+
+def test_trees():
+    msprime = pytest.importorskip("msprime")
+    if not hasattr(msprime, "sim_ancestry"):
+        pytest.skip("needs msprime >= 1.0 to simulate")
+    ts = msprime.sim_mutations(msprime.sim_ancestry(6, sequence_length=1e5, recombination_rate=1e-8,
+                                                    population_size=1e4, random_seed=5),
+                               rate=1e-8, random_seed=5, discrete_genome=False)
+    haps = ts.genotype_matrix()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        f = trees_windower(ts, 10, "snp", ploidy=2)
+    with f:
+        assert f.samples == ["msp_{}".format(k) for k in range(6)]
+        for n in range(1, f.max_n + 1):
+            assert np.array_equal(f(n), haps[10 * (n - 1):10 * n].reshape((10, 6, 2)).sum(axis=2))
@@ -0,0 +1,374 @@
+'''
+Statistics of the trees of a tree sequence, averaged over windows along the
+genome, computed in a single left-to-right sweep over the edges: as each tree
+changes into the next, the number of samples of each sample set below each
+affected node is updated, and so is the sum, over branches, of the length of
+the branch times a summary of those numbers.  Each tree's value is then
+added, times its overlap, to every window it overlaps, at every resolution at
+once (e.g., windows of 1e3, 1e4 and 1e5 bp, or those of a lostruct
+regions.csv), so the trees are only traversed once however many there are.
+
+A sweep can be restricted to part of the genome, so that parts can be done in
+separate processes and their sums added together (see WindowSums.merge()).
+
+The summary used here gives the mean time to most recent common ancestor
+(TMRCA) between (and within) sample sets, as msprime's get_mean_tmrca() does:
+the mean over pairs of samples of half the length of the path between them.
+GenomeScan adds to this the other statistics it needs (the length of branches
+segregating in each set), and gives, from the sums in each window, several
+statistics at once: see STATISTICS.
+'''
+
+import csv
+
+import numpy as np
+
+
+def num_nodes(ts):
+    return ts.get_num_nodes() if hasattr(ts, "get_num_nodes") else ts.num_nodes
+
+
+def sequence_length(ts):
+    return ts.get_sequence_length() if hasattr(ts, "get_sequence_length") else ts.sequence_length
+
+
+def node_times(ts):
+    return np.array([ts.node(u).time for u in range(num_nodes(ts))])
+
+
+def population_sample_sets(ts):
+    '''
+    The samples of ts in each population, as (population names, lists of samples).
+    '''
+    pops = {}
+    for u in ts.samples():
+        pops.setdefault(str(ts.node(u).population), []).append(int(u))
+    return list(pops.keys()), list(pops.values())
+
+
+def regular_windows(length, size=None, n=None):
+    '''
+    Windows covering [0, length), as (starts, ends): either of the given size,
+    with the last ending at length, or n of equal width.  A size that goes
+    into length a whole number of times, but for rounding (as length / n),
+    does not leave a sliver of a window at the end.
+    '''
+    if n is None:
+        n = int(np.ceil(np.round(length / size, 6)))
+        bounds = np.minimum(np.arange(n + 1) * float(size), length)
+        bounds[-1] = length
+    else:
+        bounds = np.linspace(0, length, n + 1)
+    starts, ends = bounds[:-1], bounds[1:]
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def read_regions(path, chrom=None):
+    '''
+    The windows in a lostruct regions.csv (columns chrom, start, end, with
+    positions inclusive), on chrom (which may be omitted if there is only
+    one), as (starts, ends) with ends exclusive.
+    '''
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    chroms = set(row['chrom'] for row in rows)
+    if chrom is None:
+        if len(chroms) > 1:
+            raise ValueError("Regions in " + path + " are on more than one chromosome: choose one.")
+    else:
+        rows = [row for row in rows if row['chrom'] == chrom]
+    starts = np.array([float(row['start']) for row in rows])
+    ends = np.array([float(row['end']) + 1 for row in rows])
+    order = np.argsort(starts, kind="mergesort")
+    return starts[order], ends[order]
+
+
+class PairwiseTmrca(object):
+    '''
+    The mean TMRCA between each pair (i, j), i <= j, of the sample sets, as a
+    function of the numbers x below a branch from each set: each pair of
+    samples contributes half the length of each branch that separates them.
+    '''
+
+    def __init__(self, names, sample_sets):
+        n = np.array([len(s) for s in sample_sets], dtype=np.float64)
+        k = len(sample_sets)
+        self.i, self.j = [np.array(a) for a in zip(*[(i, j) for i in range(k) for j in range(i, k)])]
+        self.names = ["_".join([names[i], names[j]]) for i, j in zip(self.i, self.j)]
+        self.n = n
+        same = (self.i == self.j)
+        with np.errstate(divide="ignore"):
+            self.scale = np.where(same, 1 / (2 * n[self.i] * (n[self.i] - 1)), 1 / (2 * n[self.i] * n[self.j]))
+
+    def __call__(self, x):
+        xi, xj = x[self.i], x[self.j]
+        ni, nj = self.n[self.i], self.n[self.j]
+        return (xi * (nj - xj) + xj * (ni - xi)) * self.scale
+
+
+class SegregatingLength(object):
+    '''
+    The length of the branches segregating in each sample set (i.e., with
+    some but not all of its samples below them), as a function of the
+    numbers x below a branch from each set.
+    '''
+
+    def __init__(self, names, sample_sets):
+        self.names = ["segregating_" + name for name in names]
+        self.n = np.array([len(s) for s in sample_sets], dtype=np.float64)
+
+    def __call__(self, x):
+        return ((x > 0) & (x < self.n)).astype(np.float64)
+
+
+class Summaries(object):
+    '''
+    Several summaries at once, whose values are concatenated; the values of
+    the k-th are in columns[k].
+    '''
+
+    def __init__(self, summaries):
+        self.summaries = summaries
+        self.names = [name for summary in summaries for name in summary.names]
+        ends = np.cumsum([len(summary.names) for summary in summaries]).tolist()
+        self.columns = [slice(end - len(summary.names), end) for summary, end in zip(summaries, ends)]
+
+    def __call__(self, x):
+        return np.concatenate([summary(x) for summary in self.summaries])
+
+
+class WindowSums(object):
+    '''
+    For each set of windows (starts, ends), the sum over the part of the
+    genome swept of each statistic times the length of each window it was
+    swept over, that length, and the number of breakpoints between trees
+    swept over inside each window.
+    '''
+
+    def __init__(self, windows, nstats):
+        self.windows = windows
+        self.sums = [np.zeros((len(starts), nstats)) for starts, _ in windows]
+        self.spans = [np.zeros(len(starts)) for starts, _ in windows]
+        self.breakpoints = [np.zeros(len(starts), dtype=np.int64) for starts, _ in windows]
+
+    def add(self, left, right, values):
+        for (starts, ends), sums, spans in zip(self.windows, self.sums, self.spans):
+            # windows are sorted and do not overlap, so those overlapping [left, right) are consecutive
+            k = np.searchsorted(ends, left, side="right")
+            while k < len(starts) and starts[k] < right:
+                overlap = min(right, ends[k]) - max(left, starts[k])
+                if overlap > 0:
+                    sums[k] += overlap * values
+                    spans[k] += overlap
+                k += 1
+
+    def add_breakpoint(self, x):
+        for (starts, ends), breakpoints in zip(self.windows, self.breakpoints):
+            k = np.searchsorted(starts, x, side="right") - 1
+            if k >= 0 and starts[k] < x < ends[k]:
+                breakpoints[k] += 1
+
+    def merge(self, other):
+        for a, b in zip(self.sums, other.sums):
+            a += b
+        for a, b in zip(self.spans, other.spans):
+            a += b
+        for a, b in zip(self.breakpoints, other.breakpoints):
+            a += b
+        return self
+
+    def means(self):
+        '''
+        For each set of windows, the mean of each statistic over each window
+        (nan for windows not swept).
+        '''
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return [sums / spans[:, np.newaxis] for sums, spans in zip(self.sums, self.spans)]
+
+
+class BranchSweep(object):
+    '''
+    The state of a sweep along the tree sequence ts: the parent of each node,
+    the numbers of samples of each sample set below it, and the sum over
+    branches of length times summary(numbers below).
+    '''
+
+    def __init__(self, ts, sample_sets, summary):
+        self.time = node_times(ts)
+        nnodes = len(self.time)
+        self.parent = np.full(nnodes, -1, dtype=np.int64)
+        self.below = np.zeros((nnodes, len(sample_sets)))
+        self.sample_sets = sample_sets
+        self.summary = summary
+        self.total = None
+
+    def start(self):
+        '''
+        Find the numbers below each node and the total for the current tree,
+        from scratch (from the parents alone).
+        '''
+        x = self.below
+        x[:] = 0
+        for k, samples in enumerate(self.sample_sets):
+            x[samples, k] = 1
+        for u in np.argsort(self.time, kind="mergesort").tolist():
+            p = self.parent[u]
+            if p >= 0:
+                x[p] += x[u]
+        has_parent = np.flatnonzero(self.parent >= 0)
+        lengths = self.time[self.parent[has_parent]] - self.time[has_parent]
+        self.total = sum((length * self.summary(x[u]) for u, length in zip(has_parent.tolist(), lengths.tolist())),
+                         np.zeros(len(self.summary.names)))
+
+    def _branch(self, u):
+        p = self.parent[u]
+        return 0.0 if p < 0 else self.time[p] - self.time[u]
+
+    def _add_below(self, v, dx):
+        # add dx to the numbers below v and all its ancestors, updating the total
+        while v >= 0:
+            b = self._branch(v)
+            if b > 0:
+                self.total -= b * self.summary(self.below[v])
+            self.below[v] += dx
+            if b > 0:
+                self.total += b * self.summary(self.below[v])
+            v = self.parent[v]
+
+    def remove(self, parent, child):
+        if self.total is None:
+            self.parent[child] = -1
+            return
+        self.total -= self._branch(child) * self.summary(self.below[child])
+        self.parent[child] = -1
+        self._add_below(parent, -self.below[child])
+
+    def insert(self, parent, child):
+        if self.total is None:
+            self.parent[child] = parent
+            return
+        self.parent[child] = parent
+        self.total += self._branch(child) * self.summary(self.below[child])
+        self._add_below(parent, self.below[child])
+
+
+def sweep(ts, sample_sets, summary, windows, left=0, right=None):
+    '''
+    Sweep over the trees of ts that overlap [left, right), adding the value
+    of summary (see PairwiseTmrca) for each to the windows, a list of
+    (starts, ends) pairs; returns the WindowSums.  Trees to the left of left
+    are only used to find the tree at left.
+    '''
+    if right is None:
+        right = sequence_length(ts)
+    state = BranchSweep(ts, sample_sets, summary)
+    out = WindowSums(windows, len(summary.names))
+    for (tree_left, tree_right), edges_out, edges_in in ts.edge_diffs():
+        if tree_left >= right:
+            break
+        for edge in edges_out:
+            state.remove(edge.parent, edge.child)
+        for edge in edges_in:
+            state.insert(edge.parent, edge.child)
+        if tree_right <= left:
+            continue
+        if state.total is None:
+            state.start()
+        # each breakpoint is counted by the piece it is in (the left end of a piece is in it)
+        if 0 < tree_left and left <= tree_left:
+            out.add_breakpoint(tree_left)
+        out.add(max(left, tree_left), min(right, tree_right), state.total)
+    return out
+
+
+STATISTICS = {
+    'tmrca': "mean TMRCA between and within sample sets (columns A_B)",
+    'diversity': "mean pairwise diversity within each sample set, 2 x mut_rate x TMRCA (columns pi_A)",
+    'fst': "Fst between sample sets, as tskit's Fst(), from diversity and divergence (columns Fst_A_B)",
+    'tajima_d': "Tajima's D in each sample set, from the expected diversity and number of segregating sites (columns D_A)",
+    'trees': "number of distinct trees overlapping the window (column num_trees)",
+    'breakpoints': "number of breakpoints between trees per bp (column breakpoint_density)",
+}
+
+
+class GenomeScan(object):
+    '''
+    Any of the STATISTICS, for the given sample sets (with names) in
+    windows, computed from a single sweep: summary is what is to be summed
+    along the genome (see sweep()), and table() gives the statistics in each
+    window from the sums.  Diversity and Tajima's D are the expected values
+    with mutations at mut_rate (per bp per generation); with the default of 1
+    these are those of tskit's "branch" mode.
+    '''
+
+    def __init__(self, names, sample_sets, stats, mut_rate=1.0):
+        for stat in stats:
+            if stat not in STATISTICS:
+                raise ValueError("Unknown statistic '{}': must be one of {}.".format(stat, ", ".join(STATISTICS)))
+        self.stats = stats
+        self.mut_rate = mut_rate
+        self.n = np.array([len(s) for s in sample_sets], dtype=np.float64)
+        self.tmrca = PairwiseTmrca(names, sample_sets)
+        summaries = [self.tmrca]
+        if 'tajima_d' in stats:
+            summaries.append(SegregatingLength(names, sample_sets))
+        self.summary = Summaries(summaries)
+        k = len(sample_sets)
+        # the columns of the TMRCA within each set, and between each pair of different sets
+        column = {(i, j): c for c, (i, j) in enumerate(zip(self.tmrca.i.tolist(), self.tmrca.j.tolist()))}
+        self.between = [(i, j) for i in range(k) for j in range(i + 1, k)]
+        self.within = np.array([column[(i, i)] for i in range(k)], dtype=np.int64)
+        self.within_i = np.array([column[(i, i)] for i, _ in self.between], dtype=np.int64)
+        self.within_j = np.array([column[(j, j)] for _, j in self.between], dtype=np.int64)
+        self.across = np.array([column[(i, j)] for i, j in self.between], dtype=np.int64)
+        self.names = []
+        for stat in stats:
+            self.names += {
+                'tmrca': self.tmrca.names,
+                'diversity': ["pi_" + name for name in names],
+                'fst': ["Fst_{}_{}".format(names[i], names[j]) for i, j in self.between],
+                'tajima_d': ["D_" + name for name in names],
+                'trees': ["num_trees"],
+                'breakpoints': ["breakpoint_density"],
+            }[stat]
+
+    def _tajima_d(self, sums):
+        # as tskit's Tajimas_D(), with the diversity and segregating sites not span-normalised
+        n = self.n
+        T = 2 * self.mut_rate * sums[:, self.summary.columns[0]][:, self.within]
+        S = self.mut_rate * sums[:, self.summary.columns[1]]
+        h = np.array([np.sum(1 / np.arange(1, nn)) for nn in n])
+        g = np.array([np.sum(1 / np.arange(1, nn) ** 2) for nn in n])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            a = (n + 1) / (3 * (n - 1) * h) - 1 / h**2
+            b = 2 * (n**2 + n + 3) / (9 * n * (n - 1)) - (n + 2) / (h * n) + g / h**2
+            return (T - S / h) / np.sqrt(a * S + (b / (h**2 + g)) * S * (S - 1))
+
+    def table(self, window_sums):
+        '''
+        For each set of windows of window_sums (a WindowSums for summary), the
+        statistics in each window, as an array with a column for each of names.
+        '''
+        out = []
+        for sums, spans, breakpoints in zip(window_sums.sums, window_sums.spans, window_sums.breakpoints):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                tmrca = sums[:, self.summary.columns[0]] / spans[:, np.newaxis]
+                swept = np.where(spans > 0, 1.0, np.nan)
+                columns = []
+                for stat in self.stats:
+                    if stat == 'tmrca':
+                        columns.append(tmrca)
+                    elif stat == 'diversity':
+                        columns.append(2 * self.mut_rate * tmrca[:, self.within])
+                    elif stat == 'fst':
+                        d = tmrca[:, self.within_i] + tmrca[:, self.within_j]
+                        columns.append(1 - 2 * d / (d + 2 * tmrca[:, self.across]))
+                    elif stat == 'tajima_d':
+                        columns.append(self._tajima_d(sums))
+                    elif stat == 'trees':
+                        columns.append((swept * (breakpoints + 1))[:, np.newaxis])
+                    elif stat == 'breakpoints':
+                        columns.append((breakpoints / spans)[:, np.newaxis])
+            out.append(np.column_stack(columns))
+        return out
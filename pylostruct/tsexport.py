@@ -0,0 +1,66 @@
+'''
+Export of the genotypes in a simulated tree sequence to a binary genotype
+store with a window table (see genobin.py), so that lostruct can read each
+window with a single seek, without a VCF being written and parsed.
+
+The samples, positions, and values are those that lostruct would get from
+the VCF written by write_tree_sequence() (or msprime's write_vcf()) with the
+same ploidy: samples msp_0, msp_1, ..., positions rounded (and increased as
+needed to be distinct), and each value the number of non-reference alleles
+carried by an individual (NA_INT8 if any is missing).
+'''
+
+import numpy as np
+
+from .genobin import GenoBinWriter, NA_INT8, write_windows
+
+# number of sites converted and written at once, with windows in bp
+CHUNK_SITES = 4096
+
+
+def distinct_positions(positions, last=0):
+    '''
+    The positions rounded to integers, and then each increased as needed to be
+    greater than the one before (and than last), as in the VCF.
+    '''
+    r = np.rint(positions).astype(np.int64)
+    i = np.arange(len(r), dtype=np.int64)
+    return np.maximum.accumulate(np.maximum(r - i, last + 1)) + i
+
+
+def _alt_counts(haps, ploidy):
+    ind = haps.reshape((haps.shape[0], -1, ploidy))
+    out = (ind > 0).sum(axis=2).astype(np.int8)
+    out[(ind < 0).any(axis=2)] = NA_INT8
+    return out
+
+
+def export_tree_sequence(ts, prefix, size, type="snp", ploidy=1, chunk_sites=CHUNK_SITES):
+    '''
+    Write the genotypes of the tree sequence ts to the store with the given
+    prefix, and its table of windows of the given size and type ("snp" or
+    "bp").  Sites are written in chunks of size sites with type="snp" (so,
+    one window at a time), or of chunk_sites otherwise.
+    Returns (number of sites, number of windows).
+    '''
+    nsamples = ts.get_sample_size() if hasattr(ts, "get_sample_size") else ts.num_samples
+    nind = nsamples // ploidy
+    chunk = size if type == "snp" else chunk_sites
+    haps = np.empty((chunk, nind * ploidy), dtype=np.int8)
+    positions = np.empty(chunk, dtype=np.float64)
+    last = 0
+    with GenoBinWriter(prefix, samples=["msp_{}".format(k) for k in range(nind)]) as writer:
+        k = 0
+        for v in ts.variants():
+            haps[k] = np.asarray(v.genotypes)[:nind * ploidy]
+            positions[k] = v.position
+            k += 1
+            if k == chunk:
+                pos = distinct_positions(positions, last)
+                writer.write(pos, _alt_counts(haps, ploidy))
+                last = pos[-1]
+                k = 0
+        if k > 0:
+            writer.write(distinct_positions(positions[:k], last), _alt_counts(haps[:k], ploidy))
+        nsites = writer.nsites
+    return nsites, write_windows(prefix, size, type)
@@ -0,0 +1,272 @@
+'''
+Writing genotypes as a bgzipped VCF (.vcf.gz) or BCF (.bcf) file together
+with its CSI index (.csi), in one pass, so that the output of a simulation can
+be read by bcftools (and so lostruct::vcf_windower()) without first running
+"bcftools convert" and "bcftools index" over it.
+
+Records are written one site at a time with write(), giving the position and
+the alleles carried by each sample (an integer array, with negative values
+missing); the file and index are finished by close().  Tree sequences can be
+written directly with write_tree_sequence(), which writes the same sites,
+positions, and genotypes as msprime's write_vcf() does.  VcfWriter writes
+the same records as uncompressed text, without an index, and open_writer()
+chooses the writer from the name of the file.
+'''
+
+import struct
+
+import numpy as np
+
+from .bgzf import BgzfWriter, CsiIndexWriter
+from .fileio import COMPRESS_THREADS, BUFFER_SIZE
+
+
+class _IndexedWriter(object):
+
+    # the depth of the CSI index (None: from the contig lengths, as htslib does for BCF)
+    index_depth = None
+    # the number of sites kept, until the blocks they are in are written out,
+    # before adding them to the index (more are kept if need be)
+    pending_sites = 4096
+
+    def __init__(self, path, samples, contigs, ploidy=1, threads=COMPRESS_THREADS, index=True):
+        '''
+        contigs is a list of (name, length) pairs; each ploidy consecutive
+        columns of the genotypes given to write() are the alleles of one sample.
+        '''
+        self.path = path
+        self.samples = list(samples)
+        self.contigs = list(contigs)
+        self.contig_index = {name: k for k, (name, _) in enumerate(self.contigs)}
+        self.ploidy = ploidy
+        self.out = self._open(path, threads)
+        self.index = (CsiIndexWriter(self._index_names(), len(self.contigs), depth=self.index_depth,
+                                     max_length=max(int(length) for _, length in self.contigs))
+                      if index else None)
+        # (contig, start, end, uncompressed start, uncompressed end) of sites not yet indexed
+        self._pending = np.empty((self.pending_sites, 5), dtype=np.int64)
+        self._npending = 0
+        self.nsites = 0
+
+    def _open(self, path, threads):
+        return BgzfWriter(path, "wb", threads=threads)
+
+    def header_text(self):
+        lines = ["##fileformat=VCFv4.2",
+                 '##FILTER=<ID=PASS,Description="All filters passed">']
+        lines += ["##contig=<ID={},length={}>".format(name, int(length)) for name, length in self.contigs]
+        lines += ['##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+                  "\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+                            + self.samples)]
+        return "\n".join(lines) + "\n"
+
+    def write(self, chrom, pos, alleles, genotypes):
+        '''
+        Write a site on chrom at 1-based position pos with the given alleles
+        (a list of strings, the first being the reference) and genotypes.
+        '''
+        start = self.out.tell()
+        self.out.write(self._record(chrom, pos, alleles, np.asarray(genotypes)))
+        if self.index is not None:
+            if self._npending == len(self._pending):
+                self._index_pending()
+            self._pending[self._npending] = (self.contig_index[chrom], pos - 1, pos - 1 + len(alleles[0]),
+                                             start, self.out.tell())
+            self._npending += 1
+        self.nsites += 1
+
+    def _index_pending(self, closed=False):
+        '''
+        Add the pending sites whose blocks have been written out (all of them,
+        if closed) to the index, making room for more (by enlarging the array,
+        if there are none).
+        '''
+        pending = self._pending[:self._npending]
+        n = self._npending if closed else int(np.searchsorted(pending[:, 4], self.out.written()))
+        for ref, beg, end, ustart, uend in pending[:n].tolist():
+            self.index.add(ref, beg, end, self.out.virtual_offset(ustart), self.out.virtual_offset(uend))
+        if n == 0:
+            self._pending = np.concatenate([self._pending, np.empty_like(self._pending)])
+        else:
+            self._pending[:self._npending - n] = pending[n:]
+            self._npending -= n
+
+    def close(self):
+        self.out.close()
+        if self.index is not None:
+            self._index_pending(closed=True)
+            self.index.write(self.path + ".csi")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VcfGzWriter(_IndexedWriter):
+    '''
+    Writes a bgzipped VCF file (and index); see _IndexedWriter.
+    '''
+
+    # as htslib indexes a VCF, whatever the contig lengths
+    index_depth = 6
+
+    def __init__(self, *args, **kwargs):
+        super(VcfGzWriter, self).__init__(*args, **kwargs)
+        self.out.write(self.header_text().encode())
+
+    def _index_names(self):
+        return [name for name, _ in self.contigs]
+
+    def _record(self, chrom, pos, alleles, genotypes):
+        gt = genotypes.reshape((-1, self.ploidy))
+        if gt.min() >= 0 and gt.max() < 10:
+            # single-digit alleles: build the text directly
+            text = np.empty((gt.shape[0], 2 * self.ploidy), dtype=np.uint8)
+            text[:, 0] = ord("\t")
+            text[:, 1::2] = gt + ord("0")
+            text[:, 2::2] = ord("|")
+            gt_text = text.tobytes()
+        else:
+            gt_text = "".join("\t" + "|".join(str(a) if a >= 0 else "." for a in row)
+                              for row in gt.tolist()).encode()
+        fixed = "{}\t{}\t.\t{}\t{}\t.\tPASS\t.\tGT".format(
+                    chrom, pos, alleles[0], ",".join(alleles[1:]) if len(alleles) > 1 else ".")
+        return fixed.encode() + gt_text + b"\n"
+
+
+class VcfWriter(VcfGzWriter):
+    '''
+    Writes an uncompressed VCF file, without an index, to path, which may
+    also be an open (text or binary) file object, e.g., from fileopt(); this
+    is flushed but not closed by close().
+    '''
+
+    def __init__(self, path, samples, contigs, ploidy=1, threads=COMPRESS_THREADS, index=False):
+        super(VcfWriter, self).__init__(path, samples, contigs, ploidy=ploidy, threads=threads, index=False)
+
+    def _open(self, path, threads):
+        if isinstance(path, str):
+            self._owned = True
+            return open(path, "wb", buffering=BUFFER_SIZE)
+        self._owned = False
+        if hasattr(path, "buffer"):
+            path.flush()
+            return path.buffer
+        return path
+
+    def close(self):
+        if self._owned:
+            self.out.close()
+        else:
+            self.out.flush()
+
+
+def open_writer(path, samples, contigs, ploidy=1, threads=COMPRESS_THREADS):
+    '''
+    A BcfWriter if path ends in ".bcf", a VcfGzWriter (with an index) if it
+    ends in ".gz", and otherwise (or if path is an open file) a VcfWriter.
+    '''
+    if not isinstance(path, str):
+        writer_class = VcfWriter
+    elif path.endswith(".bcf"):
+        writer_class = BcfWriter
+    elif path.endswith(".gz"):
+        writer_class = VcfGzWriter
+    else:
+        writer_class = VcfWriter
+    return writer_class(path, samples, contigs, ploidy=ploidy, threads=threads)
+
+
+def _typed_int_vector(values):
+    '''
+    BCF encoding of a vector of integers, in the smallest type that holds them.
+    '''
+    values = np.asarray(values)
+    if len(values) == 0 or (values.min() > -120 and values.max() < 128):
+        typ, dtype = 1, "<i1"
+    elif values.min() > -32760 and values.max() < 32768:
+        typ, dtype = 2, "<i2"
+    else:
+        typ, dtype = 3, "<i4"
+    return _descriptor(typ, len(values)) + values.astype(dtype).tobytes()
+
+
+def _descriptor(typ, n):
+    if n < 15:
+        return bytes([(n << 4) | typ])
+    return bytes([(15 << 4) | typ]) + _typed_int_vector([n])
+
+
+def _typed_string(s):
+    s = s.encode()
+    return _descriptor(7, len(s)) + s
+
+
+# QUAL is missing
+_BCF_MISSING_FLOAT = struct.pack("<I", 0x7F800001)
+
+
+class BcfWriter(_IndexedWriter):
+    '''
+    Writes a BCF file (and index); see _IndexedWriter.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(BcfWriter, self).__init__(*args, **kwargs)
+        text = self.header_text().encode() + b"\x00"
+        self.out.write(b"BCF\x02\x02" + struct.pack("<I", len(text)) + text)
+
+    def _index_names(self):
+        return None
+
+    def _record(self, chrom, pos, alleles, genotypes):
+        nsamples = len(self.samples)
+        shared = (struct.pack("<iii", self.contig_index[chrom], pos - 1, len(alleles[0]))
+                  + _BCF_MISSING_FLOAT
+                  + struct.pack("<II", len(alleles) << 16, (1 << 24) | nsamples)
+                  + _descriptor(7, 0)
+                  + b"".join(_typed_string(a) for a in alleles)
+                  # FILTER: PASS (which has index 0 in the dictionary)
+                  + _typed_int_vector([0]))
+        gt = genotypes.reshape((nsamples, self.ploidy)).astype(np.int32)
+        # (allele + 1) << 1, with all but the first allele phased; 0 is missing
+        enc = np.where(gt >= 0, (gt + 1) << 1, 0)
+        enc[:, 1:] |= 1
+        if enc.max() < 128:
+            typ, dtype = 1, "<i1"
+        elif enc.max() < 32768:
+            typ, dtype = 2, "<i2"
+        else:
+            typ, dtype = 3, "<i4"
+        # GT has index 1 in the dictionary, after PASS
+        indiv = _typed_int_vector([1]) + _descriptor(typ, self.ploidy) + enc.astype(dtype).tobytes()
+        return struct.pack("<II", len(shared), len(indiv)) + shared + indiv
+
+
+def write_tree_sequence(ts, path, ploidy=1, chrom="1", threads=COMPRESS_THREADS):
+    '''
+    Write the variants of the msprime tree sequence ts to path, as BCF if
+    path ends in ".bcf" and as bgzipped VCF otherwise, with a CSI index.
+    As in ts.write_vcf(vcffile, ploidy), samples are named msp_0, msp_1, ...,
+    positions are rounded (and then increased as needed to be distinct), and
+    biallelic sites have alleles A and T.  Returns the number of sites written.
+    '''
+    nsamples = ts.get_sample_size() if hasattr(ts, "get_sample_size") else ts.num_samples
+    samples = ["msp_{}".format(k) for k in range(nsamples // ploidy)]
+    length = ts.get_sequence_length() if hasattr(ts, "get_sequence_length") else ts.sequence_length
+    writer_class = BcfWriter if path.endswith(".bcf") else VcfGzWriter
+    with writer_class(path, samples, [(chrom, max(1, int(round(length))))], ploidy=ploidy,
+                      threads=threads) as writer:
+        last = 0
+        for v in ts.variants():
+            pos = int(round(v.position))
+            if pos <= last:
+                pos = last + 1
+            last = pos
+            alleles = list(getattr(v, "alleles", ()))
+            if len(alleles) <= 2:
+                alleles = ["A", "T"]
+            writer.write(chrom, pos, alleles, np.asarray(v.genotypes)[:len(samples) * ploidy])
+        return writer.nsites
@@ -0,0 +1,493 @@
+'''
+Window extractors, as lostruct::vcf_windower() (in lostruct/R/query_vcf.R):
+if f = vcf_windower("my.vcf.gz", size=100, type="snp"), then f(n) is the
+(sites x samples) int8 matrix of the number of alternate alleles carried by
+each sample in the n-th window (n = 1, ..., f.max_n), with missing values NA_INT8,
+and f.samples and f.region(n) give the sample IDs (the columns) and the
+(chrom, start, end) of windows, as the "samples" and "region" attributes do in R.
+
+Windows are chosen as in R: with type="bp", each chromosome is divided into
+floor((last position - first position) / size) windows of size bp, starting
+at its first site; with type="snp", into floor(number of sites / size) windows
+of size consecutive sites.  Leftover bits at the ends of chromosomes are trimmed,
+with a warning.  Chromosomes are taken in the order that vcf_positions()
+gives them in R, that of the levels of a factor: in numerical order if all
+their names are integers (as data.table::fread() then reads them), and
+otherwise sorted as strings (so "1", "10", "2", "X").
+
+Genotypes can be read from a bgzipped, indexed VCF (.vcf.gz with .tbi or .csi),
+from an indexed BCF (.bcf with .csi), or from an msprime .trees file
+(with trees_windower(); this needs msprime or tskit).  Recently extracted
+windows are kept in a cache of at most cache_size bytes, and while window n is
+being used, window n+1 is extracted in a background thread.
+'''
+
+import re
+import struct
+import warnings
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .genobin import NA_INT8
+from .bgzf import BgzfReader, BgzfIndex, is_bgzf, find_index
+
+
+def _r_order(chroms):
+    '''
+    The chromosome names chroms sorted as the levels of R's factor(fread(...)$chrom).
+    '''
+    chroms = list(chroms)
+    if all(re.match("[-+]?[0-9]+$", c) for c in chroms):
+        return sorted(chroms, key=int)
+    return sorted(chroms)
+
+
+def _site_arrays(sites):
+    # the lists of positions in the dict sites as arrays, in R's order of chromosomes
+    return collections.OrderedDict((k, np.array(sites[k], dtype=np.int64)) for k in _r_order(sites))
+
+
+class VcfSource(object):
+    '''
+    Genotypes from a bgzipped, indexed VCF file, for the samples given
+    (by default, all of them).
+    '''
+
+    def __init__(self, path, samples=None, index=None):
+        if not is_bgzf(path):
+            raise ValueError(path + " is not bgzipped (use bgzip, and then tabix or bcftools index).")
+        if index is None:
+            index = find_index(path)
+            if index is None:
+                raise ValueError("No .tbi or .csi index found for " + path + ".")
+        self.path = path
+        self.index = BgzfIndex(index)
+        self.reader = BgzfReader(path)
+        all_samples = None
+        while True:
+            line = self.reader.readline()
+            if not line.startswith(b"#"):
+                break
+            if line.startswith(b"#CHROM"):
+                all_samples = line.rstrip(b"\r\n").decode().split("\t")[9:]
+        if all_samples is None:
+            raise ValueError("No #CHROM header line found in " + path + ".")
+        self.samples, self.columns = _select_samples(all_samples, samples)
+        self._values = _GtValues()
+
+    def sites(self):
+        '''
+        An ordered dict from chromosome names (in the order R would
+        give them: see the module documentation) to arrays of the positions of their sites.
+        '''
+        sites = collections.OrderedDict()
+        with BgzfReader(self.path) as f:
+            for line in f:
+                if line.startswith(b"#"):
+                    continue
+                chrom, pos, _ = line.split(b"\t", 2)
+                sites.setdefault(chrom.decode(), []).append(int(pos))
+        return _site_arrays(sites)
+
+    def genotypes(self, chrom, start, end):
+        '''
+        The positions and genotype matrix of the sites on chrom with start <= position < end.
+        '''
+        first, last = int(np.ceil(start)), int(np.ceil(end)) - 1
+        positions, rows = [], []
+        bchrom = chrom.encode()
+        for cbeg, cend in self.index.chunks(chrom, first, last):
+            self.reader.seek_virtual(cbeg)
+            while self.reader.tell_virtual() < cend:
+                line = self.reader.readline()
+                if not line:
+                    break
+                fields = line.rstrip(b"\r\n").split(b"\t")
+                if fields[0] != bchrom:
+                    continue
+                pos = int(fields[1])
+                if pos > last:
+                    break
+                if pos < first:
+                    continue
+                positions.append(pos)
+                gts = fields[9:]
+                rows.append([self._values[gts[j].split(b":", 1)[0]] for j in self.columns])
+        return np.array(positions, dtype=np.int64), _matrix(rows, len(self.columns))
+
+    def close(self):
+        self.reader.close()
+
+
+class _GtValues(dict):
+    '''
+    A memo of the number of alternate alleles in GT fields (as bytes), as
+    counted by lostruct::vcf_query(): "0/0", "0|0" and "0" are 0, "1/2" is 2,
+    and so on, while a GT with any missing allele is NA_INT8.
+    '''
+
+    def __missing__(self, gt):
+        alleles = re.split(b"[/|]", gt)
+        if b"." in alleles or b"" in alleles:
+            value = NA_INT8
+        else:
+            value = sum(a != b"0" for a in alleles)
+        self[gt] = value
+        return value
+
+
+def _select_samples(all_samples, samples):
+    if samples is None:
+        return list(all_samples), list(range(len(all_samples)))
+    missing = [s for s in samples if s not in all_samples]
+    if missing:
+        raise ValueError("Samples not found: " + ", ".join(missing))
+    return list(samples), [all_samples.index(s) for s in samples]
+
+
+def _matrix(rows, nsamples):
+    if len(rows) == 0:
+        return np.empty((0, nsamples), dtype=np.int8)
+    return np.array(rows, dtype=np.int8)
+
+
+# BCF typed values: type code -> (dtype, value marking the end of a vector)
+_BCF_TYPES = {1: (np.dtype("<i1"), -127), 2: (np.dtype("<i2"), -32767),
+              3: (np.dtype("<i4"), -2147483647), 5: (np.dtype("<f4"), None),
+              7: (np.dtype("S1"), None)}
+
+
+def _bcf_descriptor(buf, k):
+    '''
+    The type, length, and offset of the values of the typed value at offset k of buf.
+    '''
+    typ, n = buf[k] & 0xF, buf[k] >> 4
+    k += 1
+    if n == 15:
+        ntyp = buf[k] & 0xF
+        dtype = _BCF_TYPES[ntyp][0]
+        n = int(np.frombuffer(buf, dtype=dtype, count=1, offset=k+1)[0])
+        k += 1 + dtype.itemsize
+    return typ, n, k
+
+
+def _bcf_header_dicts(text):
+    '''
+    The contig names and the dictionary of strings (FILTER, INFO and FORMAT
+    IDs) defined by the text of a BCF header, in order of their indices.
+    '''
+    contigs, strings = {}, {0: "PASS"}
+    seen = {"PASS"}
+    for line in text.split("\n"):
+        m = re.match(r"##(contig|FILTER|INFO|FORMAT)=<ID=([^,>]+)", line)
+        if m is None:
+            continue
+        kind, name = m.groups()
+        idx = re.search(r"[<,]IDX=(\d+)", line)
+        if kind == "contig":
+            contigs[int(idx.group(1)) if idx else len(contigs)] = name
+        elif name not in seen:
+            seen.add(name)
+            strings[int(idx.group(1)) if idx else len(strings)] = name
+    return [contigs[k] for k in sorted(contigs)], strings
+
+
+class BcfSource(object):
+    '''
+    Genotypes from an indexed BCF file (as made by bcf_and_index.sh),
+    for the samples given (by default, all of them).
+    '''
+
+    def __init__(self, path, samples=None, index=None):
+        if index is None:
+            index = find_index(path)
+            if index is None:
+                raise ValueError("No .csi index found for " + path + " (run bcftools index).")
+        self.path = path
+        self.reader = BgzfReader(path)
+        if self.reader.read(5) != b"BCF\x02\x02":
+            raise ValueError(path + " is not a BCF (version 2.2) file.")
+        l_text, = struct.unpack("<I", self.reader.read(4))
+        text = self.reader.read(l_text).rstrip(b"\x00").decode()
+        self.data_start = self.reader.tell_virtual()
+        self.contigs, strings = _bcf_header_dicts(text)
+        self.gt_key = [k for k, v in strings.items() if v == "GT"]
+        chrom_line = [x for x in text.split("\n") if x.startswith("#CHROM")]
+        all_samples = chrom_line[0].split("\t")[9:] if chrom_line else []
+        self.samples, self.columns = _select_samples(all_samples, samples)
+        self.index = BgzfIndex(index, names=self.contigs)
+
+    def _records(self):
+        '''
+        Iterate over (contig index, 1-based position, record) from the current
+        position of the reader.
+        '''
+        while True:
+            head = self.reader.read(8)
+            if len(head) < 8:
+                return
+            l_shared, l_indiv = struct.unpack("<II", head)
+            rec = self.reader.read(l_shared + l_indiv)
+            chrom, pos = struct.unpack("<ii", rec[:8])
+            yield chrom, pos + 1, (rec, l_shared)
+
+    def _gt(self, rec, l_shared):
+        '''
+        The number of alternate alleles of each sample in a record.
+        '''
+        n_fmt_sample, = struct.unpack("<I", rec[20:24])
+        n_sample, n_fmt = n_fmt_sample & 0xFFFFFF, n_fmt_sample >> 24
+        k = l_shared
+        for _ in range(n_fmt):
+            typ, _, k = _bcf_descriptor(rec, k)
+            key = int(np.frombuffer(rec, dtype=_BCF_TYPES[typ][0], count=1, offset=k)[0])
+            k += _BCF_TYPES[typ][0].itemsize
+            typ, n, k = _bcf_descriptor(rec, k)
+            dtype, vector_end = _BCF_TYPES[typ]
+            if key in self.gt_key:
+                gt = np.frombuffer(rec, dtype=dtype, count=n_sample * n, offset=k).reshape((n_sample, n))
+                gt = gt[self.columns].astype(np.int64)
+                present = (gt != vector_end)
+                alleles = (gt >> 1) - 1
+                out = (present & (alleles > 0)).sum(axis=1).astype(np.int8)
+                out[(present & (alleles < 0)).any(axis=1) | ~present.any(axis=1)] = NA_INT8
+                return out
+            k += n_sample * n * dtype.itemsize
+        return np.full(len(self.columns), NA_INT8, dtype=np.int8)
+
+    def sites(self):
+        sites = collections.OrderedDict()
+        self.reader.seek_virtual(self.data_start)
+        for chrom, pos, _ in self._records():
+            sites.setdefault(self.contigs[chrom], []).append(pos)
+        return _site_arrays(sites)
+
+    def genotypes(self, chrom, start, end):
+        first, last = int(np.ceil(start)), int(np.ceil(end)) - 1
+        positions, rows = [], []
+        ref = self.contigs.index(chrom) if chrom in self.contigs else None
+        for cbeg, cend in self.index.chunks(chrom, first, last):
+            self.reader.seek_virtual(cbeg)
+            for rchrom, pos, rec in self._records():
+                if rchrom != ref:
+                    if self.reader.tell_virtual() >= cend:
+                        break
+                    continue
+                if pos > last:
+                    break
+                if pos >= first:
+                    positions.append(pos)
+                    rows.append(self._gt(*rec))
+                if self.reader.tell_virtual() >= cend:
+                    break
+        return np.array(positions, dtype=np.int64), _matrix(rows, len(self.columns))
+
+    def close(self):
+        self.reader.close()
+
+
+class TreeSource(object):
+    '''
+    Genotypes from an msprime tree sequence (or .trees file), all on the
+    single chromosome chrom.  Each ploidy consecutive samples are one
+    individual, named "msp_k" as in the VCF written by msprime with that ploidy.
+    '''
+
+    def __init__(self, ts, chrom="1", ploidy=1, samples=None):
+        if isinstance(ts, str):
+            try:
+                import tskit
+                ts = tskit.load(ts)
+            except ImportError:
+                import msprime
+                ts = msprime.load(ts)
+        self.ts = ts
+        self.chrom = chrom
+        self.ploidy = ploidy
+        nsamples = ts.get_sample_size() if hasattr(ts, "get_sample_size") else ts.num_samples
+        self.nind = nsamples // ploidy
+        self.samples, self.columns = _select_samples(["msp_{}".format(k) for k in range(self.nind)], samples)
+
+    def sites(self):
+        positions = np.array([site.position for site in self.ts.sites()])
+        return collections.OrderedDict([(self.chrom, positions)])
+
+    def _variants(self, start, end):
+        try:
+            variants = self.ts.variants(left=start, right=end)
+        except TypeError:
+            # older versions of msprime cannot start partway along
+            variants = (v for v in self.ts.variants() if start <= v.position)
+        for v in variants:
+            if v.position >= end:
+                break
+            yield v
+
+    def genotypes(self, chrom, start, end):
+        positions, rows = [], []
+        if chrom == self.chrom:
+            for v in self._variants(start, end):
+                g = np.asarray(v.genotypes, dtype=np.int64)
+                ind = g[:self.nind * self.ploidy].reshape((self.nind, self.ploidy))[self.columns]
+                out = (ind > 0).sum(axis=1).astype(np.int8)
+                out[(ind < 0).any(axis=1)] = NA_INT8
+                positions.append(v.position)
+                rows.append(out)
+        return np.array(positions), _matrix(rows, len(self.columns))
+
+    def close(self):
+        pass
+
+
+class Windower(object):
+    '''
+    A window extractor over a source of genotypes (a VcfSource, BcfSource,
+    or TreeSource): see the module documentation.  The positions of all sites
+    are read from the source unless given as sites (a dict from chromosome
+    to array of positions, as from the source's sites()); the chromosomes
+    are windowed in the order R would take them.
+    '''
+
+    def __init__(self, source, size, type, sites=None, cache_size=256 * 1024 * 1024, prefetch=True):
+        if type not in ("bp", "snp"):
+            raise ValueError("Window type must be 'bp' or 'snp'.")
+        self.source = source
+        self.size = size
+        self.type = type
+        self.sites = source.sites() if sites is None else sites
+        self.samples = source.samples
+        chroms = _r_order(self.sites.keys())
+        if type == "bp":
+            starts = [self.sites[c].min() for c in chroms]
+            lens = [self.sites[c].max() - s for c, s in zip(chroms, starts)]
+        else:
+            starts = [0 for c in chroms]
+            lens = [len(self.sites[c]) for c in chroms]
+        nwins = [int(n // size) for n in lens]
+        warnings.warn("Trimming from chromosome ends: " + ", ".join(
+            "{}: {}".format(c, n - size * w) for c, n, w in zip(chroms, lens, nwins))
+            + (" bp." if type == "bp" else " SNPs."))
+        self.chroms = chroms
+        self.chrom_starts = starts
+        self.chrom_breaks = np.cumsum([0] + nwins)
+        self.max_n = int(self.chrom_breaks[-1])
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    def _locate(self, n):
+        if n < 1 or n > self.max_n:
+            raise IndexError("No such window.")
+        k = int(np.searchsorted(self.chrom_breaks, n - 1, side="right")) - 1
+        return k, n - int(self.chrom_breaks[k])
+
+    def region(self, n=None):
+        '''
+        The (chrom, start, end) of window n, or a list of these for a sequence
+        of windows (all of them, if n is None); start and end are inclusive.
+        '''
+        if n is None:
+            n = range(1, self.max_n + 1)
+        if not np.isscalar(n):
+            return [self.region(x) for x in n]
+        k, cn = self._locate(n)
+        chrom = self.chroms[k]
+        if self.type == "bp":
+            start = self.chrom_starts[k] + (cn - 1) * self.size
+            return chrom, start.item(), (start + self.size - 1).item()
+        pos = self.sites[chrom]
+        return chrom, pos[(cn - 1) * self.size].item(), pos[cn * self.size - 1].item()
+
+    def _extract(self, n):
+        k, cn = self._locate(n)
+        chrom = self.chroms[k]
+        with self._lock:
+            if self.type == "bp":
+                start = self.chrom_starts[k] + (cn - 1) * self.size
+                return self.source.genotypes(chrom, start, start + self.size)[1]
+            pos = self.sites[chrom]
+            a, b = (cn - 1) * self.size, cn * self.size
+            found, geno = self.source.genotypes(chrom, pos[a], np.nextafter(pos[b - 1], np.inf))
+            # skip sites sharing the first position that belong to the previous window
+            skip = a - int(np.searchsorted(pos, pos[a], side="left"))
+            return geno[skip:skip + self.size]
+
+    def _store(self, n, geno):
+        if n in self._cache:
+            return
+        self._cache[n] = geno
+        self._cache_bytes += geno.nbytes
+        while self._cache_bytes > self.cache_size and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cache_bytes -= old.nbytes
+
+    def _prefetch(self, n):
+        '''
+        Start extracting window n in the background, keeping the previously
+        prefetched window if it is ready.
+        '''
+        if self._executor is None or n > self.max_n or n in self._cache:
+            return
+        if self._pending is not None:
+            m, future = self._pending
+            if m == n:
+                return
+            if future.done() and future.exception() is None:
+                self._store(m, future.result())
+        self._pending = (n, self._executor.submit(self._extract, n))
+
+    def __call__(self, n):
+        n = int(n)
+        if n in self._cache:
+            self._cache.move_to_end(n)
+            geno = self._cache[n]
+        else:
+            if self._pending is not None and self._pending[0] == n:
+                geno = self._pending[1].result()
+                self._pending = None
+            else:
+                geno = self._extract(n)
+            self._store(n, geno)
+        self._prefetch(n + 1)
+        return geno
+
+    def __len__(self):
+        return self.max_n
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def vcf_windower(file, size, type, sites=None, samples=None, **kwargs):
+    '''
+    A Windower for an indexed, bgzipped VCF or BCF file, for the given samples
+    (by default, all); other arguments are passed to Windower.
+    '''
+    if file.endswith(".bcf"):
+        source = BcfSource(file, samples=samples)
+    else:
+        source = VcfSource(file, samples=samples)
+    return Windower(source, size, type, sites=sites, **kwargs)
+
+
+def trees_windower(ts, size, type, chrom="1", ploidy=1, samples=None, **kwargs):
+    '''
+    A Windower for an msprime tree sequence or .trees file (see TreeSource);
+    other arguments are passed to Windower.
+    '''
+    return Windower(TreeSource(ts, chrom=chrom, ploidy=ploidy, samples=samples),
+                    size, type, **kwargs)
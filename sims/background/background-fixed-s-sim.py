@@ -3,8 +3,7 @@ description = '''
 Simulate AND write to msprime/vcf.
 '''
 
-import gzip
-import sys
+import sys, os
 from optparse import OptionParser
 import math
 import time
@@ -12,22 +11,11 @@ import random
 from ftprime import RecombCollector
 import msprime
 
-def fileopt(fname,opts):
-    '''Return the file referred to by fname, open with options opts;
-    if fname is "-" return stdin/stdout; if fname ends with .gz run it through gzip.
-    '''
-    if fname == "-":
-        if opts == "r":
-            fobj = sys.stdin
-        elif opts == "w":
-            fobj = sys.stdout
-        else:
-            print("Something not right here.")
-    elif fname[len(fname)-3:len(fname)]==".gz":
-        fobj = gzip.open(fname,opts)
-    else:
-        fobj = open(fname,opts)
-    return fobj
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import vcf_stem, windowed_prefix
+from pylostruct.mutoverlay import write_overlay
 
 parser = OptionParser(description=description)
 parser.add_option("-T","--generations",dest="generations",help="number of generations to run for")
@@ -45,7 +33,11 @@ parser.add_option("-A","--ancestor_age",dest="ancestor_age",help="time to ancest
 parser.add_option("-U","--mut_rate",dest="mut_rate",help="mutation rate",default=1e-7)
 parser.add_option("-t","--treefile",dest="treefile",help="name of output file for trees (default: not output)",default=None)
 parser.add_option("-I","--simplify_interval",dest="simplify_interval",default=500)
+parser.add_option("-M","--stream_mutations",dest="stream_mutations",action="store_true",help="add mutations tree by tree as the VCF is written, with bounded memory (the mutations differ from msprime's for the same seed)",default=False)
 parser.add_option("-o","--outfile",dest="outfile",help="name of output VCF file (default: not output)",default=None)
+parser.add_option("-W","--window_size","--genobin_window",dest="genobin_window",type="int",help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), in a binary genotype store (see pylostruct/genobin.py) with tables of the windows, to be read with lostruct::genobin_windower()")
+parser.add_option("--window_type","--genobin_window_type",dest="genobin_window_type",type="choice",choices=["snp","bp"],help="units of --window_size (as run_lostruct.R's -t) [default: snp]",default="snp")
+parser.add_option("--genobin_file",dest="genobin_file",help="prefix of the binary genotype store (default: the VCF's name without .vcf, plus .TYPESIZE, e.g. sim.snp1000)")
 parser.add_option("-g","--logfile",dest="logfile",help="name of log file (or '-' for stdout)",default="-")
 parser.add_option("-s","--selloci_file",dest="selloci_file",help="name of file to output selected locus information",default="sel_loci.txt")
 parser.add_option("-e", "--samples_file", help="name of file to output information on samples (default=(dir)/samples.tsv)")
@@ -60,6 +52,11 @@ from simuPOP.demography import migr2DSteppingStoneRates, migrSteppingStoneRates
 if options.outfile is not None:
     outfile = fileopt(options.outfile, "w")
 logfile = fileopt(options.logfile, "w")
+if options.genobin_window is not None and options.genobin_file is None:
+    # next to the VCF, where run_lostruct.R looks for it (or the trees, if there is no VCF)
+    stem = (vcf_stem(options.outfile) if options.outfile not in (None, "-")
+            else os.path.join(os.path.dirname(options.treefile or ""), "sim"))
+    options.genobin_file = windowed_prefix(stem, options.genobin_window, options.genobin_window_type)
 selloci_file = options.selloci_file
 if args.samples_file is None:
     args.samples_file = os.path.join(os.path.dirname(args.treefile),"samples.tsv")
@@ -228,30 +225,49 @@ logfile.flush()
 
 mut_seed=random.randrange(1,1000)
 logfile.write("Generating mutations with seed "+str(mut_seed)+"\n")
-rng = msprime.RandomGenerator(mut_seed)
-nodes = msprime.NodeTable()
-edgesets = msprime.EdgesetTable()
-sites = msprime.SiteTable()
-mutations = msprime.MutationTable()
-ts.dump_tables(nodes=nodes, edgesets=edgesets)
-mutgen = msprime.MutationGenerator(rng, mut_rate)
-mutgen.generate(nodes, edgesets, sites, mutations)
-mutated_ts = msprime.load_tables(
-    nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
-
-del ts
-
-logfile.write("Generated mutations!\n")
-logfile.write(time.strftime('%X %x %Z')+"\n")
-logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
-logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
-logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
-logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
-
-if options.outfile is None:
-    print("NOT writing out genotype data.\n")
+if options.stream_mutations:
+    # mutations are added tree by tree as the VCF is written (see pylostruct/mutoverlay.py),
+    # without building a second, mutated, tree sequence
+    logfile.write("Sequence length: {}\n".format(ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(ts.get_num_trees()))
+    if options.outfile is None and options.genobin_window is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        nmuts = write_overlay(ts, mut_rate, mut_seed, outfile if options.outfile is not None else None,
+                              ploidy=1, genobin_prefix=options.genobin_file, window_size=options.genobin_window,
+                              window_type=options.genobin_window_type)
+        if options.outfile is not None:
+            outfile.close()
+        logfile.write("Generated and wrote mutations!\n")
+        logfile.write(time.strftime('%X %x %Z')+"\n")
+        logfile.write("Number of mutations: {}\n".format(nmuts))
 else:
-    mutated_ts.write_vcf(outfile,ploidy=1)
+    rng = msprime.RandomGenerator(mut_seed)
+    nodes = msprime.NodeTable()
+    edgesets = msprime.EdgesetTable()
+    sites = msprime.SiteTable()
+    mutations = msprime.MutationTable()
+    ts.dump_tables(nodes=nodes, edgesets=edgesets)
+    mutgen = msprime.MutationGenerator(rng, mut_rate)
+    mutgen.generate(nodes, edgesets, sites, mutations)
+    mutated_ts = msprime.load_tables(
+        nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
+
+    del ts
+
+    logfile.write("Generated mutations!\n")
+    logfile.write(time.strftime('%X %x %Z')+"\n")
+    logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
+    logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
+    logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
+
+    if options.outfile is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        mutated_ts.write_vcf(outfile,ploidy=1)
+    if options.genobin_window is not None:
+        export_tree_sequence(mutated_ts, options.genobin_file, options.genobin_window, options.genobin_window_type, ploidy=1)
 
 
 logfile.write("All done!\n")
@@ -3,7 +3,6 @@ description = '''
 Simulates on a rectangular grid that was bisected (in 'width') for some period in the past.
 '''
 
-import gzip
 import sys, os
 import math
 import time
@@ -12,22 +11,12 @@ from ftprime import RecombCollector
 import msprime
 import argparse
 
-def fileopt(fname,opts):
-    '''Return the file referred to by fname, open with options opts;
-    if fname is "-" return stdin/stdout; if fname ends with .gz run it through gzip.
-    '''
-    if fname == "-":
-        if opts == "r":
-            fobj = sys.stdin
-        elif opts == "w":
-            fobj = sys.stdout
-        else:
-            print("Something not right here.")
-    elif fname[len(fname)-3:len(fname)]==".gz":
-        fobj = gzip.open(fname,opts)
-    else:
-        fobj = open(fname,opts)
-    return fobj
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import vcf_stem, windowed_prefix
+from pylostruct.mutoverlay import write_overlay
+from pylostruct.demography import SteppingStone, Phase
 
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument("--post_generations","-R", type=int, dest="post_generations",
@@ -69,8 +58,16 @@ parser.add_argument("--simplify_interval", "-I", dest="simplify_interval", type=
 parser.add_argument("--seed", "-d", dest="seed", type=int,
         help="random seed", default=random.randrange(1,1000))
 
+parser.add_argument("--stream_mutations", "-M", dest="stream_mutations", action="store_true",
+        help="add mutations tree by tree as the VCF is written, with bounded memory (the mutations differ from msprime's for the same seed)")
 parser.add_argument("--outfile","-o", type=str, dest="outfile",
         help="name of output VCF file (default: not output)",default=None)
+parser.add_argument("--window_size", "--genobin_window", "-W", type=int, dest="genobin_window",
+        help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), in a binary genotype store (see pylostruct/genobin.py) with tables of the windows, to be read with lostruct::genobin_windower()")
+parser.add_argument("--window_type", "--genobin_window_type", type=str, dest="genobin_window_type", choices=["snp", "bp"], default="snp",
+        help="units of --window_size (as run_lostruct.R's -t) [default: snp]")
+parser.add_argument("--genobin_file", type=str, dest="genobin_file",
+        help="prefix of the binary genotype store (default: the VCF's name without .vcf, plus .TYPESIZE, e.g. sim.snp1000)")
 parser.add_argument("--logfile","-g", type=str, dest="logfile",
         help="name of log file (or '-' for stdout)",default="-")
 parser.add_argument("--selloci_file","-s", type=str, dest="selloci_file",
@@ -85,27 +82,17 @@ import simuPOP as sim
 # these just return the migration matrix as a list of lists
 # from simuPOP.demography import migr2DSteppingStoneRates, migrSteppingStoneRates
 
-def migrRates(migr, m, n, barrier=False):
-    b = math.floor(m/2) - 1 # barrier is between rows b, b+1
-    npops = m*n
-    rows = [i for i in range(m) for j in range(n)]
-    cols = [j for i in range(m) for j in range(n)]
-    M = [[0.0 for u in range(npops)] for v in range(npops)]
-    for u in range(npops):
-        for v in range(npops):
-            if ((abs(rows[u] - rows[v]) == 0 and abs(cols[u] - cols[v]) == 1)
-                or (abs(rows[u] - rows[v]) == 1 and abs(cols[u] - cols[v]) == 0)):
-                if not barrier or not (((rows[u] == b) and (rows[v] == b+1)) or ((rows[u] == b+1) and (rows[v] == b))):
-                    M[u][v] = migr
-        M[u][u] = 1.0 - sum(M[u])
-    return M
-
 sim.setRNG(seed=args.seed)
 random.seed(args.seed)
 
 if args.outfile is not None:
     outfile = fileopt(args.outfile, "w")
 logfile = fileopt(args.logfile, "w")
+if args.genobin_window is not None and args.genobin_file is None:
+    # next to the VCF, where run_lostruct.R looks for it (or the trees, if there is no VCF)
+    stem = (vcf_stem(args.outfile) if args.outfile not in (None, "-")
+            else os.path.join(os.path.dirname(args.treefile or ""), "sim"))
+    args.genobin_file = windowed_prefix(stem, args.genobin_window, args.genobin_window_type)
 if args.selloci_file is None:
     args.selloci_file = os.path.join(os.path.dirname(args.treefile),"sel_loci.txt")
 selloci_file = args.selloci_file
@@ -191,8 +178,16 @@ node_ids = {x:j for x, j in zip(haploid_labels, init_ts.samples())}
 rc = RecombCollector(ts=init_ts, node_ids=node_ids,
                      locus_position=locus_position)
 
-migr_rates = migrRates(args.migr, m=args.gridwidth, n=args.gridheight, barrier=False)
-barrier_rates = migrRates(args.migr, m=args.gridwidth, n=args.gridheight, barrier=True)
+# the barrier is between rows b, b+1 (a grid one row wide has none)
+grid = SteppingStone(args.gridwidth, args.gridheight, migr=args.migr,
+                     barrier=max(0, math.floor(args.gridwidth/2) - 1) if args.gridwidth > 1 else None)
+# free migration, then the barrier, then free migration again
+phases = [Phase(begin=0, end=args.pre_generations, migr=args.migr, barrier=False),
+          Phase(begin=1 + args.pre_generations, end=args.split_generations + args.pre_generations,
+                migr=args.migr, barrier=True),
+          Phase(begin=1 + args.split_generations + args.pre_generations,
+                end=args.split_generations + args.pre_generations + args.post_generations,
+                migr=args.migr, barrier=False)]
 
 pop.evolve(
     initOps=[
@@ -200,21 +195,13 @@ pop.evolve(
     ]+init_geno,
     preOps=[
         sim.PyOperator(lambda pop: rc.increment_time() or True),
+    ]+[
         sim.Migrator(
-            rate=migr_rates,
-            mode=sim.BY_PROBABILITY,
-            begin=0, 
-            end=args.pre_generations),
-        sim.Migrator(
-            rate=barrier_rates,
-            mode=sim.BY_PROBABILITY,
-            begin=1 + args.pre_generations, 
-            end=args.split_generations + args.pre_generations),
-        sim.Migrator(
-            rate=migr_rates,
+            rate=rates,
             mode=sim.BY_PROBABILITY,
-            begin=1 + args.split_generations + args.pre_generations,
-            end=args.split_generations + args.pre_generations + args.post_generations),
+            begin=begin,
+            end=end) for rates, begin, end in grid.simupop_phases(phases)
+    ]+[
         sim.SNPMutator(u=args.sel_mut_rate, v=args.sel_mut_rate),
         sim.PyMlSelector(GammaDistributedFitness(args.gamma_alpha, args.gamma_beta),
             output=">>"+selloci_file),
@@ -281,30 +268,49 @@ logfile.write(time.strftime('%X %x %Z')+"\n")
 logfile.write("Generating mutations with seed "+str(mut_seed)+"\n")
 logfile.flush()
 
-rng = msprime.RandomGenerator(mut_seed)
-nodes = msprime.NodeTable()
-edgesets = msprime.EdgesetTable()
-sites = msprime.SiteTable()
-mutations = msprime.MutationTable()
-ts.dump_tables(nodes=nodes, edgesets=edgesets)
-mutgen = msprime.MutationGenerator(rng, args.mut_rate)
-mutgen.generate(nodes, edgesets, sites, mutations)
-mutated_ts = msprime.load_tables(
-    nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
-
-del ts
-
-logfile.write("Generated mutations!\n")
-logfile.write(time.strftime('%X %x %Z')+"\n")
-logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
-logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
-logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
-logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
-
-if args.outfile is None:
-    print("NOT writing out genotype data.\n")
+if args.stream_mutations:
+    # mutations are added tree by tree as the VCF is written (see pylostruct/mutoverlay.py),
+    # without building a second, mutated, tree sequence
+    logfile.write("Sequence length: {}\n".format(ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(ts.get_num_trees()))
+    if args.outfile is None and args.genobin_window is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        nmuts = write_overlay(ts, args.mut_rate, mut_seed, outfile if args.outfile is not None else None,
+                              ploidy=1, genobin_prefix=args.genobin_file, window_size=args.genobin_window,
+                              window_type=args.genobin_window_type)
+        if args.outfile is not None:
+            outfile.close()
+        logfile.write("Generated and wrote mutations!\n")
+        logfile.write(time.strftime('%X %x %Z')+"\n")
+        logfile.write("Number of mutations: {}\n".format(nmuts))
 else:
-    mutated_ts.write_vcf(outfile,ploidy=1)
+    rng = msprime.RandomGenerator(mut_seed)
+    nodes = msprime.NodeTable()
+    edgesets = msprime.EdgesetTable()
+    sites = msprime.SiteTable()
+    mutations = msprime.MutationTable()
+    ts.dump_tables(nodes=nodes, edgesets=edgesets)
+    mutgen = msprime.MutationGenerator(rng, args.mut_rate)
+    mutgen.generate(nodes, edgesets, sites, mutations)
+    mutated_ts = msprime.load_tables(
+        nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
+
+    del ts
+
+    logfile.write("Generated mutations!\n")
+    logfile.write(time.strftime('%X %x %Z')+"\n")
+    logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
+    logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
+    logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
+
+    if args.outfile is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        mutated_ts.write_vcf(outfile,ploidy=1)
+    if args.genobin_window is not None:
+        export_tree_sequence(mutated_ts, args.genobin_file, args.genobin_window, args.genobin_window_type, ploidy=1)
 
 
 logfile.write("All done!\n")
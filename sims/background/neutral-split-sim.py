@@ -11,6 +11,10 @@ import msprime
 
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.mutoverlay import write_overlay
+
 parser = argparse.ArgumentParser(description=usage)
 parser.add_argument('--outdir', '-o', help="Output directory.")
 parser.add_argument('--Ne', '-N', nargs="+", type=int, help="List of effective population sizes used for each *chromosome*.")
@@ -21,8 +25,12 @@ parser.add_argument('--recomb_rate', '-r', default=1e-7, type=float, help="Recom
 parser.add_argument('--relative_split_time', '-T', default=0.25, type=float, help="Time since rearrangement of populations in units of Ne.")
 parser.add_argument('--relative_fast_m', '-m', default=10, type=float, help="Migration rate for 'close' pops in units of Ne.")
 parser.add_argument('--relative_slow_m', '-M', default=0.1, type=float, help="Migration rate for 'distant' pops in units of Ne.")
+parser.add_argument('--seed', '-d', type=int, default=random.randrange(1,1000), help="Random seed (for the seeds of the mutations).")
+parser.add_argument('--stream_mutations', action="store_true",
+        help="Add mutations tree by tree as the VCF is written, with bounded memory (the mutations differ from msprime's for the same seed).")
 
 args = parser.parse_args()
+random.seed(args.seed)
 
 if not os.path.isdir(args.outdir):
     os.mkdir(args.outdir)
@@ -97,12 +105,27 @@ for chrom,opts in options.items():
     logfile.write(time.strftime('     %X %x %Z\n'))
     logfile.flush()
 
+    mut_seed = random.randrange(1,1000)
+    logfile.write("  with seed {}\n".format(mut_seed))
+
+    if args.stream_mutations:
+        # mutations are added tree by tree as the VCF is written (see pylostruct/mutoverlay.py),
+        # without building a second, mutated, tree sequence; the trees are saved without them
+        ts.dump(opts['treefile'])
+        nmuts = write_overlay(ts, opts['mut_rate'], mut_seed, opts['vcffile'], ploidy=1)
+        del ts
+
+        logfile.write("  done generating and writing {} mutations!\n".format(nmuts))
+        logfile.write(time.strftime('     %X %x %Z\n'))
+        logfile.flush()
+        continue
+
     rng = msprime.RandomGenerator(mut_seed)
     nodes = msprime.NodeTable()
     edgesets = msprime.EdgesetTable()
     sites = msprime.SiteTable()
     mutations = msprime.MutationTable()
-    minimal_ts.dump_tables(nodes=nodes, edgesets=edgesets)
+    ts.dump_tables(nodes=nodes, edgesets=edgesets)
     mutgen = msprime.MutationGenerator(rng, opts['mut_rate'])
     mutgen.generate(nodes, edgesets, sites, mutations)
 
@@ -116,15 +139,8 @@ for chrom,opts in options.items():
     logfile.flush()
 
     mutated_ts.dump(opts['treefile'])
-    mutated_ts.write_vcf(open(opts['vcffile'],'w'),ploidy=1)
-
-
-logfile.write("Writing out samples.\n")
-logfile.write(time.strftime('%X %x %Z')+"\n")
-logfile.write("----------\n")
-logfile.flush()
-
-mutated_ts.dump_samples_text(samples_file)
+    with fileopt(opts['vcffile'], 'w') as vcffile:
+        mutated_ts.write_vcf(vcffile, ploidy=1)
 
 
 logfile.write("Done!\n")
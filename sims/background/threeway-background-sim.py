@@ -9,7 +9,6 @@ Output in selloci is of the form
 meaning locus number, allele1, allele2, fitness when it is first seen.
 '''
 
-import gzip
 import sys, os
 import math
 import time
@@ -18,22 +17,11 @@ from ftprime import RecombCollector
 import msprime
 import argparse
 
-def fileopt(fname,opts):
-    '''Return the file referred to by fname, open with options opts;
-    if fname is "-" return stdin/stdout; if fname ends with .gz run it through gzip.
-    '''
-    if fname == "-":
-        if opts == "r":
-            fobj = sys.stdin
-        elif opts == "w":
-            fobj = sys.stdout
-        else:
-            print("Something not right here.")
-    elif fname[len(fname)-3:len(fname)]==".gz":
-        fobj = gzip.open(fname,opts)
-    else:
-        fobj = open(fname,opts)
-    return fobj
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import vcf_stem, windowed_prefix
+from pylostruct.mutoverlay import write_overlay
 
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument('--relative_switch_time', '-w', default=0.25, type=float, 
@@ -58,7 +46,15 @@ parser.add_argument("--simplify_interval", "-I", dest="simplify_interval", type=
 parser.add_argument("--seed", "-d", type=int, help="random seed", default=random.randrange(1,1000))
 
 parser.add_argument("--treefile", "-t", help="name of output file for trees (default: not output)", default=None)
+parser.add_argument("--stream_mutations", dest="stream_mutations", action="store_true",
+        help="add mutations tree by tree as the VCF is written, with bounded memory (the mutations differ from msprime's for the same seed)")
 parser.add_argument("--outfile", "-o", help="name of output VCF file (default: not output)", default=None)
+parser.add_argument("--window_size", "--genobin_window", "-W", type=int, dest="genobin_window",
+        help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), in a binary genotype store (see pylostruct/genobin.py) with tables of the windows, to be read with lostruct::genobin_windower()")
+parser.add_argument("--window_type", "--genobin_window_type", type=str, dest="genobin_window_type", choices=["snp", "bp"], default="snp",
+        help="units of --window_size (as run_lostruct.R's -t) [default: snp]")
+parser.add_argument("--genobin_file", type=str, dest="genobin_file",
+        help="prefix of the binary genotype store (default: the VCF's name without .vcf, plus .TYPESIZE, e.g. sim.snp1000)")
 parser.add_argument("--logfile", "-g", help="name of log file (or '-' for stdout)", default="-")
 parser.add_argument("--selloci_file", "-s", help="name of file to output selected locus information (default: (dir)/sel_loci.txt)")
 parser.add_argument("--samples_file", "-e", help="name of file to output information on samples (default=(dir)/samples.tsv)")
@@ -76,6 +72,11 @@ random.seed(args.seed)
 if args.outfile is not None:
     outfile = fileopt(args.outfile, "w")
 logfile = fileopt(args.logfile, "w")
+if args.genobin_window is not None and args.genobin_file is None:
+    # next to the VCF, where run_lostruct.R looks for it (or the trees, if there is no VCF)
+    stem = (vcf_stem(args.outfile) if args.outfile not in (None, "-")
+            else os.path.join(os.path.dirname(args.treefile or ""), "sim"))
+    args.genobin_file = windowed_prefix(stem, args.genobin_window, args.genobin_window_type)
 if args.selloci_file is None:
     args.selloci_file = os.path.join(os.path.dirname(args.treefile),"sel_loci.txt")
 selloci_file = args.selloci_file
@@ -248,30 +249,49 @@ logfile.write(time.strftime('%X %x %Z')+"\n")
 logfile.write("Generating mutations with seed "+str(mut_seed)+"\n")
 logfile.flush()
 
-rng = msprime.RandomGenerator(mut_seed)
-nodes = msprime.NodeTable()
-edgesets = msprime.EdgesetTable()
-sites = msprime.SiteTable()
-mutations = msprime.MutationTable()
-ts.dump_tables(nodes=nodes, edgesets=edgesets)
-mutgen = msprime.MutationGenerator(rng, args.mut_rate)
-mutgen.generate(nodes, edgesets, sites, mutations)
-mutated_ts = msprime.load_tables(
-    nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
-
-del ts
-
-logfile.write("Generated mutations!\n")
-logfile.write(time.strftime('%X %x %Z')+"\n")
-logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
-logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
-logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
-logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
-
-if args.outfile is None:
-    print("NOT writing out genotype data.\n")
+if args.stream_mutations:
+    # mutations are added tree by tree as the VCF is written (see pylostruct/mutoverlay.py),
+    # without building a second, mutated, tree sequence
+    logfile.write("Sequence length: {}\n".format(ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(ts.get_num_trees()))
+    if args.outfile is None and args.genobin_window is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        nmuts = write_overlay(ts, args.mut_rate, mut_seed, outfile if args.outfile is not None else None,
+                              ploidy=1, genobin_prefix=args.genobin_file, window_size=args.genobin_window,
+                              window_type=args.genobin_window_type)
+        if args.outfile is not None:
+            outfile.close()
+        logfile.write("Generated and wrote mutations!\n")
+        logfile.write(time.strftime('%X %x %Z')+"\n")
+        logfile.write("Number of mutations: {}\n".format(nmuts))
 else:
-    mutated_ts.write_vcf(outfile,ploidy=1)
+    rng = msprime.RandomGenerator(mut_seed)
+    nodes = msprime.NodeTable()
+    edgesets = msprime.EdgesetTable()
+    sites = msprime.SiteTable()
+    mutations = msprime.MutationTable()
+    ts.dump_tables(nodes=nodes, edgesets=edgesets)
+    mutgen = msprime.MutationGenerator(rng, args.mut_rate)
+    mutgen.generate(nodes, edgesets, sites, mutations)
+    mutated_ts = msprime.load_tables(
+        nodes=nodes, edgesets=edgesets, sites=sites, mutations=mutations)
+
+    del ts
+
+    logfile.write("Generated mutations!\n")
+    logfile.write(time.strftime('%X %x %Z')+"\n")
+    logfile.write("Mean pairwise diversity: {}\n".format(mutated_ts.get_pairwise_diversity()/mutated_ts.get_sequence_length()))
+    logfile.write("Sequence length: {}\n".format(mutated_ts.get_sequence_length()))
+    logfile.write("Number of trees: {}\n".format(mutated_ts.get_num_trees()))
+    logfile.write("Number of mutations: {}\n".format(mutated_ts.get_num_mutations()))
+
+    if args.outfile is None:
+        print("NOT writing out genotype data.\n")
+    else:
+        mutated_ts.write_vcf(outfile,ploidy=1)
+    if args.genobin_window is not None:
+        export_tree_sequence(mutated_ts, args.genobin_file, args.genobin_window, args.genobin_window_type, ploidy=1)
 
 
 logfile.write("All done!\n")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+description = '''
+Time building stepping-stone migration matrices for square grids of a range
+of widths, with pylostruct.demography.SteppingStone and with the nested
+loops the simulation scripts used before (the list comprehension of
+msp-sim.py and neutral-sim.py, and migrRates() of the background-introgression
+scripts), checking that they agree.  Writes a tab-separated table of times,
+in seconds, to stdout.
+'''
+
+import sys, os
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pylostruct.demography import SteppingStone
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("--widths", "-w", type=int, nargs="*", dest="widths", help="grid widths",
+        default=[3, 5, 10, 20, 30, 50])
+parser.add_argument("--max_old_width", "-x", type=int, dest="max_old_width",
+        help="largest width to time the old, quadratic, methods at", default=30)
+parser.add_argument("--migr", "-m", type=float, dest="migr", help="migration rate", default=0.01)
+parser.add_argument("--reps", "-r", type=int, dest="reps", help="number of times to repeat each", default=3)
+
+args = parser.parse_args()
+
+
+def old_msp(migr, width):
+    return [ [ migr if abs(i-k)+abs(j-l)==1 else 0.0 for i in range(width) for j in range(width) ] for k in range(width) for l in range(width) ]
+
+
+def old_migrRates(migr, m, n, barrier=False):
+    b = math.floor(m/2) - 1 # barrier is between rows b, b+1
+    npops = m*n
+    rows = [i for i in range(m) for j in range(n)]
+    cols = [j for i in range(m) for j in range(n)]
+    M = [[0.0 for u in range(npops)] for v in range(npops)]
+    for u in range(npops):
+        for v in range(npops):
+            if ((abs(rows[u] - rows[v]) == 0 and abs(cols[u] - cols[v]) == 1)
+                or (abs(rows[u] - rows[v]) == 1 and abs(cols[u] - cols[v]) == 0)):
+                if not barrier or not (((rows[u] == b) and (rows[v] == b+1)) or ((rows[u] == b+1) and (rows[v] == b))):
+                    M[u][v] = migr
+        M[u][u] = 1.0 - sum(M[u])
+    return M
+
+
+def best_time(f):
+    times, value = [], None
+    for _ in range(args.reps):
+        t0 = time.perf_counter()
+        value = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), value
+
+
+def max_diff(A, B):
+    return max(abs(a - b) for ra, rb in zip(A, B) for a, b in zip(ra, rb))
+
+
+print("\t".join(["width", "npops", "neighbors", "msprime_matrix", "simupop_barrier_matrix",
+                 "old_msprime_matrix", "old_simupop_barrier_matrix"]))
+for width in args.widths:
+    grid = SteppingStone(width, migr=args.migr, barrier=max(0, math.floor(width/2) - 1) if width > 1 else None)
+    t_nbrs, _ = best_time(lambda: grid.neighbors())
+    t_msp, msp = best_time(lambda: grid.migration_matrix())
+    t_spop, spop = best_time(lambda: grid.migration_matrix(barrier=True, diagonal=True))
+    t_old_msp = t_old_spop = float("nan")
+    if width <= args.max_old_width:
+        t_old_msp, old = best_time(lambda: old_msp(args.migr, width))
+        assert max_diff(old, msp) == 0
+        if width > 1:
+            t_old_spop, old = best_time(lambda: old_migrRates(args.migr, width, width, barrier=True))
+            assert max_diff(old, spop) < 1e-12
+    print("\t".join([str(width), str(width * width)] + ["{:.6f}".format(t) for t in
+                     (t_nbrs, t_msp, t_spop, t_old_msp, t_old_spop)]))
+    sys.stdout.flush()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+description = '''
+Benchmark msp-sim.py and neutral-sim.py over all combinations of the given
+chromosome lengths, population sizes, grid widths, sample sizes, and (for
+msp-sim.py) numbers of parallel jobs.  For each run this records the wall
+time, user and system CPU time, and peak memory (max RSS) of the whole run,
+and of each of its phases (simulate, dump, write, and genobin if used; summed
+over chromosomes for msp-sim.py), as reported by the scripts' --timing_file,
+and writes them all to a JSON file.
+
+If a baseline (a results file from an earlier run, e.g. before upgrading
+msprime or changing how output is written) is given, each run's median
+elapsed time and peak memory, overall and by phase, are compared to those of
+the run with the same parameters in the baseline, and any that are worse by
+more than the tolerance are listed as regressions (and the exit status is 1).
+'''
+
+import sys, os
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+import collections
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("--scripts", "-s", type=str, nargs="*", dest="scripts", choices=["msp-sim", "neutral-sim"],
+        default=["msp-sim", "neutral-sim"], help="scripts to benchmark")
+parser.add_argument("--length", "-L", type=float, nargs="*", dest="length", help="chromosome lengths", default=[1e5, 1e6])
+parser.add_argument("--popsize", "-N", type=float, nargs="*", dest="popsize", help="subpopulation sizes", default=[500, 1000])
+parser.add_argument("--width", "-w", type=int, nargs="*", dest="width", help="grid widths", default=[3, 10])
+parser.add_argument("--nsamples", "-k", type=int, nargs="*", dest="nsamples", help="total numbers of samples", default=[200])
+parser.add_argument("--njobs", "-j", type=int, nargs="*", dest="njobs", help="numbers of parallel jobs (msp-sim.py only)", default=[1])
+parser.add_argument("--nchroms", "-n", type=int, dest="nchroms", help="number of chromosomes for msp-sim.py", default=2)
+parser.add_argument("--migr", "-m", type=float, dest="migr", help="migration rate", default=1e-3)
+parser.add_argument("--recomb", "-r", type=float, dest="recomb", help="recombination rate", default=2.5e-8)
+parser.add_argument("--mut_rate", "-u", type=float, dest="mut_rate", help="mutation rate", default=1e-8)
+parser.add_argument("--vcf_format", "-F", type=str, dest="vcf_format", choices=["vcf", "vcf.gz", "bcf"], default="vcf",
+        help="format of msp-sim.py's genotype output [default: vcf]")
+parser.add_argument("--seed", "-d", type=int, dest="seed", help="random seed (the same for every run)", default=1)
+parser.add_argument("--reps", "-R", type=int, dest="reps", help="number of times to run each combination", default=1)
+parser.add_argument("--outdir", "-o", type=str, dest="outdir", help="directory to run in [default: benchmark_$date]")
+parser.add_argument("--results", type=str, dest="results", help="name of results file [default: outdir/results.json]")
+parser.add_argument("--baseline", "-b", type=str, dest="baseline", help="results file to compare to")
+parser.add_argument("--tolerance", "-x", type=float, dest="tolerance",
+        help="a regression is a time or memory more than (1 + tolerance) times the baseline", default=0.25)
+parser.add_argument("--min_seconds", type=float, dest="min_seconds",
+        help="ignore differences in time of less than this many seconds", default=1.0)
+parser.add_argument("--min_mb", type=float, dest="min_mb",
+        help="ignore differences in memory of less than this many MB", default=20.0)
+
+args = parser.parse_args()
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+scripts = {'msp-sim' : os.path.join(scriptdir, "msp-sim.py"),
+           'neutral-sim' : os.path.join(scriptdir, os.pardir, "neutral", "neutral-sim.py")}
+
+if args.outdir is None:
+    args.outdir = "benchmark_" + time.strftime("%Y%m%d_%H%M%S")
+if not os.path.exists(args.outdir):
+    os.makedirs(args.outdir)
+if args.results is None:
+    args.results = os.path.join(args.outdir, "results.json")
+
+
+def environment():
+    env = {'python' : platform.python_version(),
+           'platform' : platform.platform(),
+           'host' : platform.node(),
+           'cpus' : os.cpu_count(),
+           'date' : time.strftime("%Y-%m-%dT%H:%M:%S")}
+    try:
+        import msprime
+        env['msprime'] = msprime.__version__
+    except (ImportError, AttributeError):
+        env['msprime'] = None
+    try:
+        env['commit'] = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=scriptdir,
+                                                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        env['commit'] = None
+    return env
+
+
+def combinations():
+    for script in args.scripts:
+        njobs = args.njobs if script == "msp-sim" else [1]
+        for L, N, w, k, j in itertools.product(args.length, args.popsize, args.width, args.nsamples, njobs):
+            params = collections.OrderedDict([('length', L), ('popsize', N), ('width', w), ('nsamples', k)])
+            if script == "msp-sim":
+                params['njobs'] = j
+                params['nchroms'] = args.nchroms
+                params['vcf_format'] = args.vcf_format
+            params.update([('migr', args.migr), ('recomb', args.recomb), ('mut_rate', args.mut_rate)])
+            yield script, params
+
+
+def command(script, params, rundir, timing_file):
+    p = params
+    # neutral-sim.py takes an integer popsize
+    popsize = str(int(p['popsize'])) if script == "neutral-sim" else str(p['popsize'])
+    cmd = [sys.executable, scripts[script], "-k", str(p['nsamples']), "-N", popsize,
+           "-w", str(p['width']), "-L", str(p['length']), "-m", str(p['migr']), "-u", str(p['mut_rate']),
+           "-r", str(p['recomb']), "-R", str(p['recomb']), "-d", str(args.seed), "--timing_file", timing_file]
+    if script == "msp-sim":
+        cmd += ["-n", str(p['nchroms']), "-j", str(p['njobs']), "-o", rundir, "-F", p['vcf_format'], "--redo",
+                "--cost_history", os.path.join(rundir, "costs.tsv")]
+    else:
+        cmd += ["-t", os.path.join(rundir, "sim.trees"), "-o", os.path.join(rundir, "sim.vcf"),
+                "-g", os.path.join(rundir, "sim.log")]
+    return cmd
+
+
+def run(script, params, rundir):
+    '''
+    Run one benchmark, returning its totals and phases.
+    '''
+    timing_file = os.path.join(rundir, "timing.json")
+    cmd = command(script, params, rundir, timing_file)
+    with open(os.path.join(rundir, "run.log"), "w") as log:
+        t0 = time.time()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        # the resource use of this child alone (and its children)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = status
+        elapsed = time.time() - t0
+    if status != 0:
+        raise RuntimeError("Failed (see {}): {}".format(os.path.join(rundir, "run.log"), " ".join(cmd)))
+    scale = 2**20 if platform.system() == "Darwin" else 2**10
+    total = {'elapsed' : elapsed, 'user' : usage.ru_utime, 'system' : usage.ru_stime,
+             'max_rss_mb' : usage.ru_maxrss / scale}
+    with open(timing_file) as f:
+        timing = json.load(f)
+    if 'chromosomes' in timing:
+        # add up the phases over chromosomes, except for memory, which is the largest
+        phases = collections.OrderedDict()
+        for chrom in timing['chromosomes'].values():
+            for name, p in chrom['phases'].items():
+                q = phases.setdefault(name, {'elapsed' : 0.0, 'user' : 0.0, 'system' : 0.0, 'max_rss_mb' : 0.0})
+                for key in ('elapsed', 'user', 'system'):
+                    q[key] += p[key]
+                q['max_rss_mb'] = max(q['max_rss_mb'], p['max_rss_mb'])
+    else:
+        phases = timing['phases']
+    return {'command' : cmd, 'total' : total, 'phases' : phases}
+
+
+def median(x):
+    x = sorted(x)
+    n = len(x)
+    return x[n // 2] if n % 2 == 1 else (x[n // 2 - 1] + x[n // 2]) / 2
+
+
+def summarize(runs):
+    '''
+    For each (script, parameters), the median of each measure, as a dict
+    from (phase, measure) to value (with phase "total" for the whole run).
+    '''
+    values = collections.OrderedDict()
+    for r in runs:
+        key = (r['script'], json.dumps(r['params'], sort_keys=True))
+        measures = values.setdefault(key, collections.defaultdict(list))
+        for phase, p in [("total", r['total'])] + list(r['phases'].items()):
+            for measure in ('elapsed', 'max_rss_mb'):
+                measures[(phase, measure)].append(p[measure])
+    return collections.OrderedDict((key, {m : median(v) for m, v in measures.items()})
+                                   for key, measures in values.items())
+
+
+def compare(runs, baseline_runs):
+    '''
+    Returns a list of (script, params, phase, measure, baseline, new, regressed).
+    '''
+    new = summarize(runs)
+    old = summarize(baseline_runs)
+    out = []
+    for key, measures in new.items():
+        if key not in old:
+            continue
+        for (phase, measure), value in measures.items():
+            if (phase, measure) not in old[key]:
+                continue
+            base = old[key][(phase, measure)]
+            min_diff = args.min_seconds if measure == "elapsed" else args.min_mb
+            regressed = (value > base * (1 + args.tolerance)) and (value - base > min_diff)
+            out.append((key[0], key[1], phase, measure, base, value, regressed))
+    return out
+
+
+results = {'environment' : environment(), 'runs' : []}
+for n, (script, params) in enumerate(combinations()):
+    for rep in range(args.reps):
+        rundir = os.path.join(args.outdir, "{}_{:03d}_{}".format(script, n, rep))
+        if not os.path.exists(rundir):
+            os.makedirs(rundir)
+        r = run(script, params, rundir)
+        r.update([('script', script), ('params', params), ('rep', rep)])
+        results['runs'].append(r)
+        print("{} {} rep {}: {:.2f}s, {:.0f}MB ({})".format(
+            script, json.dumps(params), rep, r['total']['elapsed'], r['total']['max_rss_mb'],
+            ", ".join("{}: {:.2f}s".format(name, p['elapsed']) for name, p in r['phases'].items())))
+        sys.stdout.flush()
+        # save as we go, so that a partial sweep is not lost
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=1)
+            f.write("\n")
+
+if args.baseline is not None:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    comparison = compare(results['runs'], baseline['runs'])
+    results['baseline'] = {'file' : args.baseline, 'environment' : baseline.get('environment'),
+                           'regressions' : [c for c in comparison if c[-1]]}
+    with open(args.results, "w") as f:
+        json.dump(results, f, indent=1)
+        f.write("\n")
+    print("\t".join(["script", "params", "phase", "measure", "baseline", "new", "ratio", "regression"]))
+    for script, params, phase, measure, base, value, regressed in comparison:
+        print("\t".join([script, params, phase, measure, "{:.2f}".format(base), "{:.2f}".format(value),
+                         "{:.2f}".format(value / base) if base > 0 else "NA", "REGRESSION" if regressed else ""]))
+    nreg = len(results['baseline']['regressions'])
+    print("{} regressions (of {} comparisons) against {}.".format(nreg, len(comparison), args.baseline))
+    if nreg > 0:
+        sys.exit(1)
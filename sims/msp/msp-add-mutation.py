@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 description = '''
 Add mutations to an existing tree sequence file and write it out as VCF.
+
+With --mut_rates, mutations are added to each tree sequence at each of the
+rates, nreps times each with different seeds, writing a VCF for each with the
+rate (and replicate) in its name: e.g., sim00_u1e-08_r2.vcf.  Each rate and
+replicate is a separate job, and the jobs are handed to the workers in order
+of tree sequence, in chunks that keep those of a tree sequence together,
+so that each worker mostly reuses the tree sequence it already has loaded.
+
+With --stream, mutations are instead added tree by tree as the genotypes are
+written (see pylostruct/mutoverlay.py), so that memory use stays that of the
+tree sequence rather than about twice that of the mutated tree sequence;
+output files ending in .vcf.gz or .bcf are then written compressed and indexed.
+
+With --window_size and --window_type (as run_lostruct.R's -s and -t), the
+genotypes are also written split into those windows (see pylostruct/genobin.py),
+next to each VCF: e.g., sim00.snp1000.geno, with sim00.snp1000.windows, giving
+where each window's block of genotypes starts and ends, and
+sim00.snp1000.regions.csv; run_lostruct.R reads these instead of the VCF.
 '''
 
 import sys, os
-import gzip
 import glob
 import re
 import random
@@ -13,18 +30,37 @@ import multiprocessing
 
 import msprime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.telemetry import Telemetry
+from pylostruct.schedule import PhaseTimer, replicate_grid, grouped_chunksize
+from pylostruct.mutoverlay import write_overlay
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import genobin_files, window_files, windowed_prefix, vcf_stem, rate_vcf_name
+
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument("--tree_file", "-t", type=str, nargs="*", dest="tree_file", 
                     help="name of file to load tree sequences from [default: .trees files in basedir.")
 parser.add_argument("--mut_rate", "-u", type=float, nargs="*", dest="mut_rate", 
                     help="mutation rate", default=[1e-8])
 
+parser.add_argument("--mut_rates", "-U", type=float, nargs="*", dest="mut_rates",
+                    help="mutation rates to add mutations at, to every tree sequence (instead of --mut_rate)")
+parser.add_argument("--nreps", "-r", type=int, dest="nreps",
+                    help="number of replicates at each of --mut_rates, with different seeds", default=1)
+parser.add_argument("--stream", "-s", dest="stream", action="store_true",
+                    help="add mutations tree by tree while writing, with bounded memory (the mutations differ from msprime's for the same seed)")
+parser.add_argument("--window_size", "-W", type=int, dest="window_size",
+                    help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), for lostruct::genobin_windower()")
+parser.add_argument("--window_type", type=str, dest="window_type", choices=["snp", "bp"], default="snp",
+                    help="units of --window_size (as run_lostruct.R's -t) [default: snp]")
 parser.add_argument("--basedir", "-o", type=str, dest="basedir", 
                     help="name of directory to save output files to.")
 parser.add_argument("--vcffile", "-v", type=str, nargs="*", dest="vcffile", 
-                    help="name of VCF output files [default: as trees but with .vcf]")
+                    help="name of VCF output files [default: as trees but with .vcf; with --mut_rates, the rate and replicate are added before .vcf]")
 parser.add_argument("--logfile", "-g", type=str, dest="logfile", 
                     help="name of log file")
+parser.add_argument("--telemetry_file", type=str, dest="telemetry_file",
+                    help="file to write progress and timing events to, as JSON lines [default: basedir/add_muts.telemetry.jsonl]")
 parser.add_argument("--seed", "-d", dest="seed", type=int, 
                     help="random seed", default=random.randrange(1,1000))
 
@@ -48,6 +84,8 @@ if args.vcffile is None or len(args.vcffile) == 0:
 
 if args.logfile is None:
     args.logfile = os.path.join(args.basedir, "add_muts.log")
+if args.telemetry_file is None:
+    args.telemetry_file = os.path.join(args.basedir, "add_muts.telemetry.jsonl")
 
 vector_args = ['mut_rate']
 for a in vector_args:
@@ -61,36 +99,113 @@ for a in vector_args:
 
 assert len(args.vcffile) == len(args.tree_file)
 
+def window_prefix(vcffile):
+    if args.window_size is None:
+        return None
+    return windowed_prefix(vcf_stem(vcffile), args.window_size, args.window_type)
+
+# each task is (chromosome, mutation rate, replicate, seed, output file), in order
+# of chromosome, so that each worker mostly gets the tables it already has loaded
+if args.mut_rates is None:
+    random.seed(args.seed)
+    tasks = [(chrom, args.mut_rate[chrom], 0, random.randrange(1,1000), args.vcffile[chrom])
+             for chrom in range(args.nchroms)]
+else:
+    tasks = [(chrom, mut_rate, rep, seed,
+              rate_vcf_name(args.vcffile[chrom], mut_rate, rep if args.nreps > 1 else None))
+             for chrom, mut_rate, rep, seed in replicate_grid(args.nchroms, args.mut_rates, args.nreps, args.seed)]
+
 logfile = open(args.logfile, "w")
-seeds = [random.randrange(1,1000) for _ in range(len(args.tree_file))]
 
-def write_vcf(chrom):
+# what this worker last loaded: (chrom, tree sequence) with --stream, and otherwise
+# (chrom, (nodes, edgesets)), the tables of the tree sequence
+loaded = None
+
+def load(chrom, timer):
+    global loaded
+    if loaded is None or loaded[0] != chrom:
+        loaded = None
+        with timer.phase("load"):
+            ts = msprime.load(args.tree_file[chrom])
+            if args.stream:
+                loaded = (chrom, ts)
+            else:
+                nodes = msprime.NodeTable()
+                edgesets = msprime.EdgesetTable()
+                migrations = msprime.MigrationTable()
+                ts.dump_tables(nodes=nodes, edgesets=edgesets, migrations=migrations)
+                del ts
+                loaded = (chrom, (nodes, edgesets))
+    return loaded[1]
+
+def output_blocks(prefix):
+    return [] if prefix is None else list(genobin_files(prefix).values()) + window_files(prefix)
+
+def stream_vcf(chrom, mut_rate, seed, vcffile, timer):
+    ts = load(chrom, timer)
+    telemetry.log("Saving to " + vcffile + "\n", chrom=chrom)
+    prefix = window_prefix(vcffile)
+    with timer.phase("mutate_write") as phase:
+        nsites = write_overlay(ts, mut_rate, seed, vcffile, ploidy=1, genobin_prefix=prefix,
+                               window_size=args.window_size, window_type=args.window_type)
+        phase['bytes'] = sum(os.path.getsize(f) for f in [vcffile, vcffile + ".csi"] + output_blocks(prefix)
+                             if os.path.exists(f))
+    return nsites
+
+def tables_vcf(chrom, mut_rate, seed, vcffile, timer):
+    nodes, edgesets = load(chrom, timer)
+    vcf = open(vcffile, "w")
+    with timer.phase("mutate"):
+        rng = msprime.RandomGenerator(seed)
+        sites = msprime.SiteTable()
+        mutations = msprime.MutationTable()
+        mutgen = msprime.MutationGenerator(rng, mut_rate)
+        mutgen.generate(nodes, edgesets, sites, mutations)
+    telemetry.log("Saving to " + vcffile + "\n", chrom=chrom)
+    with timer.phase("write") as phase:
+        mutated_ts = msprime.load_tables(nodes=nodes, edgesets=edgesets, 
+                                         sites=sites, mutations=mutations)
+        mutated_ts.write_vcf(vcf, ploidy=1)
+        vcf.close()
+        phase['bytes'] = os.path.getsize(vcffile)
+    prefix = window_prefix(vcffile)
+    if prefix is not None:
+        with timer.phase("windows") as phase:
+            export_tree_sequence(mutated_ts, prefix, args.window_size, args.window_type, ploidy=1)
+            phase['bytes'] = sum(os.path.getsize(f) for f in output_blocks(prefix))
+    return mutated_ts.get_num_mutations()
+
+def write_vcf(task):
+    chrom, mut_rate, rep, seed, vcffile = task
     treefile = args.tree_file[chrom]
-    vcf = open(args.vcffile[chrom], "w")
-    mut_rate = args.mut_rate[chrom]
-    seed = seeds[chrom]
-    logfile.write("Simulating mutations on" + treefile + "\n")
-    ts = msprime.load(treefile)
-    rng = msprime.RandomGenerator(seed)
-    nodes = msprime.NodeTable()
-    edgesets = msprime.EdgesetTable()
-    sites = msprime.SiteTable()
-    mutations = msprime.MutationTable()
-    migrations = msprime.MigrationTable()
-    ts.dump_tables(nodes=nodes, edgesets=edgesets, migrations=migrations)
-    mutgen = msprime.MutationGenerator(rng, mut_rate)
-    mutgen.generate(nodes, edgesets, sites, mutations)
-    logfile.write("Saving to" + args.vcffile[chrom] + "\n")
-    mutated_ts = msprime.load_tables(nodes=nodes, edgesets=edgesets, 
-                                     sites=sites, mutations=mutations)
-    mutated_ts.write_vcf(vcf, ploidy=1)
+    timer = PhaseTimer(telemetry, chrom=chrom, tree_file=treefile, mut_rate=mut_rate, rep=rep)
+    telemetry.log("Simulating mutations on {} at rate {:g} (seed {})\n".format(treefile, mut_rate, seed), chrom=chrom)
+    if args.stream:
+        nmutations = stream_vcf(chrom, mut_rate, seed, vcffile, timer)
+    else:
+        nmutations = tables_vcf(chrom, mut_rate, seed, vcffile, timer)
+    telemetry.info(chrom=chrom, mut_rate=mut_rate, rep=rep, seed=seed, vcffile=vcffile, mutations=nmutations)
+    telemetry.log("Chromosome {} at rate {:g} timing (seconds): {}\n".format(chrom, mut_rate, timer.summary()),
+                  chrom=chrom)
 
     return True
 
-logfile.write("Beginning simulating mutations on " + str(len(args.tree_file)) + " chromosomes.\n")
+logfile.write("Beginning simulating mutations on " + str(len(args.tree_file)) + " chromosomes"
+              + ("" if args.mut_rates is None else ", at {} rates, {} times each".format(len(args.mut_rates), args.nreps))
+              + ".\n")
+
+# the workers send log messages and timings to the telemetry writer, which is
+# the only process to write to the log until it is closed
+telemetry = Telemetry(args.telemetry_file, log=logfile,
+                      summary_path=re.sub("[.]jsonl$", "", args.telemetry_file) + ".summary.tsv")
 
 p = multiprocessing.Pool(args.njobs)
-p.map(write_vcf, range(len(args.vcffile)))
+for _ in p.imap(write_vcf, tasks, chunksize=grouped_chunksize(len(tasks), args.nchroms, args.njobs)):
+    pass
+p.close()
+p.join()
+
+telemetry.close()
 
 logfile.write("Done!\n")
 logfile.close()
@@ -12,32 +12,30 @@ Samples will all be in the same configuration and order, with the same number
 of samples from each subpopulation.
 '''
 
-import gzip
 import sys, os
+import re
 import math
 import time
 import random
+import json
 import argparse
 import multiprocessing
+import multiprocessing.pool
 
+import numpy as np
 import msprime
 
-def fileopt(fname,opts):
-    '''Return the file referred to by fname, open with options opts;
-    if fname is "-" return stdin/stdout; if fname ends with .gz run it through gzip.
-    '''
-    if fname == "-":
-        if opts == "r":
-            fobj = sys.stdin
-        elif opts == "w":
-            fobj = sys.stdout
-        else:
-            print("Something not right here.")
-    elif fname[len(fname)-3:len(fname)]==".gz":
-        fobj = gzip.open(fname,opts)
-    else:
-        fobj = open(fname,opts)
-    return fobj
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.vcfwriter import write_tree_sequence
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import genobin_files, window_files, windowed_prefix
+from pylostruct.demography import SteppingStone
+from pylostruct.subsample import nested_samples, subsample_path
+from pylostruct.recombmap import load_map, recombination_map
+from pylostruct.manifest import Manifest, file_checksum
+from pylostruct.telemetry import Telemetry
+from pylostruct.schedule import PhaseTimer, CostModel, read_history, append_history, largest_first, run_admitted, peak_rss_mb
 
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument("--nchroms", "-n", type=int, dest="nchroms", help="number of chromosomes")
@@ -55,9 +53,31 @@ parser.add_argument("--basedir", "-o", type=str, dest="basedir", help="name of d
 parser.add_argument("--tree_file", "-t", type=str, dest="tree_file", help="name of file to save tree sequence to.")
 parser.add_argument("--samples_file", "-S", type=str, dest="samples_file", help="name of file to save sample information to.")
 parser.add_argument("--vcffile", "-v", type=str, dest="vcffile", help="name of VCF output file.")
+parser.add_argument("--vcf_format", "-F", type=str, dest="vcf_format", choices=["vcf", "vcf.gz", "bcf"], default="vcf",
+        help="format of the genotype output: vcf (text), or vcf.gz or bcf, written with a .csi index as the simulation is saved [default: vcf]")
+parser.add_argument("--window_size", "--genobin_window", "-W", type=int, dest="genobin_window",
+        help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), in a binary genotype store (see pylostruct/genobin.py) with tables of the windows, to be read with lostruct::genobin_windower()")
+parser.add_argument("--window_type", "--genobin_window_type", type=str, dest="genobin_window_type", choices=["snp", "bp"], default="snp",
+        help="units of --window_size (as run_lostruct.R's -t) [default: snp]")
+parser.add_argument("--genobin_file", type=str, dest="genobin_file", help="prefix of the binary genotype store. [default: basedir/sim%%02d.TYPESIZE, e.g. sim%%02d.snp1000]")
+parser.add_argument("--subsample_sizes", "-K", type=int, nargs="*", dest="subsample_sizes",
+        help="also write the samples file and genotypes (and binary genotype store) for nested subsets of the samples of these sizes, "
+             "each made by simplifying the simulated tree sequence, with _k(size) added to the names of the outputs")
+parser.add_argument("--subsample_jobs", type=int, dest="subsample_jobs",
+        help="number of subsets to simplify and write at once, in threads [default: all]")
 parser.add_argument("--logfile", "-g", type=str, dest="logfile", help="name of log file")
 parser.add_argument("--seed", "-d", dest="seed", type=int, help="random seed", default=random.randrange(1,1000))
 parser.add_argument("--njobs", "-j", dest="njobs", type=int, help="number of parallel jobs", default=1)
+parser.add_argument("--memory_budget", "-M", dest="memory_budget", type=float,
+        help="total memory (in GB) that the parallel jobs may use: a chromosome is only started if its predicted peak memory fits alongside those running")
+parser.add_argument("--timing_file", type=str, dest="timing_file",
+        help="file to write the time and memory used by each phase (simulate, dump, write, genobin) of each chromosome to, as JSON")
+parser.add_argument("--telemetry_file", type=str, dest="telemetry_file",
+        help="file to write progress and timing events to, as JSON lines, with a summary table in the same name with .summary.tsv [default: basedir/telemetry.jsonl]")
+parser.add_argument("--redo", dest="redo", action="store_true",
+        help="simulate every chromosome, even those recorded as complete in basedir/manifest.json")
+parser.add_argument("--cost_history", type=str, dest="cost_history",
+        help="file of observed time and memory use per chromosome, used to schedule the largest chromosomes first, and added to after this run [default: msp_sim_costs.tsv, next to basedir]")
 
 args = parser.parse_args()
 
@@ -71,6 +91,11 @@ if args.nsamples is None or args.nchroms is None or args.popsize is None or args
     print(description)
     raise ValueError("Must specify more arguments (run with -h for help).")
 
+if args.subsample_sizes is None:
+    args.subsample_sizes = []
+if any(k >= args.nsamples for k in args.subsample_sizes):
+    raise ValueError("Subsample sizes must be less than nsamples.")
+
 argdict = vars(args)
 
 vector_args = ['popsize', 'migr', 'min_recomb', 'max_recomb', 'mut_rate']
@@ -82,7 +107,7 @@ for a in vector_args:
         if x is None or (len(x) != args.nchroms):
             raise ValueError(", ".join(vector_args) + "must all be of length 1 or of length nchroms.")
 
-for a in ["tree_file", "logfile", "vcffile"]:
+for a in ["tree_file", "logfile", "vcffile", "genobin_file"]:
     x = argdict[a]
     if x is not None:
         if "%" not in x:
@@ -95,11 +120,22 @@ if args.logfile is None:
 if args.tree_file is None:
     args.tree_file = os.path.join(args.basedir, "sim%02d.trees")
 if args.vcffile is None:
-    args.vcffile = os.path.join(args.basedir, "sim%02d.vcf")
+    args.vcffile = os.path.join(args.basedir, "sim%02d." + args.vcf_format)
 if args.samples_file is None:
     args.samples_file = os.path.join(args.basedir, "samples%02d.tsv")
+if args.genobin_file is None:
+    args.genobin_file = os.path.join(args.basedir, windowed_prefix("sim%02d", args.genobin_window, args.genobin_window_type))
+if args.telemetry_file is None:
+    args.telemetry_file = os.path.join(args.basedir, "telemetry.jsonl")
+if args.cost_history is None:
+    args.cost_history = os.path.join(os.path.dirname(os.path.abspath(args.basedir)), "msp_sim_costs.tsv")
 
-logfile = fileopt(args.logfile, "w")
+# chromosomes already simulated into basedir (with the same parameters) are
+# recorded here, and are skipped unless their output has since changed
+manifest_file = os.path.join(args.basedir, "manifest.json")
+resuming = os.path.exists(manifest_file) and not args.redo
+
+logfile = fileopt(args.logfile, "a" if resuming else "w")
 
 logfile.write("Options:\n")
 logfile.write(str(args)+"\n")
@@ -108,11 +144,112 @@ logfile.flush()
 random.seed(args.seed)
 seeds = [random.randrange(1,1000) for _ in range(args.nchroms)]
 
+if args.mapfile is not None:
+    # parse the map here, so that worker processes inherit it
+    load_map(args.mapfile)
+
+# per-chromosome cost: the features each chromosome is described by in the
+# cost history, and a rough prior for the time taken, proportional to the
+# expected number of trees (scaled up when migration is slow)
+cost_features = ['length', 'popsize', 'width', 'nsamples', 'recomb', 'isolation']
+
+def chrom_features(chrom_num):
+    chrom_index = chrom_num - args.chrom_start
+    popsize = float(args.popsize[chrom_index])
+    migr = float(args.migr[chrom_index])
+    if args.mapfile is not None:
+        rmap = load_map(args.mapfile)
+        recomb = np.sum(np.diff(rmap.positions) * rmap.rates[:-1]) / (rmap.positions[-1] - rmap.positions[0])
+    else:
+        recomb = (float(args.min_recomb[chrom_index]) + float(args.max_recomb[chrom_index])) / 2
+    return {'chrom' : chrom_num,
+            'seed' : seeds[chrom_index],
+            'length' : float(args.length),
+            'popsize' : popsize,
+            'width' : int(args.width),
+            'nsamples' : int(args.nsamples),
+            'recomb' : recomb,
+            'isolation' : 1.0 + (1.0 / (4 * popsize * migr) if args.width > 1 and migr > 0 else 0.0),
+            'mut_rate' : float(args.mut_rate[chrom_index])}
+
+mapfile_checksum = None if args.mapfile is None else file_checksum(args.mapfile)['sha256']
+
+def chrom_params(chrom_num):
+    params = chrom_features(chrom_num)
+    params.update({'vcf_format' : args.vcf_format,
+                   'genobin_window' : args.genobin_window,
+                   'genobin_window_type' : args.genobin_window_type,
+                   'subsample_sizes' : args.subsample_sizes,
+                   'mapfile' : mapfile_checksum})
+    return params
+
+def genotype_outputs(vcf_path, genobin_prefix):
+    outputs = [vcf_path]
+    if args.vcf_format != "vcf":
+        outputs.append(vcf_path + ".csi")
+    if args.genobin_window is not None:
+        outputs += list(genobin_files(genobin_prefix).values()) + window_files(genobin_prefix)
+    return outputs
+
+def chrom_outputs(chrom_num):
+    outputs = [args.samples_file % chrom_num, args.tree_file % chrom_num]
+    outputs += genotype_outputs(args.vcffile % chrom_num, args.genobin_file % chrom_num)
+    for k in args.subsample_sizes:
+        outputs.append(subsample_path(args.samples_file % chrom_num, k))
+        outputs += genotype_outputs(subsample_path(args.vcffile % chrom_num, k),
+                                    subsample_path(args.genobin_file % chrom_num, k))
+    return outputs
+
+def write_genotypes(tree_sequence, vcf_path, genobin_prefix, timer):
+    # writes VCF, or vcf.gz or bcf and the index, and the binary genotype store if asked for,
+    # as the phases "write" and "genobin" of timer; returns the names of the files written
+    outputs = genotype_outputs(vcf_path, genobin_prefix)
+    with timer.phase("write") as phase:
+        if args.vcf_format == "vcf":
+            vcffile = fileopt(vcf_path, "w")
+            tree_sequence.write_vcf(vcffile, ploidy=1)
+            vcffile.close()
+        else:
+            write_tree_sequence(tree_sequence, vcf_path, ploidy=1)
+        phase['bytes'] = sum(os.path.getsize(f) for f in outputs if f.startswith(vcf_path))
+    if args.genobin_window is not None:
+        with timer.phase("genobin") as phase:
+            export_tree_sequence(tree_sequence, genobin_prefix, args.genobin_window, args.genobin_window_type, ploidy=1)
+            phase['bytes'] = sum(os.path.getsize(f) for f in outputs if not f.startswith(vcf_path))
+    return outputs
+
+def write_subsample(tree_sequence, chrom_num, k, samples):
+    # the samples file and genotypes of the tree sequence simplified to the given samples
+    sub_ts = tree_sequence.simplify(samples)
+    samples_path = subsample_path(args.samples_file % chrom_num, k)
+    with fileopt(samples_path, "w") as samples_file:
+        sub_ts.dump_samples_text(samples_file)
+    # (timed as part of the "subsample" phase, not on their own)
+    outputs = write_genotypes(sub_ts, subsample_path(args.vcffile % chrom_num, k),
+                              subsample_path(args.genobin_file % chrom_num, k), PhaseTimer())
+    return {'chrom' : chrom_num, 'nsamples' : k, 'trees' : sub_ts.get_num_trees(),
+            'mutations' : sub_ts.get_num_mutations(),
+            'bytes' : sum(os.path.getsize(f) for f in [samples_path] + outputs)}
+
+def prior_seconds(f):
+    return (1e-5 * 4 * f['popsize'] * f['width']**2 * f['recomb'] * f['length']
+            * math.log(max(2, f['nsamples'])) * f['isolation'])
+
+def prior_rss_mb(f):
+    # fit to the run-tests.sh measurements in msp-notes.md (nsamples=2000, width=10,
+    # migr=1e-3, recomb=2.5e-8): peak memory is about 53MB plus 4.7e-3MB per unit of
+    # 4 * N * width^2 * recomb * length, which we scale with log(nsamples) and isolation
+    rho = 4 * f['popsize'] * f['width']**2 * f['recomb'] * f['length']
+    return 53 + 4.7e-3 * rho * (math.log(max(2, f['nsamples'])) / math.log(2000)) * (f['isolation'] / 1.25)
+
+nsimulated = 0
+
 def sim_chrom(chrom_num):
+    global nsimulated
+    start_time = time.time()
     chrom_index = chrom_num - args.chrom_start
 
     random.seed(seeds[chrom_index])
-    vcffile = fileopt(args.vcffile % chrom_num, "w")
     samples_file = fileopt(args.samples_file % chrom_num, "w")
     tree_file = args.tree_file % chrom_num
 
@@ -124,17 +261,8 @@ def sim_chrom(chrom_num):
     mut_rate = float(args.mut_rate[chrom_index])
     if args.mapfile is not None:
         use_map = True
-        mapfile = fileopt(args.mapfile, "r")
-        positions=[]
-        rates=[]
-        mapfile.readline()
-        for line in mapfile:
-            pos, rate, = map(float, line.split()[1:3])
-            positions.append(pos)
-            # Rate is expressed in centimorgans per megabase, which
-            # we convert to per-base rates
-            rates.append(rate * 1e-8)
-        recomb_map = msprime.RecombinationMap(positions,rates)
+        # parsed once, by the parent process (see below)
+        recomb_map = recombination_map(args.mapfile)
     else:
         min_recomb = float(args.min_recomb[chrom_index])
         max_recomb = float(args.max_recomb[chrom_index])
@@ -145,19 +273,16 @@ def sim_chrom(chrom_num):
                 positions=[ k*length/n_recomb_steps for k in range(n_recomb_steps+1) ],
                 rates=[ max_recomb - (max_recomb-min_recomb)*k/n_recomb_steps for k in range(n_recomb_steps+1) ])
 
-    logfile.write(time.strftime('%X %x %Z')+"\n")
-    logfile.write("Beginning simulation:\n")
-    logfile.flush()
+    telemetry.log("{}\nBeginning simulation of chromosome {}:\n".format(time.strftime('%X %x %Z'), chrom_num),
+                  chrom=chrom_num)
 
     # population setup
     per_samples = math.ceil(nsamples/width/width)
     pop_config = [ msprime.PopulationConfiguration(sample_size=per_samples) for i in range(width) for j in range(width) ]
-    mig_mat = [ [ migr if abs(i-k)+abs(j-l)==1 else 0.0 for i in range(width) for j in range(width) ] for k in range(width) for l in range(width) ]
+    mig_mat = SteppingStone(width, migr=migr).migration_matrix()
 
-    logfile.write("Sample configuration:\n")
-    logfile.write(str([x.sample_size for x in pop_config])+"\n")
-    # logfile.write("Migration matrix:\n")
-    # logfile.write(str(mig_mat)+"\n")
+    telemetry.log("Chromosome {} sample configuration:\n{}\n".format(chrom_num, [x.sample_size for x in pop_config]),
+                  chrom=chrom_num)
 
     msp_args = {'Ne' : popsize, 'mutation_rate' : mut_rate, 'length' : length}
     if width == 1:
@@ -170,32 +295,126 @@ def sim_chrom(chrom_num):
     else:
         msp_args['recombination_rate'] = max_recomb
 
-    tree_sequence = msprime.simulate(**msp_args)
-
-    logfile.write("Done!\n")
-    logfile.write(time.strftime('%X %x %Z')+"\n")
-    logfile.write("Mean pairwise diversity: {}\n".format(tree_sequence.get_pairwise_diversity()/length))
-    logfile.write("Number of trees: {}\n".format(tree_sequence.get_num_trees()))
-    logfile.write("Number of mutations: {}\n".format(tree_sequence.get_num_mutations()))
-    logfile.flush()
-
-    tree_sequence.dump_samples_text(samples_file)
+    timer = PhaseTimer(telemetry, chrom=chrom_num)
+    with timer.phase("simulate"):
+        tree_sequence = msprime.simulate(**msp_args)
+
+    diversity = tree_sequence.get_pairwise_diversity()/length
+    ntrees = tree_sequence.get_num_trees()
+    nmutations = tree_sequence.get_num_mutations()
+    telemetry.info(chrom=chrom_num, diversity=diversity, trees=ntrees, mutations=nmutations)
+    telemetry.log("Done with chromosome {}!\n{}\n".format(chrom_num, time.strftime('%X %x %Z'))
+                  + "Mean pairwise diversity: {}\n".format(diversity)
+                  + "Number of trees: {}\n".format(ntrees)
+                  + "Number of mutations: {}\n".format(nmutations), chrom=chrom_num)
+
+    with timer.phase("dump") as phase:
+        tree_sequence.dump_samples_text(samples_file)
+        samples_file.close()
+        tree_sequence.dump(tree_file)
+        phase['bytes'] = os.path.getsize(args.samples_file % chrom_num) + os.path.getsize(tree_file)
+
+    write_genotypes(tree_sequence, args.vcffile % chrom_num, args.genobin_file % chrom_num, timer)
+
+    if len(args.subsample_sizes) > 0:
+        # samples are numbered by population, per_samples from each (or all in one)
+        populations = np.repeat(np.arange(len(pop_config)), per_samples) if width > 1 else np.zeros(nsamples)
+        subsets = nested_samples(populations, args.subsample_sizes)
+        # simplifying and writing each subset is independent of the others, and
+        # much of the time is spent in msprime and in writing the files
+        with timer.phase("subsample") as phase:
+            pool = multiprocessing.pool.ThreadPool(args.subsample_jobs or len(subsets))
+            subs = pool.starmap(write_subsample, [(tree_sequence, chrom_num, k, samples)
+                                                  for k, samples in zip(args.subsample_sizes, subsets)])
+            pool.close()
+            pool.join()
+            phase['bytes'] = sum(sub['bytes'] for sub in subs)
+        for sub in subs:
+            telemetry.info(**sub)
+            telemetry.log("Chromosome {} subset of {} samples: {} trees, {} mutations\n".format(
+                chrom_num, sub['nsamples'], sub['trees'], sub['mutations']), chrom=chrom_num)
+
+    telemetry.log("Chromosome {} timing (seconds): {}\n".format(chrom_num, timer.summary()), chrom=chrom_num)
+
+    result = chrom_features(chrom_num)
+    result['seconds'] = time.time() - start_time
+    # each worker runs one chromosome (maxtasksperchild=1), so its peak is this chromosome's;
+    # running serially the peak would include earlier chromosomes, so is only recorded for the first
+    result['peak_rss_mb'] = peak_rss_mb() if args.njobs > 1 or nsimulated == 0 else ''
+    nsimulated += 1
+    result['phases'] = timer.phases
+    result['outputs'] = {path : file_checksum(path) for path in chrom_outputs(chrom_num)}
+    return result
+
+manifest = Manifest(manifest_file)
+chroms = {}
+for j in range(args.chrom_start, args.chrom_start+args.nchroms):
+    status = "redo" if args.redo else manifest.status(j, chrom_params(j))
+    if status == "complete":
+        logfile.write("Chromosome {} is complete, skipping.\n".format(j))
+    else:
+        if status != "missing":
+            logfile.write("Chromosome {}: {}, simulating again.\n".format(j, status))
+        chroms[j] = chrom_features(j)
+logfile.flush()
 
-    tree_sequence.dump(tree_file)
+timings = {}
 
-    tree_sequence.write_vcf(vcffile, ploidy=1)
+def finish(result):
+    # called by the parent process, as each chromosome is done
+    manifest.record(result['chrom'], chrom_params(result['chrom']), result['outputs'])
+    timings[str(result['chrom'])] = {'seconds' : result['seconds'], 'phases' : result['phases']}
+    append_history(args.cost_history, [result],
+                   ['chrom', 'seed'] + cost_features + ['mut_rate', 'seconds', 'peak_rss_mb'])
 
-    samples_file.close()
-    vcffile.close()
+cost_history = read_history(args.cost_history)
+time_model = CostModel(cost_features, prior_seconds, 'seconds', cost_history)
+rss_model = CostModel(cost_features, prior_rss_mb, 'peak_rss_mb', cost_history)
 
-    return True
+if args.njobs > 1:
+    # submit the slowest chromosomes first, one at a time, so that none is left queued
+    # behind others when the rest of the workers are done
+    order = largest_first(chroms, time_model.predict)
+    logfile.write("Predicted time per chromosome (seconds, from {} past observations): {}\n".format(
+        time_model.nobs, ", ".join("{}: {:.1f}".format(j, time_model.predict(chroms[j])) for j in order)))
+    if args.memory_budget is not None:
+        # only start a chromosome when its predicted peak memory fits in the budget
+        budget = 1024 * args.memory_budget
+        logfile.write("Predicted peak memory per chromosome (MB, from {} past observations): {}\n".format(
+            rss_model.nobs, ", ".join("{}: {:.0f}".format(j, rss_model.predict(chroms[j])) for j in order)))
+        for j in order:
+            if rss_model.predict(chroms[j]) > budget:
+                logfile.write("Warning: chromosome {} is predicted to need more than the memory budget, "
+                              "and will be run alone.\n".format(j))
+
+# from here until telemetry is closed, the log is written only by the telemetry writer,
+# which gets messages from the workers (started after it, so they can send them)
+telemetry = Telemetry(args.telemetry_file, log=logfile, mode="a" if resuming else "w",
+                      summary_path=re.sub("[.]jsonl$", "", args.telemetry_file) + ".summary.tsv")
 
 if args.njobs > 1:
-    p = multiprocessing.Pool(args.njobs)
-    p.map(sim_chrom, range(args.chrom_start, args.chrom_start+args.nchroms))
+    p = multiprocessing.Pool(args.njobs, maxtasksperchild=1)
+    if args.memory_budget is None:
+        for result in p.imap_unordered(sim_chrom, order, chunksize=1):
+            finish(result)
+    else:
+        for result in run_admitted(p, sim_chrom, order, lambda j: rss_model.predict(chroms[j]),
+                                   budget, args.njobs):
+            finish(result)
+    p.close()
+    p.join()
 else:
-    for j in range(args.chrom_start, args.chrom_start+args.nchroms):
-        sim_chrom(j)
+    for j in sorted(chroms):
+        finish(sim_chrom(j))
+
+telemetry.close()
+
+if args.timing_file is not None:
+    with open(args.timing_file, "w") as f:
+        json.dump({'chromosomes' : timings}, f, indent=1)
+        f.write("\n")
+
+logfile.write("Observed time and peak memory of {} chromosomes added to {}\n".format(len(chroms), args.cost_history))
 
 logfile.close()
 
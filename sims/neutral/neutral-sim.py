@@ -3,31 +3,26 @@ description = '''
 Simulate.
 '''
 
-import gzip
 import sys, os
 import math
 import time
+import json
 import random
 import argparse
+import multiprocessing.pool
+
+import numpy as np
 
 import msprime
 
-def fileopt(fname,opts):
-    '''Return the file referred to by fname, open with options opts;
-    if fname is "-" return stdin/stdout; if fname ends with .gz run it through gzip.
-    '''
-    if fname == "-":
-        if opts == "r":
-            fobj = sys.stdin
-        elif opts == "w":
-            fobj = sys.stdout
-        else:
-            print("Something not right here.")
-    elif fname[len(fname)-3:len(fname)]==".gz":
-        fobj = gzip.open(fname,opts)
-    else:
-        fobj = open(fname,opts)
-    return fobj
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from pylostruct.fileio import fileopt
+from pylostruct.tsexport import export_tree_sequence
+from pylostruct.genobin import windowed_prefix
+from pylostruct.demography import SteppingStone
+from pylostruct.subsample import nested_samples, subsample_path
+from pylostruct.schedule import PhaseTimer
+from pylostruct.recombmap import recombination_map
 
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument("--nsamples", "-k", type=int, dest="nsamples", help="number of samples, total")
@@ -42,7 +37,17 @@ parser.add_argument("--mut_rate", "-u", type=float, dest="mut_rate", help="mutat
 parser.add_argument("--tree_file", "-t", type=str, dest="tree_file", help="name of file to save tree sequence to.")
 parser.add_argument("--samples_file", "-S", type=str, dest="samples_file", help="name of file to save sample information to.")
 parser.add_argument("--outfile", "-o", type=str, dest="outfile", help="name of output file (or '-' for stdout).")
+parser.add_argument("--window_size", "--genobin_window", "-W", type=int, dest="genobin_window",
+        help="also write the genotypes split into windows of this size (as run_lostruct.R's -s), in a binary genotype store (see pylostruct/genobin.py) with tables of the windows, to be read with lostruct::genobin_windower()")
+parser.add_argument("--window_type", "--genobin_window_type", type=str, dest="genobin_window_type", choices=["snp", "bp"], default="snp",
+        help="units of --window_size (as run_lostruct.R's -t) [default: snp]")
+parser.add_argument("--genobin_file", type=str, dest="genobin_file", help="prefix of the binary genotype store. [default: sim.TYPESIZE (e.g. sim.snp1000), in the directory of tree_file]")
+parser.add_argument("--subsample_sizes", "-K", type=int, nargs="*", dest="subsample_sizes",
+        help="also write the samples file and VCF (and binary genotype store) for nested subsets of the samples of these sizes, "
+             "each made by simplifying the simulated tree sequence, with _k(size) added to the names of the outputs")
 parser.add_argument("--logfile", "-g", type=str, dest="logfile", help="name of log file (or '-' for stdout)", default="-")
+parser.add_argument("--timing_file", type=str, dest="timing_file",
+        help="file to write the time and memory used by each phase (simulate, dump, write, genobin) to, as JSON")
 parser.add_argument("--seed", "-d", dest="seed", type=int,
         help="random seed", default=random.randrange(1,1000))
 
@@ -51,13 +56,24 @@ args = parser.parse_args()
 if args.tree_file is None:
     print(description)
     raise(ValueError("Must specify output tree file."))
+if args.nsamples is None:
+    print(description)
+    raise(ValueError("Must specify number of samples."))
 
 if args.outfile is None:
     args.outfile = os.path.join(os.path.dirname(args.tree_file),"sim.vcf")
+if args.subsample_sizes is None:
+    args.subsample_sizes = []
+if len(args.subsample_sizes) > 0 and (args.outfile == "-" or args.samples_file == "-"):
+    raise ValueError("Subsets of samples need named output and samples files.")
+if any(k >= args.nsamples for k in args.subsample_sizes):
+    raise ValueError("Subsample sizes must be less than nsamples.")
 if args.logfile is None:
     args.logfile = os.path.join(os.path.dirname(args.tree_file),"sim.log")
 if args.samples_file is None:
     args.samples_file = os.path.join(os.path.dirname(args.tree_file),"samples.tsv")
+if args.genobin_file is None:
+    args.genobin_file = os.path.join(os.path.dirname(args.tree_file), windowed_prefix("sim", args.genobin_window, args.genobin_window_type))
 
 logfile = fileopt(args.logfile, "w")
 
@@ -67,7 +83,6 @@ logfile.write(str(args)+"\n")
 outfile = fileopt(args.outfile, "w")
 samples_file = fileopt(args.samples_file, "w")
 
-sim.setRNG(seed=args.seed)
 random.seed(args.seed)
 
 popsize = float(args.popsize)
@@ -78,17 +93,7 @@ migr = float(args.migr)
 mut_rate = float(args.mut_rate)
 if args.mapfile is not None:
     use_map = True
-    mapfile = fileopt(args.mapfile, "r")
-    positions=[]
-    rates=[]
-    mapfile.readline()
-    for line in mapfile:
-        pos, rate, = map(float, line.split()[1:3])
-        positions.append(pos)
-        # Rate is expressed in centimorgans per megabase, which
-        # we convert to per-base rates
-        rates.append(rate * 1e-8)
-    recomb_map = msprime.RecombinationMap(positions,rates)
+    recomb_map = recombination_map(args.mapfile)
 else:
     min_recomb = float(args.min_recomb)
     max_recomb = float(args.max_recomb)
@@ -106,44 +111,50 @@ logfile.flush()
 # population setup
 per_samples = math.ceil(nsamples/width/width)
 pop_config = [ msprime.PopulationConfiguration(sample_size=per_samples) for i in range(width) for j in range(width) ]
-mig_mat = [ [ migr if abs(i-k)+abs(j-l)==1 else 0.0 for i in range(width) for j in range(width) ] for k in range(width) for l in range(width) ]
+mig_mat = SteppingStone(width, migr=migr).migration_matrix()
 
 logfile.write("Sample configuration:\n")
 logfile.write(str([x.sample_size for x in pop_config])+"\n")
 # logfile.write("Migration matrix:\n")
 # logfile.write(str(mig_mat)+"\n")
 
-if width==1:
-    if not use_map:
-        tree_sequence = msprime.simulate(
-                sample_size=nsamples, 
-                Ne=popsize,
-                length=length, 
-                recombination_rate=max_recomb,
-                mutation_rate=mut_rate)
-    else:
-        tree_sequence = msprime.simulate(
-                sample_size=nsamples, 
-                Ne=popsize,
-                recombination_map=recomb_map,
-                mutation_rate=mut_rate)
+timer = PhaseTimer()
+with timer.phase("simulate"):
+    if width==1:
+        if not use_map:
+            tree_sequence = msprime.simulate(
+                    sample_size=nsamples, 
+                    Ne=popsize,
+                    length=length, 
+                    recombination_rate=max_recomb,
+                    mutation_rate=mut_rate,
+                    random_seed=args.seed)
+        else:
+            tree_sequence = msprime.simulate(
+                    sample_size=nsamples, 
+                    Ne=popsize,
+                    recombination_map=recomb_map,
+                    mutation_rate=mut_rate,
+                    random_seed=args.seed)
 
-else:
-    if not use_map:
-        tree_sequence = msprime.simulate(
-                population_configurations=pop_config,
-                migration_matrix=mig_mat,
-                Ne=popsize,
-                length=length,
-                recombination_rate=max_recomb,
-                mutation_rate=mut_rate)
     else:
-        tree_sequence = msprime.simulate(
-                population_configurations=pop_config,
-                migration_matrix=mig_mat,
-                Ne=popsize,
-                recombination_map=recomb_map,
-                mutation_rate=mut_rate)
+        if not use_map:
+            tree_sequence = msprime.simulate(
+                    population_configurations=pop_config,
+                    migration_matrix=mig_mat,
+                    Ne=popsize,
+                    length=length,
+                    recombination_rate=max_recomb,
+                    mutation_rate=mut_rate,
+                    random_seed=args.seed)
+        else:
+            tree_sequence = msprime.simulate(
+                    population_configurations=pop_config,
+                    migration_matrix=mig_mat,
+                    Ne=popsize,
+                    recombination_map=recomb_map,
+                    mutation_rate=mut_rate,
+                    random_seed=args.seed)
 
 logfile.write("Done!\n")
 logfile.write(time.strftime('%X %x %Z')+"\n")
@@ -152,14 +163,51 @@ logfile.write("Number of trees: {}\n".format(tree_sequence.get_num_trees()))
 logfile.write("Number of mutations: {}\n".format(tree_sequence.get_num_mutations()))
 logfile.flush()
 
-tree_sequence.dump_samples_text(samples_file)
-
-if args.tree_file is not None:
-    tree_sequence.dump(args.tree_file)
-
-tree_sequence.write_vcf(outfile, ploidy=1)
-logfile.close()
+with timer.phase("dump"):
+    tree_sequence.dump_samples_text(samples_file)
+    if args.tree_file is not None:
+        tree_sequence.dump(args.tree_file)
+    samples_file.close()
+
+def write_genotypes(ts, vcffile, genobin_prefix, timer):
+    # writes the VCF to the open file vcffile (closing it), and the binary genotype store
+    # if asked for, as the phases "write" and "genobin" of timer
+    with timer.phase("write"):
+        ts.write_vcf(vcffile, ploidy=1)
+        vcffile.close()
+    if args.genobin_window is not None:
+        with timer.phase("genobin"):
+            export_tree_sequence(ts, genobin_prefix, args.genobin_window, args.genobin_window_type, ploidy=1)
+
+write_genotypes(tree_sequence, outfile, args.genobin_file, timer)
+
+def write_subsample(k, samples):
+    # the samples file, VCF, and binary genotype store of the tree sequence simplified to the given samples
+    sub_ts = tree_sequence.simplify(samples)
+    with fileopt(subsample_path(args.samples_file, k), "w") as f:
+        sub_ts.dump_samples_text(f)
+    # (timed as part of the "subsample" phase, not on their own)
+    write_genotypes(sub_ts, fileopt(subsample_path(args.outfile, k), "w"), subsample_path(args.genobin_file, k),
+                    PhaseTimer())
+    return sub_ts.get_num_trees(), sub_ts.get_num_mutations()
+
+if len(args.subsample_sizes) > 0:
+    # samples are numbered by population, per_samples from each (or all in one)
+    populations = np.repeat(np.arange(len(pop_config)), per_samples) if width > 1 else np.zeros(nsamples)
+    subsets = nested_samples(populations, args.subsample_sizes)
+    with timer.phase("subsample"):
+        pool = multiprocessing.pool.ThreadPool(len(subsets))
+        subs = pool.starmap(write_subsample, zip(args.subsample_sizes, subsets))
+        pool.close()
+        pool.join()
+    for k, (ntrees, nmuts) in zip(args.subsample_sizes, subs):
+        logfile.write("Subset of {} samples: {} trees, {} mutations\n".format(k, ntrees, nmuts))
+
+logfile.write("Timing (seconds): {}\n".format(timer.summary()))
+if args.timing_file is not None:
+    with open(args.timing_file, "w") as f:
+        json.dump({'phases' : timer.phases}, f, indent=1)
+        f.write("\n")
 
-outfile.close()
 logfile.close()
 
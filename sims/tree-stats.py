@@ -1,63 +1,114 @@
 #!/usr/bin/env python3
 description = '''
-Compute mean divergence between populations in windows along the genome.
+Compute mean divergence (TMRCA) between populations, and other statistics of
+the trees, in windows along the genome.
+
+With --stats, any of: tmrca, diversity, fst, tajima_d, trees, breakpoints
+(see STATISTICS in pylostruct/treestats.py) are computed together, in the
+same pass, and written as one table, with columns in the order given.
+Diversity and Tajima's D are expected values for mutations at --mut_rate.
+
+Windows can be given at several resolutions at once: regularly spaced windows
+of each of the --window_size values, and/or the windows of lostruct
+regions.csv files (as written by run_lostruct.R); all are computed in one pass
+over the trees (see pylostruct/treestats.py).  With --njobs, the genome is
+split into that many pieces, swept in parallel, and the per-window sums added
+together.  If there is more than one set of windows, the first column of the
+output says which each row is from.
 '''
 
-import gzip, csv
+import csv
 import sys, os, math
-import msprime
 import argparse
+import multiprocessing
+
+import numpy as np
+import msprime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pylostruct.treestats import (STATISTICS, GenomeScan, WindowSums, population_sample_sets, regular_windows,
+                                  read_regions, sequence_length, sweep)
 
 parser = argparse.ArgumentParser(description=description)
-parser.add_argument('--treefile', '-t', type=str, 
+parser.add_argument('--treefile', '-t', type=str,
         help="Name of the tree sequence file output by msprime.")
-parser.add_argument('--window_size', '-w', type=float, 
-        help="Width of the (regularly spaced) windows.")
-parser.add_argument('--n_window', '-n', type=int, 
+parser.add_argument('--window_size', '-w', type=float, nargs="*", default=[],
+        help="Width(s) of the (regularly spaced) windows.")
+parser.add_argument('--n_window', '-n', type=int,
         help="Number of (regularly spaced) windows.")
-parser.add_argument('--outfile', '-o', type=str, 
+parser.add_argument('--regions', '-r', type=str, nargs="*", default=[],
+        help="lostruct regions.csv file(s) giving the windows (chrom, start, end).")
+parser.add_argument('--chrom', '-c', type=str,
+        help="Chromosome of the tree sequence in the regions files (needed if they have more than one).")
+parser.add_argument('--samples_file', '-s', type=str,
+        help="File of sample IDs and populations, as written by msprime's dump_samples_text() [default: populations from the tree sequence].")
+parser.add_argument('--stats', type=str, nargs="+", default=["tmrca"], choices=list(STATISTICS),
+        help="Statistics to compute [default: tmrca]: " + "; ".join(k + ": " + v for k, v in STATISTICS.items()))
+parser.add_argument('--mut_rate', '-u', type=float, default=1.0,
+        help="Mutation rate (per bp per generation) for diversity and Tajima's D [default: 1, i.e., in units of branch length].")
+parser.add_argument('--njobs', '-j', type=int, default=1,
+        help="Number of parallel jobs.")
+parser.add_argument('--outfile', '-o', type=str,
         help="Output file name.")
 
 args = parser.parse_args()
 
 ts = msprime.load(args.treefile)
+length = sequence_length(ts)
 
-pops = {}
-ids = {} # record msprime -> ftprime ID here (not used)
-
-for node_id in ts.samples():
-    node = ts.node(node_id)
-    pop = str(node.population)
-    if not pop in pops:
-        pops[pop] = []
-    pops[pop] += [node_id]
-
-leaf_sets = [list(map(int,u)) for u in pops.values()]
-pop_names = list(pops.keys())
+if args.samples_file is None:
+    pop_names, leaf_sets = population_sample_sets(ts)
+else:
+    samples = list(ts.samples())
+    pops = {}
+    with open(args.samples_file, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            pops.setdefault(row['population'], []).append(int(samples[int(row['ID'])]))
+    pop_names, leaf_sets = list(pops.keys()), list(pops.values())
 
 print('leaf sets:', leaf_sets)
 print('samples:', list(ts.samples()))
-print('ids:', list(ids.values()))
-
-output_names = ["_".join([pop_names[i],pop_names[j]]) for i in range(len(pop_names))
-                        for j in range(i,len(pop_names))]
 
 if args.n_window is not None:
-    if args.window_size is not None:
+    if len(args.window_size) > 0:
         raise ValueError("Can't specify both number of windows and window size.")
-    else:
-        args.window_size = ts.sequence_length / args.n_window
-else:
-    args.n_window = math.ceil(ts.sequence_length / args.window_size)
 
-windows = [args.window_size * k for k in range(args.n_window + 1)]
+if args.n_window is None and len(args.window_size) == 0 and len(args.regions) == 0:
+    raise ValueError("Must specify window sizes, number of windows, or regions files.")
+
+# each set of windows, and its label
+windows = [regular_windows(length, size) for size in args.window_size]
+labels = ["{:g}".format(size) for size in args.window_size]
+if args.n_window is not None:
+    windows.append(regular_windows(length, n=args.n_window))
+    labels.append("{:g}".format(length / args.n_window))
+for regions_file in args.regions:
+    windows.append(read_regions(regions_file, chrom=args.chrom))
+    labels.append(regions_file)
+
+scan = GenomeScan(pop_names, leaf_sets, args.stats, mut_rate=args.mut_rate)
 
-tmrcas = ts.get_mean_tmrca(leaf_sets, windows)
+def sweep_piece(k):
+    # the piece k of njobs equal pieces of the genome
+    return sweep(ts, leaf_sets, scan.summary, windows, left=length * k / args.njobs,
+                 right=length * (k + 1) / args.njobs)
+
+if args.njobs > 1:
+    pool = multiprocessing.Pool(args.njobs)
+    pieces = pool.map(sweep_piece, range(args.njobs))
+    pool.close()
+    pool.join()
+else:
+    pieces = [sweep_piece(0)]
+
+total = WindowSums(windows, len(scan.summary.names))
+for piece in pieces:
+    total.merge(piece)
 
 with open(args.outfile, "w", newline="") as outfile:
     writer = csv.writer(outfile, delimiter="\t")
-    writer.writerow(["start", "end"] + output_names)
-    for k in range(len(tmrcas)):
-        writer.writerow([windows[k], windows[k+1]] + tmrcas[k])
-
-outfile.close()
+    label_column = ["windows"] if len(windows) > 1 else []
+    writer.writerow(label_column + ["start", "end"] + scan.names)
+    for label, (starts, ends), values in zip(labels, windows, scan.table(total)):
+        for k in range(len(starts)):
+            writer.writerow(([label] if len(windows) > 1 else []) + [starts[k], ends[k]] + values[k].tolist())
@@ -4,7 +4,8 @@ if [ $# -lt 1 ]
 then
     echo "Usage:"
     echo "   $0 [vcf file [vcf file [...]]]"
-    echo "For each file on the command line, will convert to bcf and index it."
+    echo "For each file on the command line, will convert to bcf and index it;"
+    echo "bgzipped vcf files (e.g., .vcf.gz written by the simulation scripts) are just indexed."
 fi
 
 while (( "$#" )) 
@@ -12,6 +13,10 @@ do
     if [[ ! -e "$1" ]] 
     then 
         echo "File $1 does not exist."
+    elif [[ "$1" == *.vcf.gz ]]
+    then
+        echo "Indexing $1."
+        bcftools index $1
     else 
         OUT=${1%.vcf}.bcf
         echo "Converting $! to $OUT (and indexing)."